@@ -2,9 +2,9 @@ import os
 import math
 import discord
 from discord import app_commands, Interaction
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ui import Modal, TextInput
-from datetime import datetime
+from datetime import datetime, timedelta, time
 import asyncpg 
 from discord.ui import View, Button
 from discord.ui import View, Select
@@ -14,8 +14,16 @@ from discord import SelectOption, Interaction
 
 import aiohttp
 import io
-
-active_views = {}
+import csv
+import hashlib
+import difflib
+import asyncio
+import tempfile
+from contextlib import asynccontextmanager
+from PIL import Image, ImageDraw, ImageFont
+from currency import currency_to_copper, copper_to_currency, format_currency, format_currency_many
+from registry import ExpiringRegistry
+from cdn import AttachmentURLCache, is_stale
 
 print("discord.py version:", discord.__version__)
 
@@ -23,13 +31,21 @@ print("discord.py version:", discord.__version__)
 TOKEN = os.getenv("DISCORD_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Set by launcher.py when running more than one process. Each process owns the
+# shards listed in SHARD_IDS out of SHARD_COUNT; unset means one process that
+# lets discord.py pick the recommended shard count.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS").split(",")] if os.getenv("SHARD_IDS") else None
+
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.guilds = True
 intents.messages = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = commands.AutoShardedBot(command_prefix="!", intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
 db_pool: asyncpg.Pool = None
+# Stored image URLs expire; this swaps them for freshly signed ones before they are embedded
+attachment_urls = AttachmentURLCache(bot.http)
 
 # ---------- DB Helpers ----------
 
@@ -64,13 +80,414 @@ async def ensure_upload_channel1(guild: discord.Guild):
 
 
 
-async def add_item_db_bank(guild_id, upload_message_id, name, image=None, donated_by=None, qty=None, added_by=None, ):
+async def init_db(pool):
+    """Create the bookkeeping tables the bot maintains on top of inventory1/funds."""
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # Several shard processes may start at once
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('guildbank_init_db'))")
+
+            # Upload-log messages waiting to be deleted by upload_log_cleanup.
+            # channel_id NULL means the guild's guild-bank-upload-log.
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS upload_log_outbox (
+                    id BIGSERIAL PRIMARY KEY,
+                    guild_id BIGINT NOT NULL,
+                    channel_id BIGINT,
+                    message_id BIGINT NOT NULL,
+                    attempts INT NOT NULL DEFAULT 0,
+                    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            ''')
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS upload_log_outbox_due_idx ON upload_log_outbox (next_attempt_at)"
+            )
+            # Jobs past OUTBOX_MAX_ATTEMPTS stay as a record that the message was meant to go,
+            # so /recover_bank doesn't bring the item back
+            await conn.execute(
+                "ALTER TABLE upload_log_outbox ADD COLUMN IF NOT EXISTS gave_up BOOLEAN NOT NULL DEFAULT FALSE"
+            )
+
+            # Closing balance of each guild's funds ledger per day, written by snapshot_fund_balances
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS funds_snapshots (
+                    guild_id BIGINT NOT NULL,
+                    snapshot_date DATE NOT NULL,
+                    donated BIGINT NOT NULL,
+                    spent BIGINT NOT NULL,
+                    PRIMARY KEY (guild_id, snapshot_date)
+                )
+            ''')
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS funds_guild_donated_at_idx ON funds (guild_id, donated_at)"
+            )
+            # /funds_report buckets each type separately
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS funds_guild_type_donated_at_idx ON funds (guild_id, type, donated_at)"
+            )
+
+            # Bumped by every write to an item, for optimistic concurrency checks
+            await conn.execute("ALTER TABLE inventory1 ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 0")
+
+            # Stacking: identical item names (see normalize_item_name) share one
+            # inventory1 row with a real qty. Every donation is logged in
+            # inventory1_donations, and removals leave qty=0 rows as their record.
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS inventory1_donations (
+                    id BIGSERIAL PRIMARY KEY,
+                    guild_id BIGINT NOT NULL,
+                    item_id BIGINT,
+                    name TEXT NOT NULL,
+                    donated_by TEXT,
+                    added_by TEXT,
+                    qty INT NOT NULL DEFAULT 1,
+                    donated_at TIMESTAMP NOT NULL DEFAULT NOW()
+                )
+            ''')
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS inventory1_donations_guild_idx ON inventory1_donations (guild_id, donated_at)"
+            )
+            has_name_key = await conn.fetchval('''
+                SELECT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name='inventory1' AND column_name='name_key'
+                )
+            ''')
+            if not has_name_key:
+                await migrate_inventory_stacks(conn)
+            await conn.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS inventory1_stack_idx
+                ON inventory1 (guild_id, name_key) WHERE qty > 0
+            ''')
+
+            # Images already in guild-bank-upload-log, by content hash and dHash,
+            # so re-uploads of the same screenshot reuse the existing message
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS upload_log_images (
+                    guild_id BIGINT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    dhash BIGINT,
+                    message_id BIGINT NOT NULL,
+                    image_url TEXT NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (guild_id, sha256)
+                )
+            ''')
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS upload_log_images_message_idx ON upload_log_images (message_id)"
+            )
+            # Downscaled preview uploaded next to the original, shown by /view_bank
+            await conn.execute("ALTER TABLE inventory1 ADD COLUMN IF NOT EXISTS thumbnail TEXT")
+            await conn.execute("ALTER TABLE upload_log_images ADD COLUMN IF NOT EXISTS thumbnail_url TEXT")
+
+            # Upload-log messages can be shared by several items now
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS inventory1_upload_message_idx
+                ON inventory1 (upload_message_id) WHERE upload_message_id IS NOT NULL
+            ''')
+
+            # How far /recover_bank got in each upload-log channel
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS upload_log_recovery (
+                    guild_id BIGINT NOT NULL,
+                    channel_id BIGINT NOT NULL,
+                    last_message_id BIGINT NOT NULL,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (guild_id, channel_id)
+                )
+            ''')
+
+            # Scratch space for reconcile_upload_logs: message ids seen in an upload-log
+            # channel during the current scan. Rebuilt every run, so no WAL needed.
+            await conn.execute('''
+                CREATE UNLOGGED TABLE IF NOT EXISTS reconcile_seen (
+                    guild_id BIGINT NOT NULL,
+                    channel_id BIGINT NOT NULL,
+                    message_id BIGINT NOT NULL,
+                    PRIMARY KEY (guild_id, channel_id, message_id)
+                )
+            ''')
+            # Set by reconcile_upload_logs on rows whose upload-log message is gone
+            await conn.execute(
+                "ALTER TABLE inventory1 ADD COLUMN IF NOT EXISTS upload_missing BOOLEAN NOT NULL DEFAULT FALSE"
+            )
+            await conn.execute(
+                "ALTER TABLE IF EXISTS item_database ADD COLUMN IF NOT EXISTS upload_missing BOOLEAN NOT NULL DEFAULT FALSE"
+            )
+
+            # One-off data fixes that have been applied, by name
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    name TEXT PRIMARY KEY,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            ''')
+
+            # Zone, zone area and NPC dimensions for item_database (see DimensionCache)
+            zones_exist = await conn.fetchval("SELECT to_regclass('zones') IS NOT NULL")
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS zones (
+                    id SERIAL PRIMARY KEY,
+                    guild_id BIGINT NOT NULL,
+                    name TEXT NOT NULL,
+                    name_key TEXT NOT NULL,
+                    UNIQUE (guild_id, name_key)
+                )
+            ''')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS zone_areas (
+                    id SERIAL PRIMARY KEY,
+                    zone_id INT NOT NULL REFERENCES zones(id),
+                    name TEXT NOT NULL,
+                    name_key TEXT NOT NULL,
+                    UNIQUE (zone_id, name_key)
+                )
+            ''')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS npcs (
+                    id SERIAL PRIMARY KEY,
+                    guild_id BIGINT NOT NULL,
+                    name TEXT NOT NULL,
+                    name_key TEXT NOT NULL,
+                    UNIQUE (guild_id, name_key)
+                )
+            ''')
+            has_item_database = await conn.fetchval("SELECT to_regclass('item_database') IS NOT NULL")
+            renamed_npcs = False
+            if has_item_database:
+                await conn.execute("ALTER TABLE item_database ADD COLUMN IF NOT EXISTS zone_id INT REFERENCES zones(id)")
+                await conn.execute("ALTER TABLE item_database ADD COLUMN IF NOT EXISTS zone_area_id INT REFERENCES zone_areas(id)")
+                await conn.execute("ALTER TABLE item_database ADD COLUMN IF NOT EXISTS npc_id INT REFERENCES npcs(id)")
+                await conn.execute("CREATE INDEX IF NOT EXISTS item_database_zone_idx ON item_database (zone_id)")
+                await conn.execute("CREATE INDEX IF NOT EXISTS item_database_npc_idx ON item_database (npc_id)")
+                # item_slot split into an array Postgres keeps in step, for indexed slot lookups.
+                # Empty entries ("Ear, , Finger") are dropped, as split_item_slots does.
+                await conn.execute('''
+                    ALTER TABLE item_database ADD COLUMN IF NOT EXISTS item_slots TEXT[]
+                    GENERATED ALWAYS AS (
+                        array_remove(
+                            regexp_split_to_array(NULLIF(btrim(item_slot, ' ,'), ''), '[[:space:]]*,[[:space:]]*'),
+                            ''
+                        )
+                    ) STORED
+                ''')
+                await conn.execute("CREATE INDEX IF NOT EXISTS item_database_slots_idx ON item_database USING GIN (item_slots)")
+                if not zones_exist:
+                    await migrate_item_database_dimensions(conn)
+                # New entries already take the npcs spelling (DimensionCache.intern),
+                # so only rows from before that need rewriting, once
+                first_run = await conn.fetchval(
+                    "INSERT INTO schema_migrations (name) VALUES ('canonicalize_npc_names') "
+                    "ON CONFLICT DO NOTHING RETURNING TRUE"
+                )
+                if first_run:
+                    renamed_npcs = await canonicalize_npc_names(conn)
+
+            # Loot rollups over item_database, kept in step by ItemDatabaseModal
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS loot_zone_rollup (
+                    guild_id BIGINT NOT NULL,
+                    zone_name TEXT NOT NULL,
+                    item_name TEXT NOT NULL,
+                    drops INT NOT NULL,
+                    PRIMARY KEY (guild_id, zone_name, item_name)
+                )
+            ''')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS loot_slot_rollup (
+                    guild_id BIGINT NOT NULL,
+                    slot TEXT NOT NULL,
+                    npc_name TEXT NOT NULL,
+                    zone_name TEXT NOT NULL,
+                    items INT NOT NULL,
+                    PRIMARY KEY (guild_id, slot, npc_name, zone_name)
+                )
+            ''')
+            levels_exist = await conn.fetchval("SELECT to_regclass('loot_level_rollup') IS NOT NULL")
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS loot_level_rollup (
+                    guild_id BIGINT NOT NULL,
+                    level_band INT NOT NULL,
+                    slot TEXT NOT NULL,
+                    items INT NOT NULL,
+                    PRIMARY KEY (guild_id, level_band, slot)
+                )
+            ''')
+            # Rebuilt after the dimension migration too, it rewrites zone and NPC spellings
+            if has_item_database and (not levels_exist or not zones_exist or renamed_npcs):
+                await rebuild_loot_rollups(conn)
+
+            # Per-guild item counters, kept in step by add_item_db_bank and delete_item_db.
+            # total_donated counts donations, in_bank counts units.
+            counts_exist = await conn.fetchval("SELECT to_regclass('inventory1_counts') IS NOT NULL")
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS inventory1_counts (
+                    guild_id BIGINT PRIMARY KEY,
+                    total_donated BIGINT NOT NULL DEFAULT 0,
+                    in_bank BIGINT NOT NULL DEFAULT 0
+                )
+            ''')
+            if not counts_exist:
+                await conn.execute('''
+                    INSERT INTO inventory1_counts (guild_id, total_donated, in_bank)
+                    SELECT guild_id, SUM(donations), SUM(in_bank)
+                    FROM (
+                        SELECT guild_id, COUNT(*) AS donations, 0 AS in_bank
+                        FROM inventory1_donations GROUP BY guild_id
+                        UNION ALL
+                        SELECT guild_id, 0, SUM(qty)
+                        FROM inventory1 WHERE qty > 0 GROUP BY guild_id
+                    ) c
+                    GROUP BY guild_id
+                ''')
+
+            # Id of the /add_funds or /spend_funds interaction that opened the modal,
+            # so a resubmitted modal can't record the same entry twice
+            await conn.execute("ALTER TABLE funds ADD COLUMN IF NOT EXISTS idempotency_key BIGINT")
+            await conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS funds_idempotency_key_idx ON funds (idempotency_key)"
+            )
+
+
+def normalize_item_name(name):
+    """Stacking key for an item name: trimmed, single-spaced, lower case."""
+    return " ".join(name.split()).lower()
+
+
+async def migrate_inventory_stacks(conn):
+    """
+    One-time merge of the old one-row-per-item inventory into stacks.
+    Every existing row becomes a donation record, duplicates in the bank are
+    folded into their oldest row, and their upload-log images are queued for deletion.
+    """
+    await conn.execute("ALTER TABLE inventory1 ADD COLUMN name_key TEXT")
+    await conn.execute('''
+        UPDATE inventory1
+        SET name_key = lower(regexp_replace(btrim(name), '[[:space:]]+', ' ', 'g'))
+    ''')
+    await conn.execute('''
+        INSERT INTO inventory1_donations (guild_id, item_id, name, donated_by, added_by, qty, donated_at)
+        SELECT guild_id, id, name, donated_by, added_by, 1, COALESCE(created_at1, NOW())
+        FROM inventory1
+    ''')
+
+    await conn.execute('''
+        CREATE TEMP TABLE inventory1_merge ON COMMIT DROP AS
+        SELECT id, MIN(id) OVER w AS keep_id, SUM(qty) OVER w AS stack_qty
+        FROM inventory1
+        WHERE qty > 0
+        WINDOW w AS (PARTITION BY guild_id, name_key)
+    ''')
+    await conn.execute('''
+        UPDATE inventory1_donations d
+        SET item_id = m.keep_id
+        FROM inventory1_merge m
+        WHERE d.item_id = m.id AND m.id <> m.keep_id
+    ''')
+    await conn.execute('''
+        INSERT INTO upload_log_outbox (guild_id, message_id)
+        SELECT i.guild_id, i.upload_message_id
+        FROM inventory1 i
+        JOIN inventory1_merge m ON m.id = i.id
+        WHERE m.id <> m.keep_id AND i.upload_message_id IS NOT NULL
+    ''')
+    await conn.execute('''
+        UPDATE inventory1 i
+        SET qty = m.stack_qty
+        FROM inventory1_merge m
+        WHERE i.id = m.id AND m.id = m.keep_id
+    ''')
+    merged = await conn.execute('''
+        DELETE FROM inventory1 i
+        USING inventory1_merge m
+        WHERE i.id = m.id AND m.id <> m.keep_id
+    ''')
+    print(f"Inventory stacking migration: {merged}")
+
+
+async def add_item_db_bank(guild_id, upload_message_id, name, image=None, donated_by=None, qty=1, added_by=None, thumbnail=None):
+    """
+    Add `qty` units of an item. Stacks onto the guild's existing row with the
+    same normalized name if there is one; the new upload-log image is then not
+    needed and is queued for deletion. Returns (item_id, stacked).
+    """
     created_at1 = datetime.utcnow()
     async with db_pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO inventory1 (guild_id, upload_message_id, name, image, donated_by, qty, added_by, created_at1)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-        ''', guild_id, upload_message_id, name, image, donated_by, qty, added_by, created_at1)
+        async with conn.transaction():
+            row = await conn.fetchrow('''
+                INSERT INTO inventory1 (guild_id, upload_message_id, name, name_key, image, donated_by, qty, added_by, created_at1, thumbnail)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+                ON CONFLICT (guild_id, name_key) WHERE qty > 0
+                DO UPDATE SET qty = inventory1.qty + EXCLUDED.qty,
+                              version = inventory1.version + 1
+                RETURNING id, upload_message_id, (xmax <> 0) AS stacked
+            ''', guild_id, upload_message_id, name, normalize_item_name(name), image, donated_by, qty, added_by, created_at1, thumbnail)
+            if row['stacked'] and upload_message_id and row['upload_message_id'] != upload_message_id:
+                await queue_upload_log_delete(conn, guild_id, upload_message_id)
+            await conn.execute('''
+                INSERT INTO inventory1_donations (guild_id, item_id, name, donated_by, added_by, qty, donated_at)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ''', guild_id, row['id'], name, donated_by, added_by, qty, created_at1)
+            await conn.execute('''
+                INSERT INTO inventory1_counts (guild_id, total_donated, in_bank)
+                VALUES ($1, 1, $2)
+                ON CONFLICT (guild_id) DO UPDATE
+                SET total_donated = inventory1_counts.total_donated + 1,
+                    in_bank = inventory1_counts.in_bank + EXCLUDED.in_bank
+            ''', guild_id, qty)
+    return row['id'], row['stacked']
+
+
+async def get_item_counts(guild_id):
+    """Get (total donated, currently in bank) for a guild."""
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow(
+            "SELECT total_donated, in_bank FROM inventory1_counts WHERE guild_id=$1",
+            guild_id
+        )
+        if row is None:
+            # No counters row yet, count in a single pass
+            row = await conn.fetchrow('''
+                SELECT (SELECT COUNT(*) FROM inventory1_donations WHERE guild_id=$1) AS total_donated,
+                       (SELECT COALESCE(SUM(qty), 0) FROM inventory1 WHERE guild_id=$1 AND qty > 0) AS in_bank
+            ''', guild_id)
+    return row['total_donated'], row['in_bank']
+
+
+async def queue_upload_log_delete(conn, guild_id, message_id, channel_id=None):
+    """
+    Queue an upload-log message for deletion. Runs on the caller's connection so it commits with them.
+    Messages still used by another item in the bank are kept.
+    """
+    in_use = await conn.fetchval(
+        "SELECT EXISTS (SELECT 1 FROM inventory1 WHERE upload_message_id=$1 AND qty > 0)", message_id
+    )
+    if in_use:
+        return
+    await conn.execute("DELETE FROM upload_log_images WHERE message_id=$1", message_id)
+    await conn.execute('''
+        INSERT INTO upload_log_outbox (guild_id, channel_id, message_id)
+        VALUES ($1, $2, $3)
+    ''', guild_id, channel_id, message_id)
+
+
+# One lock per item that is being changed right now. Writers in this process
+# queue up here instead of all failing their version check at once; the
+# version column still catches writes from other shard processes.
+item_locks = {}  # item_id -> [lock, users]
+
+@asynccontextmanager
+async def item_lock(item_id):
+    entry = item_locks.setdefault(item_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del item_locks[item_id]
 
 
 async def get_all_items(guild_id):
@@ -80,21 +497,27 @@ async def get_all_items(guild_id):
 
 async def get_item_by_name(guild_id, name):
     async with db_pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT * FROM inventory1 WHERE guild_id=$1 AND name=$2", guild_id, name)
+        row = await conn.fetchrow(
+            "SELECT * FROM inventory1 WHERE guild_id=$1 AND name_key=$2 AND qty > 0",
+            guild_id, normalize_item_name(name)
+        )
     return row
 
-async def update_item_db(guild_id, item_id, **fields):
+async def update_item_db(guild_id, item_id, expected_version=None, **fields):
     """
     Update an item in the database.
-    Only updates the fields provided.
-    Automatically updates updated_at.
+    Only updates the fields provided and bumps the version.
+    With expected_version, only updates if nobody changed the item since it was read.
+    Returns True if the item was updated.
     """
     if not fields:
-        return  # nothing to update
+        return False  # nothing to update
 
     set_clauses = []
     values = []
     i = 1
+    if "name" in fields:
+        fields["name_key"] = normalize_item_name(fields["name"])
     for key, value in fields.items():
         set_clauses.append(f"{key}=${i}")
         values.append(value)
@@ -102,26 +525,67 @@ async def update_item_db(guild_id, item_id, **fields):
  
     values.append(guild_id)
     values.append(item_id)
+    set_clauses.append("version = version + 1")
+    where = f"guild_id=${i} AND id=${i+1}"
+    if expected_version is not None:
+        values.append(expected_version)
+        where += f" AND version=${i+2}"
 
     sql = f"""
         UPDATE inventory1
         SET {', '.join(set_clauses)}
-        WHERE guild_id=${i} AND id=${i+1}
+        WHERE {where}
     """
-    async with db_pool.acquire() as conn:
-        await conn.execute(sql, *values)
+    async with item_lock(item_id):
+        async with db_pool.acquire() as conn:
+            result = await conn.execute(sql, *values)
+    return result == "UPDATE 1"
 
 
 
-async def delete_item_db(guild_id, item_id):
-    # Reduce qty by 1
-    item = await db.fetch_one("SELECT qty FROM items WHERE guild_id=? AND id=?", (guild_id, item_id))
-    if not item:
-        return
-    if item['qty'] > 1:
-        await db.execute("UPDATE items SET qty = qty - 1 WHERE id = ?", (item_id,))
-    else:
-        await db.execute("DELETE FROM items WHERE id = ?", (item_id,))
+async def delete_item_db(guild_id, item_id, removed_by, removed_reason, upload_channel_id=None):
+    """
+    Take one unit out of a stack and return how many are left, or None if
+    there was nothing left to remove. Each removal leaves a qty=0 record for
+    the removal history; the last unit turns the stack row itself into that
+    record and queues its upload-log image for deletion.
+    """
+    async with item_lock(item_id), db_pool.acquire() as conn:
+        async with conn.transaction():
+            item = await conn.fetchrow('''
+                UPDATE inventory1
+                SET qty = qty - 1, version = version + 1
+                WHERE guild_id=$1 AND id=$2 AND qty > 0
+                RETURNING *
+            ''', guild_id, item_id)
+            if item is None:
+                return None
+
+            if item['qty'] > 0:
+                await conn.execute('''
+                    INSERT INTO inventory1 (guild_id, name, name_key, donated_by, added_by, created_at1,
+                                            qty, removed_by, removed_reason, removed_at)
+                    VALUES ($1, $2, $3, $4, $5, $6, 0, $7, $8, NOW())
+                ''', guild_id, item['name'], item['name_key'], item['donated_by'], item['added_by'],
+                    item['created_at1'], removed_by, removed_reason)
+            else:
+                await conn.execute('''
+                    UPDATE inventory1
+                    SET image=NULL,
+                        thumbnail=NULL,
+                        upload_message_id=NULL,
+                        removed_by=$2,
+                        removed_reason=$3,
+                        removed_at=NOW()
+                    WHERE id=$1
+                ''', item_id, removed_by, removed_reason)
+                if item['upload_message_id']:
+                    await queue_upload_log_delete(conn, guild_id, item['upload_message_id'], upload_channel_id)
+
+            await conn.execute(
+                "UPDATE inventory1_counts SET in_bank = in_bank - 1 WHERE guild_id=$1", guild_id
+            )
+    return item['qty']
 
 
 
@@ -129,10 +593,109 @@ async def delete_item_db(guild_id, item_id):
 
 # ---------- UI Components ----------
 
+# Modal text inputs hold at most 4000 characters
+HISTORY_TEXT_LIMIT = 3990
+
+
+def join_history_lines(lines, limit=HISTORY_TEXT_LIMIT):
+    """Join history lines, stopping at the first line that would go past `limit`."""
+    parts = []
+    size = 0
+    for line in lines:
+        if size + len(line) > limit:
+            parts.append("…")
+            break
+        parts.append(line)
+        size += len(line)
+    return "".join(parts)
+
+
 
 
 #-----IMAGE UPLOAD ----
 
+# dHashes this many bits apart or less are treated as the same picture
+DHASH_MAX_DISTANCE = 6
+
+def image_hashes(data):
+    """
+    Content hash and 64-bit difference hash of an image. CPU-bound, run it in a thread.
+    dHash is None if Pillow can't read the image.
+    """
+    sha256 = hashlib.sha256(data).hexdigest()
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            small = img.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
+    except Exception:
+        return sha256, None
+
+    pixels = list(small.getdata())
+    dhash = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            dhash = (dhash << 1) | (left > right)
+    # Store as a signed BIGINT
+    if dhash >= 1 << 63:
+        dhash -= 1 << 64
+    return sha256, dhash
+
+async def find_uploaded_image(guild_id, sha256, dhash):
+    """
+    Look an incoming image up in upload_log_images.
+    Returns (exact, similar_name): the index row with identical bytes, if any, and
+    the name of an item in the bank whose image looks the same, if any.
+    """
+    async with db_pool.acquire() as conn:
+        exact = await conn.fetchrow(
+            "SELECT message_id, image_url, thumbnail_url FROM upload_log_images WHERE guild_id=$1 AND sha256=$2",
+            guild_id, sha256
+        )
+        if exact:
+            similar_name = await conn.fetchval(
+                "SELECT name FROM inventory1 WHERE upload_message_id=$1 AND qty > 0 LIMIT 1",
+                exact['message_id']
+            )
+        elif dhash is not None:
+            # Hamming distance between the two hashes
+            similar_name = await conn.fetchval('''
+                SELECT i.name
+                FROM upload_log_images h
+                JOIN inventory1 i ON i.upload_message_id = h.message_id AND i.qty > 0
+                WHERE h.guild_id=$1
+                  AND h.dhash IS NOT NULL
+                  AND length(replace(((h.dhash # $2)::bit(64))::text, '0', '')) <= $3
+                LIMIT 1
+            ''', guild_id, dhash, DHASH_MAX_DISTANCE)
+        else:
+            similar_name = None
+    return exact, similar_name
+
+async def remember_uploaded_image(guild_id, sha256, dhash, message_id, image_url, thumbnail_url=None):
+    async with db_pool.acquire() as conn:
+        await conn.execute('''
+            INSERT INTO upload_log_images (guild_id, sha256, dhash, message_id, image_url, thumbnail_url)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            ON CONFLICT (guild_id, sha256) DO NOTHING
+        ''', guild_id, sha256, dhash, message_id, image_url, thumbnail_url)
+
+# Bank listings show this preview and link to the full image
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 70
+
+def make_thumbnail(data):
+    """Downscale and re-encode an image as a small JPEG. CPU-bound, run it in a thread. None if unreadable."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img = img.convert("RGB")
+            img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+            buf = io.BytesIO()
+            img.save(buf, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    except Exception:
+        return None
+    return buf.getvalue()
+
 class ImageDetailsModal(discord.ui.Modal):
     def __init__(self, interaction: discord.Interaction, image_url: str = None, item_row: dict = None):
         """
@@ -178,22 +741,46 @@ class ImageDetailsModal(discord.ui.Modal):
         # Ensure upload channel exists
         upload_channel = await ensure_upload_channel(modal_interaction.guild)
 
-        # Upload the image if provided
+        # Upload the image if provided, unless the same picture is already in the upload log
+        upload_message_id = None
+        warning = ""
         if self.image_url:
             async with aiohttp.ClientSession() as session:
                 async with session.get(self.image_url) as resp:
-                    if resp.status == 200:
-                        data = await resp.read()
-                        file = discord.File(io.BytesIO(data), filename=f"{item_name}.png")
-                        message = await upload_channel.send(content=f"Uploaded by {added_by}", file=file)
-                        self.image_url = message.attachments[0].url
-                    else:
+                    if resp.status != 200:
                         await modal_interaction.response.send_message(
                             "❌ Failed to download the image.", ephemeral=True
                         )
                         return
+                    data = await resp.read()
+
+            sha256, dhash = await asyncio.to_thread(image_hashes, data)
+            exact, similar_name = await find_uploaded_image(self.guild_id, sha256, dhash)
+            thumbnail_url = None
+            if similar_name and normalize_item_name(similar_name) != normalize_item_name(item_name):
+                warning = f"\n⚠️ This image looks like **{similar_name}**, which is already in the bank."
+
+            if exact:
+                upload_message_id = exact['message_id']
+                self.image_url = exact['image_url']
+                thumbnail_url = exact['thumbnail_url']
+            else:
+                # Original plus its preview in the same upload-log message
+                files = [discord.File(io.BytesIO(data), filename=f"{item_name}.png")]
+                thumb = await asyncio.to_thread(make_thumbnail, data)
+                if thumb:
+                    files.append(discord.File(io.BytesIO(thumb), filename=f"{item_name}_thumb.jpg"))
+                message = await upload_channel.send(content=f"Uploaded by {added_by}", files=files)
+                upload_message_id = message.id
+                self.image_url = message.attachments[0].url
+                if thumb:
+                    thumbnail_url = message.attachments[1].url
+                await remember_uploaded_image(
+                    self.guild_id, sha256, dhash, upload_message_id, self.image_url, thumbnail_url
+                )
         elif self.is_edit and self.item_row.get("image"):
             self.image_url = self.item_row["image"]
+            thumbnail_url = self.item_row.get("thumbnail")
         else:
             await modal_interaction.response.send_message(
                 "❌ No image provided. Please attach an image.", ephemeral=True
@@ -202,26 +789,43 @@ class ImageDetailsModal(discord.ui.Modal):
 
         # Save to database
         if self.is_edit:
-            await update_item_db(
-                guild_id=self.guild_id,
-                item_id=self.item_id,
-                name=item_name,
-                donated_by=donated_by,
-                image=self.image_url,
-                added_by=added_by
-            )
-            await modal_interaction.response.send_message(f"✅ Updated **{item_name}**.", ephemeral=True)
+            try:
+                updated = await update_item_db(
+                    guild_id=self.guild_id,
+                    item_id=self.item_id,
+                    expected_version=self.item_row.get('version'),
+                    name=item_name,
+                    donated_by=donated_by,
+                    image=self.image_url,
+                    thumbnail=thumbnail_url,
+                    added_by=added_by
+                )
+            except asyncpg.UniqueViolationError:
+                await modal_interaction.response.send_message(
+                    f"❌ The bank already has a **{item_name}** stack.", ephemeral=True
+                )
+                return
+            if not updated:
+                await modal_interaction.response.send_message(
+                    f"❌ **{item_name}** was changed by someone else. Reopen it and try again.", ephemeral=True
+                )
+                return
+            await modal_interaction.response.send_message(f"✅ Updated **{item_name}**.{warning}", ephemeral=True)
         else:
-            await add_item_db_bank(
+            _, stacked = await add_item_db_bank(
                 guild_id=self.guild_id,
                 name=item_name,
                 image=self.image_url,
+                thumbnail=thumbnail_url,
                 donated_by=donated_by,
                 qty=1,
                 added_by=added_by,
-                upload_message_id=message.id
+                upload_message_id=upload_message_id
             )
-            await modal_interaction.response.send_message(f"✅ Image item **{item_name}** added!", ephemeral=True)
+            if stacked:
+                await modal_interaction.response.send_message(f"✅ Added another **{item_name}** to its stack!{warning}", ephemeral=True)
+            else:
+                await modal_interaction.response.send_message(f"✅ Image item **{item_name}** added!{warning}", ephemeral=True)
 
 
 class EditItemModal(discord.ui.Modal):
@@ -263,14 +867,27 @@ class EditItemModal(discord.ui.Modal):
         added_by = str(modal_interaction.user)
 
         # Update DB without touching the image
-        await update_item_db(
-            guild_id=self.guild_id,
-            item_id=self.item_id,
-            name=item_name,
-            donated_by=donated_by,
-            image=self.item_row['image'],  # keep existing image
-            added_by=added_by
-        )
+        try:
+            updated = await update_item_db(
+                guild_id=self.guild_id,
+                item_id=self.item_id,
+                expected_version=self.item_row.get('version'),
+                name=item_name,
+                donated_by=donated_by,
+                image=self.item_row['image'],  # keep existing image
+                added_by=added_by
+            )
+        except asyncpg.UniqueViolationError:
+            await modal_interaction.response.send_message(
+                f"❌ The bank already has a **{item_name}** stack.", ephemeral=True
+            )
+            return
+        if not updated:
+            await modal_interaction.response.send_message(
+                f"❌ **{item_name}** was changed or removed by someone else. Reopen it and try again.",
+                ephemeral=True
+            )
+            return
 
         await modal_interaction.response.send_message(
             f"✅ Updated **{item_name}**.", ephemeral=True
@@ -288,17 +905,12 @@ class ItemHistoryModal(discord.ui.Modal):
         total_donated = len(items)
         total_text = str(total_donated)
 
-        # Build history string
-        history_text = ""
-        for i in items:
-            donor = i['donated_by'] or "Anonymous"
-            name = i['name']
-            date = i['created_at1'].strftime("%m-%d-%y") if i['created_at1'] else "Unknown"
-            history_text += f"{donor} | {name} | {date}\n"
-
-        # Truncate if too long
-        if len(history_text) > 4000:
-            history_text = history_text[:3990] + "\n…"
+        # Build history string, stops once it is too long
+        history_text = join_history_lines(
+            f"{i['donated_by'] or 'Anonymous'} | {i['name']} | "
+            f"{i['donated_at'].strftime('%m-%d-%y')}\n"
+            for i in items
+        )
 
         # Total Items Donated field
         self.total_input = discord.ui.TextInput(
@@ -332,7 +944,7 @@ class ItemHistoryButton(discord.ui.Button):
     async def callback(self, interaction: discord.Interaction):
         async with self.db_pool.acquire() as conn:
             items = await conn.fetch(
-                "SELECT name, donated_by, created_at1 FROM inventory1 WHERE guild_id=$1 ORDER BY created_at1 DESC",
+                "SELECT name, donated_by, donated_at FROM inventory1_donations WHERE guild_id=$1 ORDER BY donated_at DESC",
                 interaction.guild.id
             )
 
@@ -355,18 +967,12 @@ class RemovalHistoryModal(discord.ui.Modal):
         total_removed = len(items)
         total_text = str(total_removed)
 
-        # Build history string
-        history_text = ""
-        for i in items:
-            name = i['name']
-            removed_by = i['removed_by']
-            removed_reason = i['removed_reason']
-            date = i['removed_at'].strftime("%m-%d-%y") if i['removed_at'] else "Unknown"
-            history_text += f"{name} | {removed_by} | {date}\n {removed_reason} \n"
-
-        # Truncate if too long
-        if len(history_text) > 4000:
-            history_text = history_text[:3990] + "\n…"
+        # Build history string, stops once it is too long
+        history_text = join_history_lines(
+            f"{i['name']} | {i['removed_by']} | "
+            f"{i['removed_at'].strftime('%m-%d-%y') if i['removed_at'] else 'Unknown'}\n {i['removed_reason']} \n"
+            for i in items
+        )
 
         # Total Items Removed field
         self.total_input = discord.ui.TextInput(
@@ -432,40 +1038,29 @@ class RemoveItemModal(discord.ui.Modal):
 
     async def on_submit(self, interaction: discord.Interaction):
         try:
-            async with self.db_pool.acquire() as conn:
-                # 🔹 Try deleting uploaded image message if it exists
-                if self.item.get("upload_message_id"):
-                    upload_channel = discord.utils.get(
-                        interaction.guild.text_channels, name="guild-bank-upload-log"
-                    )
-                    if upload_channel:
-                        try:
-                            msg = await upload_channel.fetch_message(self.item["upload_message_id"])
-                            await msg.delete()
-                        except discord.NotFound:
-                            pass
-                        except Exception as e:
-                            print(f"Failed to delete uploaded image: {e}")
-
-                # 🔹 Update DB record
-                await conn.execute(
-                    """
-                    UPDATE inventory1
-                    SET image=NULL,
-                        upload_message_id=NULL,
-                        qty=0,
-                        removed_by=$2,
-                        removed_reason=$3,
-                        removed_at=NOW()
-                    WHERE id=$1
-                    """,
-                    self.item["id"],
-                    str(interaction.user),
-                    self.reason.value
+            upload_channel = discord.utils.get(
+                interaction.guild.text_channels, name="guild-bank-upload-log"
+            )
+            # 🔹 Takes one unit off the stack. The DB record, counters and the queued
+            # upload-log delete are written together; upload_log_cleanup removes
+            # the image later, so no Discord call holds the connection.
+            left = await delete_item_db(
+                self.item["guild_id"],
+                self.item["id"],
+                str(interaction.user),
+                self.reason.value,
+                upload_channel.id if upload_channel else None
+            )
+
+            if left is None:
+                await interaction.response.send_message(
+                    f"❌ **{self.item['name']}** was already removed.", ephemeral=True
                 )
+                return
 
             await interaction.response.send_message(
-                f"🗑️ **{self.item['name']}** was removed from the Guild Bank.\n"
+                f"🗑️ **{self.item['name']}** was removed from the Guild Bank"
+                + (f" ({left} left)" if left else "") + ".\n"
                 f"📝 Reason: {self.reason.value}",
                 ephemeral=True
             )
@@ -478,15 +1073,19 @@ class RemoveItemModal(discord.ui.Modal):
 
 
 
+# Stale links view_bank re-reads from their upload-log message, per command and at once.
+# Items past the limit keep the URL they have.
+STALE_FETCH_LIMIT = 25
+STALE_FETCH_CONCURRENCY = 5
 
 @bot.tree.command(name="view_bank", description="View all image items in the guild bank.")
 async def view_bank(interaction: discord.Interaction):
     guild_id = interaction.guild.id
 
-    # Fetch all items with qty=1 for this guild
+    # Fetch all stacks in the bank for this guild
     async with db_pool.acquire() as conn:
         items = await conn.fetch(
-            "SELECT name, image, donated_by FROM inventory1 WHERE guild_id=$1 AND qty=1 ORDER BY name ASC",
+            "SELECT name, image, thumbnail, upload_message_id, upload_missing, donated_by, qty FROM inventory1 WHERE guild_id=$1 AND qty > 0 ORDER BY name ASC",
             guild_id
         )
 
@@ -494,19 +1093,54 @@ async def view_bank(interaction: discord.Interaction):
         await interaction.response.send_message("The guild bank is empty.", ephemeral=True)
         return
 
+    await interaction.response.defer(ephemeral=True)
+
+    urls = await attachment_urls.refresh([u for item in items for u in (item["image"], item["thumbnail"])])
+
+    # Links the refresh endpoint couldn't renew are read back from their upload-log message
+    stale = [
+        item for item in items
+        if item["upload_message_id"] and not item["upload_missing"] and is_stale(urls.get(item["image"], ""))
+    ]
+    upload_channel = discord.utils.get(interaction.guild.text_channels, name="guild-bank-upload-log")
+    if stale and upload_channel:
+        if len(stale) > STALE_FETCH_LIMIT:
+            print(f"view_bank: {len(stale)} stale links in {interaction.guild.name}, re-reading {STALE_FETCH_LIMIT}")
+        semaphore = asyncio.Semaphore(STALE_FETCH_CONCURRENCY)
+
+        async def reread(item):
+            async with semaphore:
+                try:
+                    message = await upload_channel.fetch_message(item["upload_message_id"])
+                except discord.HTTPException:
+                    return
+            for attachment in message.attachments:
+                attachment_urls.remember(attachment.url)
+            for url in (item["image"], item["thumbnail"]):
+                if url:
+                    urls[url] = attachment_urls.get(url) or urls[url]
+
+        await asyncio.gather(*(reread(item) for item in stale[:STALE_FETCH_LIMIT]))
+
     embeds = []
     for item in items:
-        embed = discord.Embed()
-        embed.set_image(url=item["image"])
+        image = urls.get(item["image"], item["image"])
+        thumbnail = urls.get(item["thumbnail"]) if item["thumbnail"] else None
+        # Small preview inline, full size one click away
+        embed = discord.Embed(description=f"[Full size]({image})")
+        embed.set_image(url=thumbnail or image)
+        name = f"{item['name']} x{item['qty']}" if item["qty"] > 1 else item["name"]
         if item.get("donated_by"):
-            embed.set_footer(text=f"Donated by: {item['donated_by']} | {item['name']}")
+            embed.set_footer(text=f"Donated by: {item['donated_by']} | {name}")
+        else:
+            embed.set_footer(text=name)
         embeds.append(embed)
 
     # Discord limits to 10 embeds per message; send in chunks if needed
     for i in range(0, len(embeds), 10):
         await interaction.channel.send(embeds=embeds[i:i+10])
 
-    await interaction.response.send_message("✅ Guild bank items displayed.", ephemeral=True)
+    await interaction.followup.send("✅ Guild bank items displayed.", ephemeral=True)
 
 
 # ---------- /add_item Command ----------
@@ -544,9 +1178,9 @@ async def remove_item(interaction: discord.Interaction, item_name: str):
     # Fetch the full item from DB by name + guild
     async with db_pool.acquire() as conn:
         item_row = await conn.fetchrow(
-            "SELECT * FROM inventory1 WHERE guild_id=$1 AND name=$2 AND qty=1",
+            "SELECT * FROM inventory1 WHERE guild_id=$1 AND name_key=$2 AND qty > 0",
             guild_id,
-            item_name
+            normalize_item_name(item_name)
         )
 
     if not item_row:
@@ -568,18 +1202,8 @@ async def remove_item(interaction: discord.Interaction, item_name: str):
 async def view_itemhistory(interaction: discord.Interaction):
     guild_id = interaction.guild.id
 
-    async with db_pool.acquire() as conn:
-        # Total donated (all items ever)
-        total_donated = await conn.fetchval(
-            "SELECT COUNT(*) FROM inventory1 WHERE guild_id = $1;",
-            guild_id
-        )
-
-        # Total currently in bank
-        total_in_bank = await conn.fetchval(
-            "SELECT COUNT(*) FROM inventory1 WHERE guild_id = $1 AND qty = 1;",
-            guild_id
-        )
+    # Total donated (all items ever) and total currently in bank
+    total_donated, total_in_bank = await get_item_counts(guild_id)
 
     # Embed summary
     embed = discord.Embed(
@@ -611,56 +1235,174 @@ async def view_itemhistory(interaction: discord.Interaction):
 # ---------- Funds DB Helpers ----------
 
 
-# ----------------- Currency Helpers -----------------
-# Convert from 4-part currency to total copper
-def currency_to_copper(plat=0, gold=0, silver=0, copper=0):
-    # 1 Platinum = 100 Gold = 10,000 Silver = 1,000,000 Copper
-    # 1 Gold = 100 Silver = 10,000 Copper
-    # 1 Silver = 100 Copper
-    total_copper = (
-        plat * 100 * 100 * 100 +  # Plat to Copper
-        gold * 100 * 100 +        # Gold to Copper
-        silver * 100 +            # Silver to Copper
-        copper                     # Copper
-    )
-    return total_copper
+# ----------------- DB Helpers -----------------
+# History modals only show ~4000 characters, so never load more rows than fit
+HISTORY_ROW_LIMIT = 200
 
+# Keys submitted recently by this process. Retries inside the window are
+# answered from here; older ones still hit the unique index.
+FUNDS_DEDUPE_WINDOW = 15 * 60
+recent_fund_keys = ExpiringRegistry(ttl=FUNDS_DEDUPE_WINDOW, max_size=5000)
+# Largest single entry: a billion platinum, far inside BIGINT even summed over many rows
+MAX_FUNDS_COPPER = currency_to_copper(plat=10**9)
 
-# Convert total copper back to 4-part currency
-def copper_to_currency(total_copper):
-    plat = total_copper // (100*100*100)
-    remainder = total_copper % (100*100*100)
-    
-    gold = remainder // (100*100)
-    remainder = remainder % (100*100)
-    
-    silver = remainder // 100
-    copper = remainder % 100
-    
-    return plat, gold, silver, copper
-
+async def add_funds_db(guild_id, type, total_copper, donated_by=None, donated_at=None, idempotency_key=None):
+    """
+    Insert a donation or spend entry.
+    funds is an append-only ledger: balances come from funds_snapshots plus the
+    rows after the latest snapshot, so rows must never be edited or back-dated
+    into a day that already has a snapshot. Record corrections as new entries.
+    Returns False if an entry with the same idempotency_key was already recorded.
+    Raises ValueError if total_copper isn't between 1 and MAX_FUNDS_COPPER.
+    """
+    if not 0 < total_copper <= MAX_FUNDS_COPPER:
+        raise ValueError(f"Amount must be between 1c and {format_currency(MAX_FUNDS_COPPER)}")
+    if idempotency_key is not None:
+        if idempotency_key in recent_fund_keys:
+            return False
+        # Claim the key before awaiting so a concurrent retry sees it
+        recent_fund_keys.set(idempotency_key, True)
 
-# ----------------- DB Helpers -----------------
-async def add_funds_db(guild_id, type, total_copper, donated_by=None, donated_at=None):
-    """Insert a donation or spend entry."""
     donated_at = donated_at or datetime.utcnow()  # Use current time if not provided
+    try:
+        return await funds_batcher.submit(
+            (guild_id, type, total_copper, donated_by, donated_at, idempotency_key)
+        )
+    except Exception:
+        if idempotency_key is not None:
+            recent_fund_keys.pop(idempotency_key)
+        raise
+
+async def insert_funds_batch(entries):
+    """
+    Insert many funds rows in one statement and transaction.
+    `entries` are (guild_id, type, total_copper, donated_by, donated_at, idempotency_key)
+    tuples. Returns one bool per entry, False where the idempotency_key already existed.
+    """
+    values = ", ".join(
+        "(" + ", ".join(f"${i * 6 + j}" for j in range(1, 7)) + ")"
+        for i in range(len(entries))
+    )
+    args = [v for entry in entries for v in entry]
     async with db_pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO funds (guild_id, type, total_copper, donated_by, donated_at)
-            VALUES ($1, $2, $3, $4, $5)
-        ''', guild_id, type, total_copper, donated_by, donated_at)
+        rows = await conn.fetch(f'''
+            INSERT INTO funds (guild_id, type, total_copper, donated_by, donated_at, idempotency_key)
+            VALUES {values}
+            ON CONFLICT (idempotency_key) DO NOTHING
+            RETURNING idempotency_key
+        ''', *args)
+
+    inserted_keys = {r['idempotency_key'] for r in rows}
+    results = []
+    for entry in entries:
+        key = entry[5]
+        if key is None:
+            results.append(True)
+        else:
+            # Only the first entry with a key gets credit for the row
+            results.append(key in inserted_keys)
+            inserted_keys.discard(key)
+    return results
+
+
+class FundsBatcher:
+    """
+    Write-behind queue for funds inserts. Entries submitted within `max_delay`
+    seconds of each other are written together, up to `max_batch` per statement.
+    Each caller is only answered once its batch has committed, or gets the error.
+    """
 
-async def get_fund_totals(guild_id):
-    """Get total donated and spent copper."""
+    def __init__(self, max_batch=100, max_delay=0.005):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = None
+        self.task = None
+
+    async def submit(self, entry):
+        if self.task is None or self.task.done():
+            self.queue = self.queue or asyncio.Queue()
+            self.task = asyncio.create_task(self.run())
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((entry, future))
+        return await future
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            # Let the burst build up, then take what is waiting
+            await asyncio.sleep(self.max_delay)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            await self.flush(batch)
+
+    async def flush(self, batch):
+        try:
+            results = await insert_funds_batch([entry for entry, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                _, future = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            # One bad entry fails the whole statement; retry them one by one
+            # so only its own caller gets the error
+            print(f"Funds batch of {len(batch)} failed, inserting individually: {e}")
+            for item in batch:
+                await self.flush([item])
+            return
+        for (_, future), inserted in zip(batch, results):
+            if not future.done():
+                future.set_result(inserted)
+
+funds_batcher = FundsBatcher()
+
+async def get_fund_totals(guild_id, as_of=None):
+    """
+    Get total donated and spent copper, optionally as of a point in time.
+    Starts from the latest daily snapshot before `as_of` and only sums the
+    funds rows after it. A total is None if the guild has no rows of that type
+    and no snapshot, and 0 if a snapshot recorded none.
+    """
+    # Snapshot for day D covers everything before D+1 00:00
+    snapshot_cutoff = (as_of - timedelta(days=1)).date() if as_of else datetime.max.date()
     async with db_pool.acquire() as conn:
-        row = await conn.fetchrow('''
+        snap = await conn.fetchrow('''
+            SELECT snapshot_date, donated, spent
+            FROM funds_snapshots
+            WHERE guild_id=$1 AND snapshot_date <= $2
+            ORDER BY snapshot_date DESC
+            LIMIT 1
+        ''', guild_id, snapshot_cutoff)
+
+        tail_start = datetime.combine(snap['snapshot_date'] + timedelta(days=1), time.min) if snap else datetime.min
+        tail = await conn.fetchrow('''
             SELECT
-                SUM(CASE WHEN type='donation' THEN total_copper ELSE 0 END) AS donated,
-                SUM(CASE WHEN type='spend' THEN total_copper ELSE 0 END) AS spent
+                SUM(total_copper) FILTER (WHERE type='donation') AS donated,
+                SUM(total_copper) FILTER (WHERE type='spend') AS spent
             FROM funds
-            WHERE guild_id=$1
-        ''', guild_id)
-    return row
+            WHERE guild_id=$1 AND donated_at >= $2 AND donated_at < $3
+        ''', guild_id, tail_start, as_of or datetime.max)
+
+    if snap is None:
+        return {"donated": tail['donated'], "spent": tail['spent']}
+    return {
+        "donated": snap['donated'] + (tail['donated'] or 0),
+        "spent": snap['spent'] + (tail['spent'] or 0),
+    }
+
+async def get_fund_history(guild_id, type, limit=HISTORY_ROW_LIMIT):
+    """Get the total and the most recent entries of one type ('donation' or 'spend')."""
+    totals = await get_fund_totals(guild_id)
+    total = totals['donated' if type == 'donation' else 'spent'] or 0
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch('''
+            SELECT donated_by, total_copper, donated_at
+            FROM funds
+            WHERE guild_id=$1 AND type=$2
+            ORDER BY donated_at DESC
+            LIMIT $3
+        ''', guild_id, type, limit)
+    return total, rows
 
 async def get_all_donations(guild_id):
     """Get all donations (type='donation')"""
@@ -675,8 +1417,9 @@ async def get_all_donations(guild_id):
 
 # ----------------- Modals -----------------
 class AddFundsModal(Modal):
-    def __init__(self):
+    def __init__(self, idempotency_key):
         super().__init__(title="Add Donation")
+        self.idempotency_key = idempotency_key
         self.plat = TextInput(label="Platinum", default="0", required=False)
         self.gold = TextInput(label="Gold", default="0", required=False)
         self.silver = TextInput(label="Silver", default="0", required=False)
@@ -700,18 +1443,31 @@ class AddFundsModal(Modal):
             await interaction.response.send_message("❌ Invalid number entered.", ephemeral=True)
             return
 
-        await add_funds_db(
-            guild_id=interaction.guild.id,
-            type='donation',
-            total_copper=total,
-            donated_by=self.donated_by.value.strip() or None,
-            donated_at=datetime.utcnow()
-        )
+        try:
+            added = await add_funds_db(
+                guild_id=interaction.guild.id,
+                type='donation',
+                total_copper=total,
+                donated_by=self.donated_by.value.strip() or None,
+                donated_at=datetime.utcnow(),
+                idempotency_key=self.idempotency_key
+            )
+        except ValueError as e:
+            await interaction.response.send_message(f"❌ {e}.", ephemeral=True)
+            return
+        except Exception as e:
+            print(f"Error recording donation: {e}")
+            await interaction.response.send_message("❌ Couldn't record that, please try again.", ephemeral=True)
+            return
+        if not added:
+            await interaction.response.send_message("ℹ️ This donation was already recorded.", ephemeral=True)
+            return
         await interaction.response.send_message("✅ Donation added!", ephemeral=True)
 
 class SpendFundsModal(Modal):
-    def __init__(self):
+    def __init__(self, idempotency_key):
         super().__init__(title="Spend Funds")
+        self.idempotency_key = idempotency_key
         self.plat = TextInput(label="Platinum", default="0", required=False)
         self.gold = TextInput(label="Gold", default="0", required=False)
         self.silver = TextInput(label="Silver", default="0", required=False)
@@ -735,42 +1491,44 @@ class SpendFundsModal(Modal):
             await interaction.response.send_message("❌ Invalid number entered.", ephemeral=True)
             return
 
-        await add_funds_db(
-            guild_id=interaction.guild.id,
-            type='spend',
-            total_copper=total,
-            donated_by=self.note.value.strip() or None,
-            donated_at=datetime.utcnow()
-        )
+        try:
+            added = await add_funds_db(
+                guild_id=interaction.guild.id,
+                type='spend',
+                total_copper=total,
+                donated_by=self.note.value.strip() or None,
+                donated_at=datetime.utcnow(),
+                idempotency_key=self.idempotency_key
+            )
+        except ValueError as e:
+            await interaction.response.send_message(f"❌ {e}.", ephemeral=True)
+            return
+        except Exception as e:
+            print(f"Error recording spend: {e}")
+            await interaction.response.send_message("❌ Couldn't record that, please try again.", ephemeral=True)
+            return
+        if not added:
+            await interaction.response.send_message("ℹ️ This spending was already recorded.", ephemeral=True)
+            return
         await interaction.response.send_message("✅ Funds spent recorded!", ephemeral=True)
 
 
 # Modal to show full donation history
 
 class DonationHistoryModal(discord.ui.Modal):
-    def __init__(self, guild_id, donations):
+    def __init__(self, guild_id, donations, total_copper):
         super().__init__(title="📜 Full Donation History")
         self.guild_id = guild_id
         self.donations = donations
         
-        total_copper = sum(d['total_copper'] for d in donations)
-        t_plat, t_gold, t_silver, t_copper = copper_to_currency(total_copper)
-        total_text = f"{t_plat}p {t_gold}g {t_silver}s {t_copper}c"
+        total_text = format_currency(total_copper)
 
         # Combine all donations into one string
-      
-        history_text = ""
-      
-        for d in donations:
-            total_copper += d['total_copper']
-            plat, gold, silver, copper = copper_to_currency(d['total_copper'])
-            donor = d['donated_by'] or "Anonymous"
-            date = d['donated_at'].strftime("%m-%d-%y")
-            history_text += f"{donor} | {plat}p {gold}g {silver}s {copper}c | {date}\n"
-        
-        # Optional: truncate if too long
-        if len(history_text) > 4000:
-            history_text = history_text[:3990] + "\n…"
+        amounts = format_currency_many([d['total_copper'] for d in donations])
+        history_text = join_history_lines(
+            f"{d['donated_by'] or 'Anonymous'} | {amount} | {d['donated_at'].strftime('%m-%d-%y')}\n"
+            for d, amount in zip(donations, amounts)
+        )
         
         
         self.total_input = discord.ui.TextInput(
@@ -796,28 +1554,19 @@ class DonationHistoryModal(discord.ui.Modal):
         await interaction.response.send_message("✅ Closed.", ephemeral=True)
 
 class SpendingHistoryModal(discord.ui.Modal):
-    def __init__(self, guild_id, spendings):
+    def __init__(self, guild_id, spendings, total_copper):
         super().__init__(title="📜 Full Spending History")
         self.guild_id = guild_id
         self.spendings = spendings
         
-
-        total_copper = sum(s['total_copper'] for s in spendings)
-        t_plat, t_gold, t_silver, t_copper = copper_to_currency(total_copper)
-        total_text = f"{t_plat}p {t_gold}g {t_silver}s {t_copper}c"
+        total_text = format_currency(total_copper)
         
         # Combine all spendings into one string
-        history_text = ""
-        total_copper = 0
-        for s in spendings:
-            total_copper += s['total_copper']
-            plat, gold, silver, copper = copper_to_currency(s['total_copper'])
-            spender = s['donated_by'] or "Unknown"
-            date = s['donated_at'].strftime("%m-%d-%y")
-            history_text += f"{spender} | {plat}p {gold}g {silver}s {copper}c | {date}\n"
-
-        if len(history_text) > 4000:
-            history_text = history_text[:3990] + "\n…"
+        amounts = format_currency_many([s['total_copper'] for s in spendings])
+        history_text = join_history_lines(
+            f"{s['donated_by'] or 'Unknown'} | {amount} | {s['donated_at'].strftime('%m-%d-%y')}\n"
+            for s, amount in zip(spendings, amounts)
+        )
 
         self.total_input = discord.ui.TextInput(
             label="💰 Total Spending",
@@ -843,79 +1592,103 @@ class SpendingHistoryModal(discord.ui.Modal):
 
 
     # Button to view full history
+    # Persistent: the custom_id carries the guild, so the button keeps working
+    # after a restart and rows are only fetched when it is clicked.
 
-class ViewFullHistoryButton(discord.ui.Button):
-    def __init__(self, donations):
-        super().__init__(label="Donation History", style=discord.ButtonStyle.secondary)
-        self.donations = donations  # Already filtered by guild_id
+class ViewFullHistoryButton(discord.ui.DynamicItem[discord.ui.Button], template=r"funds:donations:(?P<guild_id>[0-9]+)"):
+    def __init__(self, guild_id: int):
+        super().__init__(discord.ui.Button(
+            label="Donation History",
+            style=discord.ButtonStyle.secondary,
+            custom_id=f"funds:donations:{guild_id}"
+        ))
+        self.guild_id = guild_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(int(match["guild_id"]))
 
     async def callback(self, interaction: discord.Interaction):
-        if not self.donations:
+        if interaction.guild is None or interaction.guild.id != self.guild_id:
+            await interaction.response.send_message("❌ This button belongs to another server.", ephemeral=True)
+            return
+
+        total_copper, donations = await get_fund_history(self.guild_id, 'donation')
+        if not donations:
             await interaction.response.send_message("No donations found for this guild.", ephemeral=True)
             return
 
-        modal = DonationHistoryModal(interaction.guild.id, self.donations)
+        modal = DonationHistoryModal(self.guild_id, donations, total_copper)
         await interaction.response.send_modal(modal)
 
 
-class ViewSpendingHistoryButton(discord.ui.Button):
-    def __init__(self, spendings):
-        super().__init__(label="Spending History", style=discord.ButtonStyle.secondary)
-        self.spendings = spendings  # Already filtered by guild_id
+class ViewSpendingHistoryButton(discord.ui.DynamicItem[discord.ui.Button], template=r"funds:spending:(?P<guild_id>[0-9]+)"):
+    def __init__(self, guild_id: int):
+        super().__init__(discord.ui.Button(
+            label="Spending History",
+            style=discord.ButtonStyle.secondary,
+            custom_id=f"funds:spending:{guild_id}"
+        ))
+        self.guild_id = guild_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(int(match["guild_id"]))
 
     async def callback(self, interaction: discord.Interaction):
-        if not self.spendings:
+        if interaction.guild is None or interaction.guild.id != self.guild_id:
+            await interaction.response.send_message("❌ This button belongs to another server.", ephemeral=True)
+            return
+
+        total_copper, spendings = await get_fund_history(self.guild_id, 'spend')
+        if not spendings:
             await interaction.response.send_message("No spending found for this guild.", ephemeral=True)
             return
 
-        modal = SpendingHistoryModal(interaction.guild.id, self.spendings)
+        modal = SpendingHistoryModal(self.guild_id, spendings, total_copper)
         await interaction.response.send_modal(modal)
 
 
+bot.add_dynamic_items(ViewFullHistoryButton, ViewSpendingHistoryButton)
+
+
 
 
 # ----------------- Slash Commands -----------------
 @bot.tree.command(name="add_funds", description="Add a donation to the guild bank.")
 async def add_funds(interaction: discord.Interaction):
-    await interaction.response.send_modal(AddFundsModal())
+    await interaction.response.send_modal(AddFundsModal(interaction.id))
 
 @bot.tree.command(name="spend_funds", description="Record spent guild funds.")
 async def spend_funds(interaction: discord.Interaction):
-    await interaction.response.send_modal(SpendFundsModal())
+    await interaction.response.send_modal(SpendFundsModal(interaction.id))
 
 @bot.tree.command(name="view_funds", description="View current available funds.")
-async def view_funds(interaction: discord.Interaction):
+@app_commands.describe(as_of="Show the balance at the end of this day instead (YYYY-MM-DD)")
+async def view_funds(interaction: discord.Interaction, as_of: str = None):
     guild_id = interaction.guild.id
 
-    async with db_pool.acquire() as conn:
-        all_donations = await conn.fetch('''
-            SELECT donated_by, total_copper, donated_at, guild_id
-            FROM funds
-            WHERE type='donation'
-            ORDER BY donated_at DESC
-        ''')
-        all_spendings = await conn.fetch('''
-            SELECT donated_by, total_copper, donated_at, guild_id
-            FROM funds
-            WHERE type='spend'
-            ORDER BY donated_at DESC
-        ''')
-
-    # Filter by current guild
-    donations = [d for d in all_donations if d['guild_id'] == guild_id]
-    spendings = [s for s in all_spendings if s['guild_id'] == guild_id]
+    as_of_time = None
+    if as_of:
+        try:
+            as_of_time = datetime.strptime(as_of.strip(), "%Y-%m-%d") + timedelta(days=1)
+        except ValueError:
+            await interaction.response.send_message("❌ Date must look like 2025-01-31.", ephemeral=True)
+            return
 
-    donated = sum(d['total_copper'] for d in donations)
-    spent = sum(s['total_copper'] for s in spendings)
+    totals = await get_fund_totals(guild_id, as_of=as_of_time)
+    donated = totals['donated'] or 0
+    spent = totals['spent'] or 0
     available = donated - spent
     plat, gold, silver, copper = copper_to_currency(available)
 
-    embed = discord.Embed(title="💰 Available Funds", color=discord.Color.gold())
+    title = f"💰 Available Funds (end of {as_of.strip()})" if as_of else "💰 Available Funds"
+    embed = discord.Embed(title=title, color=discord.Color.gold())
     embed.add_field(name="\u200b", value=f"{plat}p {gold}g {silver}s {copper}c")
 
-    view = discord.ui.View()
-    view.add_item(ViewFullHistoryButton(donations))
-    view.add_item(ViewSpendingHistoryButton(spendings))
+    view = discord.ui.View(timeout=None)
+    view.add_item(ViewFullHistoryButton(guild_id))
+    view.add_item(ViewSpendingHistoryButton(guild_id))
 
     await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
 
@@ -925,20 +1698,13 @@ async def view_funds(interaction: discord.Interaction):
 async def view_donations(interaction: discord.Interaction):
     guild_id = interaction.guild.id
 
-    async with db_pool.acquire() as conn:
-        donations = await conn.fetch('''
-            SELECT donated_by, total_copper, donated_at
-            FROM funds
-            WHERE type='donation' AND guild_id=$1
-            ORDER BY donated_at DESC
-        ''', guild_id)
-
-    if not donations:
+    totals = await get_fund_totals(guild_id)
+    # Totals are None from an empty SUM but 0 from a snapshot, so test both as falsy
+    if not totals['donated'] and not totals['spent']:
         await interaction.response.send_message("No donations found for this guild.", ephemeral=True)
         return
 
-    total_copper = sum(d['total_copper'] for d in donations)
-    t_plat, t_gold, t_silver, t_copper = copper_to_currency(total_copper)
+    t_plat, t_gold, t_silver, t_copper = copper_to_currency(totals['donated'] or 0)
 
     embed = discord.Embed(
         title="📜 Donation Records",
@@ -946,8 +1712,8 @@ async def view_donations(interaction: discord.Interaction):
         color=discord.Color.green()
     )
 
-    view = discord.ui.View()
-    view.add_item(ViewFullHistoryButton(donations))
+    view = discord.ui.View(timeout=None)
+    view.add_item(ViewFullHistoryButton(guild_id))
 
     await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
 
@@ -956,9 +1722,593 @@ async def view_donations(interaction: discord.Interaction):
 
 
 
+# ----------------- Funds Report -----------------
+
+async def get_funds_report(guild_id, period, periods):
+    """
+    Income and spend per `period` ('week' or 'month') for the last `periods`
+    periods, plus the top donors over the same window.
+    """
+    async with db_pool.acquire() as conn:
+        start = await conn.fetchval('''
+            SELECT date_trunc($1, NOW() AT TIME ZONE 'UTC') - ($2 - 1) * ('1 ' || $1)::interval
+        ''', period, periods)
+        rows = await conn.fetch('''
+            SELECT date_trunc($2, donated_at) AS bucket, type, SUM(total_copper) AS total
+            FROM funds
+            WHERE guild_id=$1 AND donated_at >= $3
+            GROUP BY bucket, type
+            ORDER BY bucket
+        ''', guild_id, period, start)
+        top_donors = await conn.fetch('''
+            SELECT COALESCE(donated_by, 'Anonymous') AS donor, SUM(total_copper) AS total
+            FROM funds
+            WHERE guild_id=$1 AND type='donation' AND donated_at >= $2
+            GROUP BY 1
+            ORDER BY total DESC
+            LIMIT 5
+        ''', guild_id, start)
+
+    # Fill in empty periods so the report has no gaps
+    buckets = {}
+    bucket = start
+    for _ in range(periods):
+        buckets[bucket] = [0, 0]
+        if period == "week":
+            bucket = bucket + timedelta(weeks=1)
+        else:
+            bucket = (bucket + timedelta(days=32)).replace(day=1)
+    for row in rows:
+        buckets.setdefault(row['bucket'], [0, 0])[0 if row['type'] == 'donation' else 1] += row['total']
+
+    return [(b, d, s) for b, (d, s) in sorted(buckets.items())], top_donors
+
+
+def render_funds_chart(buckets, title):
+    """
+    Draw income vs. spend bars per bucket on the misc background.
+    `buckets` is a list of (label, donated, spent) in copper. Returns PNG bytes.
+    """
+    background = Image.open("assets/backgrounds/bgmisc.png").convert("RGBA")
+    draw = ImageDraw.Draw(background)
+    font_title = ImageFont.truetype("assets/WinthorpeScB.ttf", 24)
+    font_label = ImageFont.truetype("assets/Winthorpe.ttf", 13)
+
+    width, height = background.size
+    left, right, top, bottom = 110, width - 30, 55, height - 40
+
+    draw.text((40, 12), title, fill=(255, 255, 255), font=font_title)
+    draw.line((left, bottom, right, bottom), fill=(200, 200, 200), width=1)
+
+    peak = max([max(d, s) for _, d, s in buckets] + [1])
+    slot = (right - left) / max(len(buckets), 1)
+    bar = max(int(slot * 0.35), 2)
+
+    for i, (label, donated, spent) in enumerate(buckets):
+        x = left + int(i * slot + slot * 0.15)
+        for offset, amount, color in ((0, donated, (90, 200, 110)), (bar, spent, (220, 90, 80))):
+            bar_height = int((bottom - top) * amount / peak)
+            if bar_height:
+                draw.rectangle((x + offset, bottom - bar_height, x + offset + bar - 1, bottom), fill=color)
+        draw.text((x, bottom + 6), label, fill=(255, 255, 255), font=font_label)
+
+    # Scale: the tallest bar in platinum
+    draw.text((left, top - 16), f"{peak // (100 * 100 * 100)}p", fill=(200, 200, 200), font=font_label)
+
+    buf = io.BytesIO()
+    background.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@bot.tree.command(name="funds_report", description="Income and spending per week or month.")
+@app_commands.describe(period="Group by week or month", periods="How many periods to show (1-12)", chart="Attach a chart")
+@app_commands.choices(period=[
+    app_commands.Choice(name="Week", value="week"),
+    app_commands.Choice(name="Month", value="month")
+])
+async def funds_report(interaction: discord.Interaction, period: str = "week", periods: app_commands.Range[int, 1, 12] = 8, chart: bool = False):
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
+    buckets, top_donors = await get_funds_report(interaction.guild.id, period, periods)
+
+    date_format = "%m-%d-%y" if period == "week" else "%b %Y"
+    donated = format_currency_many([d for _, d, _ in buckets])
+    spent = format_currency_many([s for _, _, s in buckets])
+    lines = [f"{b.strftime(date_format)} | +{d} | -{s}" for (b, _, _), d, s in zip(buckets, donated, spent)]
+
+    embed = discord.Embed(
+        title=f"📊 Funds per {period}",
+        description="```" + "\n".join(lines) + "```",
+        color=discord.Color.gold()
+    )
+    if top_donors:
+        embed.add_field(
+            name="🏆 Top Donors",
+            value="\n".join(f"{i}. {d['donor']} — {format_currency(d['total'])}" for i, d in enumerate(top_donors, 1)),
+            inline=False
+        )
+
+    if not chart:
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        return
+
+    label_format = "%m-%d" if period == "week" else "%b"
+    png = await asyncio.to_thread(
+        render_funds_chart,
+        [(b.strftime(label_format), d, s) for b, d, s in buckets],
+        f"Funds per {period}"
+    )
+    embed.set_image(url="attachment://funds_report.png")
+    await interaction.followup.send(
+        embed=embed,
+        file=discord.File(io.BytesIO(png), filename="funds_report.png"),
+        ephemeral=True
+    )
+
+
+# ----------------- CSV Exports -----------------
+# Rows are read through a server-side cursor and written in chunks, so memory
+# stays flat no matter how long the history is. Small exports stay in memory,
+# bigger ones spill to a temp file.
+EXPORT_CHUNK_ROWS = 2000
+EXPORT_SPOOL_SIZE = 4 * 1024 * 1024
+
+def write_csv_chunk(out, rows, convert=None):
+    """Encode one chunk of rows as CSV and append it to `out`. Runs in a worker thread."""
+    if convert:
+        rows = convert(rows)
+    text = io.StringIO()
+    csv.writer(text).writerows(rows)
+    out.write(text.getvalue().encode("utf-8"))
+
+async def export_csv(query, args, header, convert=None):
+    """Stream the rows of `query` into a CSV file. Returns (file, row_count), file rewound."""
+    out = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    row_count = 0
+    try:
+        await asyncio.to_thread(write_csv_chunk, out, [header])
+        async with db_pool.acquire() as conn:
+            # Cursors only live inside a transaction
+            async with conn.transaction():
+                cursor = await conn.cursor(query, *args)
+                while True:
+                    rows = await cursor.fetch(EXPORT_CHUNK_ROWS)
+                    if not rows:
+                        break
+                    await asyncio.to_thread(write_csv_chunk, out, rows, convert)
+                    row_count += len(rows)
+    except Exception:
+        out.close()
+        raise
+    out.seek(0)
+    return out, row_count
+
+async def send_export(interaction, out, row_count, filename):
+    with out:
+        out.seek(0, io.SEEK_END)
+        size = out.tell()
+        out.seek(0)
+        if row_count == 0:
+            await interaction.followup.send("❌ Nothing to export.", ephemeral=True)
+        elif size > interaction.guild.filesize_limit:
+            await interaction.followup.send(
+                f"❌ Export is {size // (1024 * 1024)} MB, over this server's upload limit.", ephemeral=True
+            )
+        else:
+            await interaction.followup.send(
+                f"📄 Exported {row_count} rows.",
+                file=discord.File(out, filename=filename),
+                ephemeral=True
+            )
+
+def funds_csv_rows(rows):
+    amounts = format_currency_many([r['total_copper'] for r in rows])
+    return [
+        (r['donated_at'].isoformat(), r['type'], r['donated_by'] or "", r['total_copper'], amount)
+        for r, amount in zip(rows, amounts)
+    ]
+
+@bot.tree.command(name="export_funds", description="Download the full funds history as CSV.")
+async def export_funds(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    out, row_count = await export_csv(
+        '''
+            SELECT donated_at, type, donated_by, total_copper
+            FROM funds
+            WHERE guild_id=$1
+            ORDER BY donated_at
+        ''',
+        (interaction.guild.id,),
+        ("date", "type", "by", "total_copper", "amount"),
+        convert=funds_csv_rows
+    )
+    await send_export(interaction, out, row_count, f"funds_{interaction.guild.id}.csv")
+
+@bot.tree.command(name="export_bank", description="Download the full guild bank item history as CSV.")
+async def export_bank(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    out, row_count = await export_csv(
+        '''
+            SELECT name, donated_by, added_by, created_at1, qty, removed_by, removed_reason, removed_at, image
+            FROM inventory1
+            WHERE guild_id=$1
+            ORDER BY id
+        ''',
+        (interaction.guild.id,),
+        ("name", "donated_by", "added_by", "added_at", "qty", "removed_by", "removed_reason", "removed_at", "image")
+    )
+    await send_export(interaction, out, row_count, f"bank_{interaction.guild.id}.csv")
+
+
+
+
+
+
+# ---------------- Zone / NPC Dimensions ----------------
+# zones, zone_areas and npcs hold one row per distinct name (per guild, or per
+# zone for areas). item_database rows point at them by id and keep the
+# canonical spelling in their text columns, so spelling drift doesn't split
+# rollups. Names share the normalized key used for bank items, and only an
+# exact key match is merged automatically; close spellings are offered to
+# the user as suggestions.
+
+# How close a spelling must be to a known name to be suggested as that name
+FUZZY_MATCH_CUTOFF = 0.88
+
+DIMENSION_KEY_SQL = "lower(regexp_replace(btrim({}), '[[:space:]]+', ' ', 'g'))"
+
+
+async def migrate_item_database_dimensions(conn):
+    """One-time fill of zones, zone_areas and npcs from item_database's text columns."""
+    zone_key = DIMENSION_KEY_SQL.format("zone_name")
+    area_key = DIMENSION_KEY_SQL.format("zone_area")
+    npc_key = DIMENSION_KEY_SQL.format("npc_name")
+    await conn.execute(f'''
+        INSERT INTO zones (guild_id, name, name_key)
+        SELECT DISTINCT ON (guild_id, {zone_key}) guild_id, btrim(zone_name), {zone_key}
+        FROM item_database
+        WHERE btrim(COALESCE(zone_name, '')) <> ''
+        ORDER BY guild_id, {zone_key}, zone_name
+    ''')
+    await conn.execute(f'''
+        UPDATE item_database d
+        SET zone_id = z.id, zone_name = z.name
+        FROM zones z
+        WHERE z.guild_id = d.guild_id AND z.name_key = {zone_key.replace("zone_name", "d.zone_name")}
+    ''')
+    await conn.execute(f'''
+        INSERT INTO zone_areas (zone_id, name, name_key)
+        SELECT DISTINCT ON (zone_id, {area_key}) zone_id, btrim(zone_area), {area_key}
+        FROM item_database
+        WHERE zone_id IS NOT NULL AND btrim(COALESCE(zone_area, '')) <> ''
+        ORDER BY zone_id, {area_key}, zone_area
+    ''')
+    await conn.execute(f'''
+        UPDATE item_database d
+        SET zone_area_id = a.id, zone_area = a.name
+        FROM zone_areas a
+        WHERE a.zone_id = d.zone_id AND a.name_key = {area_key.replace("zone_area", "d.zone_area")}
+    ''')
+    # npc_name text is rewritten by canonicalize_npc_names
+    await conn.execute(f'''
+        INSERT INTO npcs (guild_id, name, name_key)
+        SELECT DISTINCT ON (guild_id, {npc_key}) guild_id, btrim(npc_name), {npc_key}
+        FROM item_database
+        WHERE btrim(COALESCE(npc_name, '')) <> ''
+        ORDER BY guild_id, {npc_key}, npc_name
+    ''')
+    await conn.execute(f'''
+        UPDATE item_database d
+        SET npc_id = n.id
+        FROM npcs n
+        WHERE n.guild_id = d.guild_id AND n.name_key = {npc_key.replace("npc_name", "d.npc_name")}
+    ''')
+
+
+async def canonicalize_npc_names(conn):
+    """
+    Rewrite item_database.npc_name to its npcs row's spelling, so lookups by the
+    canonical name find the row. npc_name is part of item_database's unique key,
+    so an item recorded under two spellings of one NPC is left as is and reported.
+    Returns how many rows were rewritten.
+    """
+    status = await conn.execute('''
+        UPDATE item_database d
+        SET npc_name = n.name
+        FROM npcs n
+        WHERE n.id = d.npc_id AND d.npc_name IS DISTINCT FROM n.name
+          AND NOT EXISTS (
+              SELECT 1 FROM item_database o
+              WHERE o.guild_id = d.guild_id AND o.item_name = d.item_name
+                AND o.npc_id = d.npc_id AND o.ctid <> d.ctid
+          )
+    ''')
+    renamed = int(status.split()[-1])
+    conflicts = await conn.fetchval('''
+        SELECT COUNT(*) FROM item_database d JOIN npcs n ON n.id = d.npc_id
+        WHERE d.npc_name IS DISTINCT FROM n.name
+    ''')
+    if renamed or conflicts:
+        print(f"item_database: {renamed} NPC names made canonical, {conflicts} left (same item under two spellings)")
+    return renamed
+
+
+class DimensionCache:
+    """
+    In-memory name -> (id, canonical name) interning for zones, zone_areas and npcs,
+    one dict per (table, scope) loaded on first use. Names another process added
+    since are still found through the INSERT ... ON CONFLICT in `intern`.
+    """
+
+    # table -> column that scopes its names
+    SCOPES = {"zones": "guild_id", "zone_areas": "zone_id", "npcs": "guild_id"}
+
+    def __init__(self):
+        self._names = {}  # (table, scope_id) -> {name_key: (id, name)}
+
+    async def _load(self, conn, table, scope_id):
+        names = self._names.get((table, scope_id))
+        if names is None:
+            rows = await conn.fetch(
+                f"SELECT id, name, name_key FROM {table} WHERE {self.SCOPES[table]}=$1", scope_id
+            )
+            names = self._names[(table, scope_id)] = {r['name_key']: (r['id'], r['name']) for r in rows}
+        return names
+
+    async def match(self, conn, table, scope_id, name):
+        """(id, name) of the known name with the same normalized key as `name`, or None."""
+        names = await self._load(conn, table, scope_id)
+        return names.get(normalize_item_name(name))
+
+    async def suggest(self, conn, table, scope_id, name):
+        """(id, name) of a different known name `name` may be a misspelling of, or None."""
+        names = await self._load(conn, table, scope_id)
+        key = normalize_item_name(name)
+        if key in names:
+            return None
+        close = difflib.get_close_matches(key, list(names), n=1, cutoff=FUZZY_MATCH_CUTOFF)
+        return names[close[0]] if close else None
+
+    async def intern(self, conn, table, scope_id, name):
+        """
+        (id, canonical name) for `name`, adding it if no known name has its key. Run
+        outside any transaction that may roll back, or the cache could keep an id that doesn't exist.
+        """
+        found = await self.match(conn, table, scope_id, name)
+        if found:
+            return found
+        key = normalize_item_name(name)
+        row = await conn.fetchrow(f'''
+            INSERT INTO {table} ({self.SCOPES[table]}, name, name_key)
+            VALUES ($1, $2, $3)
+            ON CONFLICT ({self.SCOPES[table]}, name_key) DO UPDATE SET name = {table}.name
+            RETURNING id, name
+        ''', scope_id, name, key)
+        self._names[(table, scope_id)][key] = (row['id'], row['name'])
+        return row['id'], row['name']
+
+dimensions = DimensionCache()
+
+
+# ---------------- Loot Analytics ----------------
+
+# NPC levels are grouped in bands of this size, unknown levels go in band -1
+LOOT_LEVEL_BAND = 10
+UNKNOWN_LEVEL_BAND = -1
+
+
+def split_item_slots(item_slot):
+    return [s.strip() for s in (item_slot or "").split(",") if s.strip()]
+
+
+async def find_items_by_slot(guild_id, slots, match_all=False):
+    """
+    item_database rows for any of `slots` (all of them with match_all),
+    answered from the GIN index on item_slots.
+    """
+    operator = "@>" if match_all else "&&"
+    async with db_pool.acquire() as conn:
+        return await conn.fetch(f'''
+            SELECT item_name, npc_name, zone_name, item_slot, npc_level
+            FROM item_database
+            WHERE guild_id=$1 AND item_slots {operator} $2::text[]
+            ORDER BY item_name, npc_name
+        ''', guild_id, [s.strip().title() for s in slots])
+
+def level_band(npc_level):
+    if npc_level is None:
+        return UNKNOWN_LEVEL_BAND
+    return npc_level // LOOT_LEVEL_BAND * LOOT_LEVEL_BAND
+
+
+async def rebuild_loot_rollups(conn):
+    """Recompute every loot rollup from item_database."""
+    await conn.execute("TRUNCATE loot_zone_rollup, loot_slot_rollup, loot_level_rollup")
+    await conn.execute('''
+        INSERT INTO loot_zone_rollup (guild_id, zone_name, item_name, drops)
+        SELECT guild_id, COALESCE(zone_name, ''), item_name, COUNT(*)
+        FROM item_database
+        GROUP BY 1, 2, 3
+    ''')
+    await conn.execute('''
+        INSERT INTO loot_slot_rollup (guild_id, slot, npc_name, zone_name, items)
+        SELECT d.guild_id, s.slot, COALESCE(d.npc_name, ''), COALESCE(d.zone_name, ''), COUNT(*)
+        FROM item_database d,
+             LATERAL (SELECT DISTINCT unnest(d.item_slots) AS slot) s
+        GROUP BY 1, 2, 3, 4
+    ''')
+    await conn.execute('''
+        INSERT INTO loot_level_rollup (guild_id, level_band, slot, items)
+        SELECT d.guild_id,
+               CASE WHEN d.npc_level IS NULL THEN $1 ELSE d.npc_level / $2 * $2 END,
+               s.slot, COUNT(*)
+        FROM item_database d,
+             LATERAL (SELECT DISTINCT unnest(d.item_slots) AS slot) s
+        GROUP BY 1, 2, 3
+    ''', UNKNOWN_LEVEL_BAND, LOOT_LEVEL_BAND)
+
+
+async def apply_loot_rollups(conn, row, sign):
+    """Count one item_database row into the rollups (sign=1) or out of them (sign=-1)."""
+    guild_id = row['guild_id']
+    zone_name = row['zone_name'] or ""
+    npc_name = row['npc_name'] or ""
+    slots = sorted(set(split_item_slots(row['item_slot'])))
+    band = level_band(row['npc_level'])
+
+    await conn.execute('''
+        INSERT INTO loot_zone_rollup (guild_id, zone_name, item_name, drops)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (guild_id, zone_name, item_name) DO UPDATE
+        SET drops = loot_zone_rollup.drops + EXCLUDED.drops
+    ''', guild_id, zone_name, row['item_name'], sign)
+    if slots:
+        await conn.executemany('''
+            INSERT INTO loot_slot_rollup (guild_id, slot, npc_name, zone_name, items)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (guild_id, slot, npc_name, zone_name) DO UPDATE
+            SET items = loot_slot_rollup.items + EXCLUDED.items
+        ''', [(guild_id, slot, npc_name, zone_name, sign) for slot in slots])
+        await conn.executemany('''
+            INSERT INTO loot_level_rollup (guild_id, level_band, slot, items)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (guild_id, level_band, slot) DO UPDATE
+            SET items = loot_level_rollup.items + EXCLUDED.items
+        ''', [(guild_id, band, slot, sign) for slot in slots])
+
+    if sign < 0:
+        await conn.execute("DELETE FROM loot_zone_rollup WHERE guild_id=$1 AND zone_name=$2 AND drops <= 0", guild_id, zone_name)
+        await conn.execute("DELETE FROM loot_slot_rollup WHERE guild_id=$1 AND slot = ANY($2::text[]) AND items <= 0", guild_id, slots)
+        await conn.execute("DELETE FROM loot_level_rollup WHERE guild_id=$1 AND level_band=$2 AND items <= 0", guild_id, band)
+
+
+def band_label(band):
+    return "Unknown" if band == UNKNOWN_LEVEL_BAND else f"{band}-{band + LOOT_LEVEL_BAND - 1}"
+
+
+@bot.tree.command(name="loot_zone", description="What drops in a zone.")
+@app_commands.describe(zone="Zone name, e.g. Shaded Dunes")
+async def loot_zone(interaction: discord.Interaction, zone: str):
+    zone_name = zone.strip().title()
+    async with db_pool.acquire() as conn:
+        known = await dimensions.match(conn, "zones", interaction.guild.id, zone_name)
+        if known:
+            zone_name = known[1]
+        suggestion = None if known else await dimensions.suggest(conn, "zones", interaction.guild.id, zone_name)
+        rows = await conn.fetch('''
+            SELECT item_name, drops FROM loot_zone_rollup
+            WHERE guild_id=$1 AND zone_name=$2
+            ORDER BY item_name
+        ''', interaction.guild.id, zone_name)
+
+    if not rows:
+        await interaction.response.send_message(
+            f"No drops recorded in **{zone_name}**."
+            + (f" Did you mean **{suggestion[1]}**?" if suggestion else ""),
+            ephemeral=True
+        )
+        return
+
+    embed = discord.Embed(
+        title=f"🗺️ Drops in {zone_name}",
+        description=join_history_lines(
+            f"{r['item_name']}" + (f" ({r['drops']} NPCs)" if r['drops'] > 1 else "") + "\n" for r in rows
+        ),
+        color=discord.Color.green()
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+@bot.tree.command(name="loot_slot", description="Which NPCs drop items for a slot.")
+@app_commands.describe(slot="Item slot, e.g. Finger")
+async def loot_slot(interaction: discord.Interaction, slot: str):
+    slot_name = slot.strip().title()
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch('''
+            SELECT npc_name, zone_name, items FROM loot_slot_rollup
+            WHERE guild_id=$1 AND slot=$2
+            ORDER BY items DESC, npc_name
+        ''', interaction.guild.id, slot_name)
+
+    if not rows:
+        await interaction.response.send_message(f"No NPCs recorded dropping **{slot_name}** items.", ephemeral=True)
+        return
+
+    embed = discord.Embed(
+        title=f"👹 NPCs dropping {slot_name} items",
+        description=join_history_lines(
+            f"{r['npc_name'] or 'Unknown'} | {r['zone_name'] or 'Unknown'} | {r['items']}\n" for r in rows
+        ),
+        color=discord.Color.green()
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+@bot.tree.command(name="slot_items", description="Items recorded for one or more slots.")
+@app_commands.describe(slots="Slots separated by commas, e.g. Finger, Wrist", match_all="Only items that fit every slot listed")
+async def slot_items(interaction: discord.Interaction, slots: str, match_all: bool = False):
+    wanted = split_item_slots(slots)
+    if not wanted:
+        await interaction.response.send_message("⚠️ Give at least one slot.", ephemeral=True)
+        return
+    rows = await find_items_by_slot(interaction.guild.id, wanted, match_all)
+    label = (" + " if match_all else " / ").join(s.title() for s in wanted)
+
+    if not rows:
+        await interaction.response.send_message(f"No items recorded for **{label}**.", ephemeral=True)
+        return
+
+    embed = discord.Embed(
+        title=f"🧤 {label} items",
+        description=join_history_lines(
+            f"{r['item_name']} | {r['item_slot']} | {r['npc_name'] or 'Unknown'} | {r['zone_name'] or 'Unknown'}\n"
+            for r in rows
+        ),
+        color=discord.Color.green()
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+@bot.tree.command(name="loot_levels", description="Loot table by NPC level band.")
+@app_commands.describe(slot="Only count items for this slot")
+async def loot_levels(interaction: discord.Interaction, slot: str = None):
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch('''
+            SELECT level_band, slot, items FROM loot_level_rollup
+            WHERE guild_id=$1 AND ($2::text IS NULL OR slot=$2)
+            ORDER BY level_band, items DESC, slot
+        ''', interaction.guild.id, slot.strip().title() if slot else None)
+
+    if not rows:
+        await interaction.response.send_message("No loot recorded yet.", ephemeral=True)
+        return
+
+    bands = {}
+    for r in rows:
+        bands.setdefault(r['level_band'], []).append(f"{r['slot']} {r['items']}")
+    embed = discord.Embed(
+        title="📊 Loot by NPC level" + (f" ({slot.strip().title()})" if slot else ""),
+        description=join_history_lines(
+            f"Lv {band_label(band)}: {', '.join(entries)}\n" for band, entries in bands.items()
+        ),
+        color=discord.Color.green()
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+# ---------------- /add_item_db ----------------
+
+# Attachments of /add_item_db commands whose modal is still open, keyed by the
+# command's interaction id. Only the Attachment references are kept; nothing is
+# downloaded or uploaded until the modal is submitted.
+STAGING_TTL = 15 * 60
+staged_uploads = ExpiringRegistry(ttl=STAGING_TTL, max_size=500)
+
+
 class ItemDatabaseModal(discord.ui.Modal, title="Add Item to Database"):
-    def __init__(self, db_pool, guild_id, added_by, item_image_url=None, npc_image_url=None, item_slot=None, item_msg_id=None, npc_msg_id=None):
-        super().__init__(timeout=None)
+    def __init__(self, db_pool, guild_id, added_by, item_image_url=None, npc_image_url=None, item_slot=None, item_msg_id=None, npc_msg_id=None, staging_key=None):
+        # Staged uploads are dropped once the modal times out
+        super().__init__(timeout=STAGING_TTL if staging_key else None)
         self.db_pool = db_pool
         self.guild_id = guild_id
         self.added_by = added_by
@@ -966,6 +2316,7 @@ class ItemDatabaseModal(discord.ui.Modal, title="Add Item to Database"):
         self.npc_image_url = npc_image_url
         self.item_msg_id = item_msg_id
         self.npc_msg_id = npc_msg_id
+        self.staging_key = staging_key
 
         # Fields
         self.item_name = discord.ui.TextInput(label="Item Name", placeholder="Example: Flowing Black Silk Sash")
@@ -989,8 +2340,34 @@ class ItemDatabaseModal(discord.ui.Modal, title="Add Item to Database"):
         self.add_item(self.npc_name)
         self.add_item(self.npc_level)
         self.add_item(self.item_slot_field)
-        
 
+    async def on_timeout(self):
+        if self.staging_key:
+            staged_uploads.pop(self.staging_key)
+
+    async def upload_staged(self, interaction):
+        """
+        Upload the staged item and NPC images as one upload-log message, item
+        image first. Returns False if they expired.
+        """
+        staged = staged_uploads.pop(self.staging_key)
+        if staged is None:
+            return False
+        upload_channel, item_file, npc_file = await asyncio.gather(
+            ensure_upload_channel1(interaction.guild),
+            staged["item"].to_file(),
+            staged["npc"].to_file(),
+        )
+        msg = await upload_channel.send(
+            files=[item_file, npc_file],
+            content=f"📦👹 Uploaded item and NPC images by {interaction.user.mention}"
+        )
+        self.upload_channel_id = upload_channel.id
+        self.item_image_url = msg.attachments[0].url
+        self.npc_image_url = msg.attachments[1].url
+        self.item_msg_id = msg.id
+        self.npc_msg_id = msg.id
+        return True
 
     async def on_submit(self, interaction: discord.Interaction):
          # 🧹 Clean and title-case all text inputs
@@ -1016,17 +2393,82 @@ class ItemDatabaseModal(discord.ui.Modal, title="Add Item to Database"):
             except ValueError:
                 await interaction.response.send_message("⚠️ NPC Level must be a number.", ephemeral=True)
                 return
+
+        # Uploads can take longer than the 3 second response window
+        await interaction.response.defer(ephemeral=True, thinking=True)
+
+        if self.staging_key:
+            try:
+                if not await self.upload_staged(interaction):
+                    await interaction.followup.send("❌ This entry expired. Run /add_item_db again.", ephemeral=True)
+                    return
+            except discord.Forbidden:
+                await interaction.followup.send("❌ I don't have permission to upload files here.", ephemeral=True)
+                return
+            except Exception as e:
+                await interaction.followup.send(f"❌ Upload failed: {e}", ephemeral=True)
+                return
+
+        values = dict(
+            item_name=item_name, zone_name=zone_name, zone_area=zone_area,
+            npc_name=npc_name, item_slot=item_slot, npc_level_value=npc_level_value
+        )
+        # Close but not identical to a known zone / area / NPC: let the user pick
+        suggestions = await self.name_suggestions(zone_name, zone_area, npc_name)
+        if suggestions:
+            await interaction.followup.send(
+                "🤔 Some names look like ones already recorded:\n"
+                + "\n".join(f"{label}: `{typed}` → `{known}`?" for label, _, typed, known in suggestions),
+                view=NameSuggestionView(self, interaction, values, suggestions),
+                ephemeral=True
+            )
+            return
+        await self.save(interaction, **values)
+
+    async def name_suggestions(self, zone_name, zone_area, npc_name):
+        """(label, field, typed, known name) for each name that is close to, but not, a known one."""
+        suggestions = []
+        async with self.db_pool.acquire() as conn:
+            if zone_name:
+                zone = await dimensions.match(conn, "zones", self.guild_id, zone_name)
+                if zone is None:
+                    close = await dimensions.suggest(conn, "zones", self.guild_id, zone_name)
+                    if close:
+                        suggestions.append(("Zone", "zone_name", zone_name, close[1]))
+                elif zone_area:
+                    close = await dimensions.suggest(conn, "zone_areas", zone[0], zone_area)
+                    if close:
+                        suggestions.append(("Area", "zone_area", zone_area, close[1]))
+            if npc_name:
+                close = await dimensions.suggest(conn, "npcs", self.guild_id, npc_name)
+                if close:
+                    suggestions.append(("NPC", "npc_name", npc_name, close[1]))
+        return suggestions
+
+    async def save(self, interaction, item_name, zone_name, zone_area, npc_name, item_slot, npc_level_value):
+        """Insert the entry, or offer to update it if the item is already recorded for this NPC."""
+        # Resolve names to their zone / area / NPC rows; same-key names take the stored spelling
+        zone_id = zone_area_id = npc_id = None
+        async with self.db_pool.acquire() as conn:
+            if zone_name:
+                zone_id, zone_name = await dimensions.intern(conn, "zones", self.guild_id, zone_name)
+                if zone_area:
+                    zone_area_id, zone_area = await dimensions.intern(conn, "zone_areas", zone_id, zone_area)
+            if npc_name:
+                npc_id, npc_name = await dimensions.intern(conn, "npcs", self.guild_id, npc_name)
     
         # Insert into DB
         try:
-            async with self.db_pool.acquire() as conn:
-                await conn.execute("""
+            async with self.db_pool.acquire() as conn, conn.transaction():
+                row = await conn.fetchrow("""
                     INSERT INTO item_database (
                         guild_id, item_name, zone_name, zone_area,
                         npc_name, item_slot, npc_level,
-                        item_image, npc_image, item_msg_id, npc_msg_id, added_by, created_at
+                        item_image, npc_image, item_msg_id, npc_msg_id, added_by, created_at,
+                        zone_id, zone_area_id, npc_id
                     )
-                    VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12,NOW())
+                    VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12,NOW(),$13,$14,$15)
+                    RETURNING guild_id, item_name, zone_name, npc_name, item_slot, npc_level
                 """,
                 self.guild_id,
                 item_name,
@@ -1039,11 +2481,16 @@ class ItemDatabaseModal(discord.ui.Modal, title="Add Item to Database"):
                 self.npc_image_url,
                 self.item_msg_id,
                 self.npc_msg_id,                  
-                self.added_by)
+                self.added_by,
+                zone_id,
+                zone_area_id,
+                npc_id)
+                await apply_loot_rollups(conn, row, 1)
     
             # Confirmation
-            await interaction.response.send_message(
-                f"✅ `{item_name}` added successfully!",
+            await interaction.followup.send(
+                f"✅ `{item_name}` added successfully! ({npc_name}, {zone_name}"
+                + (f" - {zone_area}" if zone_area else "") + ")",
                 ephemeral=True
             )
     
@@ -1051,7 +2498,8 @@ class ItemDatabaseModal(discord.ui.Modal, title="Add Item to Database"):
             # ⚠️ Already exists — ask if they want to update
             class ConfirmUpdateView(discord.ui.View):
                 def __init__(self, db_pool, guild_id, item_name, npc_name, zone_name, zone_area,
-                             item_slot, npc_level_value, item_image_url, npc_image_url, item_msg_id, npc_msg_id, added_by):
+                             item_slot, npc_level_value, item_image_url, npc_image_url, item_msg_id, npc_msg_id, added_by,
+                             dimension_ids=(None, None, None)):
                     super().__init__(timeout=None)
                     self.db_pool = db_pool
                     self.guild_id = guild_id
@@ -1066,16 +2514,25 @@ class ItemDatabaseModal(discord.ui.Modal, title="Add Item to Database"):
                     self.item_msg_id = item_msg_id
                     self.npc_msg_id = npc_msg_id
                     self.added_by = added_by
+                    self.zone_id, self.zone_area_id, self.npc_id = dimension_ids
     
                 @discord.ui.button(label="✅ Update Existing", style=discord.ButtonStyle.green)
                 async def confirm(self, interaction2: discord.Interaction, button: discord.ui.Button):
-                    async with self.db_pool.acquire() as conn:
-                        await conn.execute("""
+                    async with self.db_pool.acquire() as conn, conn.transaction():
+                        old = await conn.fetchrow("""
+                            SELECT guild_id, item_name, zone_name, npc_name, item_slot, npc_level
+                            FROM item_database
+                            WHERE guild_id=$1 AND item_name=$2 AND npc_name=$3
+                            FOR UPDATE
+                        """, self.guild_id, self.item_name, self.npc_name)
+                        new = await conn.fetchrow("""
                             UPDATE item_database
                             SET zone_name=$3, zone_area=$4, item_slot=$5,
                                 npc_level=$6, item_image=$7, npc_image=$8, item_msg_id=$9, npc_msg_id=$10,
-                                added_by=$11, updated_at=NOW()
+                                added_by=$11, updated_at=NOW(),
+                                zone_id=$13, zone_area_id=$14, npc_id=$15
                             WHERE guild_id=$1 AND item_name=$2 AND npc_name=$12
+                            RETURNING guild_id, item_name, zone_name, npc_name, item_slot, npc_level
                         """,
                         self.guild_id,
                         self.item_name,
@@ -1088,40 +2545,646 @@ class ItemDatabaseModal(discord.ui.Modal, title="Add Item to Database"):
                         self.item_msg_id,
                         self.npc_msg_id,
                         self.added_by,
-                        self.npc_name)
+                        self.npc_name,
+                        self.zone_id,
+                        self.zone_area_id,
+                        self.npc_id)
+                        if old and new:
+                            await apply_loot_rollups(conn, old, -1)
+                            await apply_loot_rollups(conn, new, 1)
                     await interaction2.response.edit_message(content=f"✅ `{self.item_name}` updated successfully!", view=None)
     
                 @discord.ui.button(label="❌ Cancel", style=discord.ButtonStyle.red)
                 async def cancel(self, interaction2: discord.Interaction, button: discord.ui.Button):
+                    # The images were uploaded for this entry only
+                    if upload_channel_id:
+                        async with self.db_pool.acquire() as conn:
+                            for msg_id in {self.item_msg_id, self.npc_msg_id}:
+                                await queue_upload_log_delete(conn, self.guild_id, msg_id, upload_channel_id)
                     await interaction2.response.edit_message(content="❌ Update cancelled.", view=None)
     
+            upload_channel_id = getattr(self, "upload_channel_id", None)
             view = ConfirmUpdateView(
                 db_pool=self.db_pool,
                 guild_id=self.guild_id,
-                item_name=self.item_name.value.strip(),
-                npc_name=self.npc_name.value.strip(),
+                item_name=item_name,
+                npc_name=npc_name,
                 zone_name=zone_name,
                 zone_area=zone_area,
-                item_slot=self.item_slot_field.value.lower(),
+                item_slot=item_slot,
                 npc_level_value=npc_level_value,
                 item_image_url=self.item_image_url,
                 npc_image_url=self.npc_image_url,
                 item_msg_id=self.item_msg_id,
                 npc_msg_id=self.npc_msg_id,
-                added_by=self.added_by
+                added_by=self.added_by,
+                dimension_ids=(zone_id, zone_area_id, npc_id)
             )
     
-            await interaction.response.send_message(
-                f"⚠️ `{self.item_name.value}` from `{self.npc_name.value}` already exists.\nWould you like to update it?",
+            await interaction.followup.send(
+                f"⚠️ `{item_name}` from `{npc_name}` already exists.\nWould you like to update it?",
                 view=view,
                 ephemeral=True
             )
 
         return
 
+
+class NameSuggestionView(discord.ui.View):
+    """Asks whether to use the known spellings ItemDatabaseModal suggested, then saves the entry."""
+
+    def __init__(self, modal, interaction, values, suggestions):
+        super().__init__(timeout=STAGING_TTL)
+        self.modal = modal
+        # The modal's interaction: its followup webhook reports the save
+        self.interaction = interaction
+        self.values = values
+        self.suggestions = suggestions
+
+    async def finish(self, interaction2, use_suggestions):
+        self.stop()
+        if use_suggestions:
+            for _, field, _, known in self.suggestions:
+                self.values[field] = known
+        await interaction2.response.edit_message(content="⏳ Saving…", view=None)
+        await self.modal.save(self.interaction, **self.values)
+
+    @discord.ui.button(label="✅ Use suggested names", style=discord.ButtonStyle.green)
+    async def use_suggested(self, interaction2: discord.Interaction, button: discord.ui.Button):
+        await self.finish(interaction2, True)
+
+    @discord.ui.button(label="✏️ Keep as typed", style=discord.ButtonStyle.secondary)
+    async def keep_typed(self, interaction2: discord.Interaction, button: discord.ui.Button):
+        await self.finish(interaction2, False)
+
+    async def on_timeout(self):
+        # Nothing was saved, so the images uploaded for this entry are unused
+        upload_channel_id = getattr(self.modal, "upload_channel_id", None)
+        if upload_channel_id:
+            async with self.modal.db_pool.acquire() as conn:
+                for msg_id in {self.modal.item_msg_id, self.modal.npc_msg_id}:
+                    await queue_upload_log_delete(conn, self.modal.guild_id, msg_id, upload_channel_id)
+
+
+@bot.tree.command(name="add_item_db", description="Add a new item to the database.")
+@app_commands.describe(
+    item_image="Upload an image of the item",
+    npc_image="Upload an image of the NPC that drops the item",
+    item_slot="Select the item slot"
+)
+@app_commands.choices(item_slot=[
+    app_commands.Choice(name="Ammo", value="Ammo"),
+    app_commands.Choice(name="Back", value="Back"),
+    app_commands.Choice(name="Backpack", value="Backpack"),
+    app_commands.Choice(name="Bag", value="Bag"),
+    app_commands.Choice(name="Belt", value="Belt"),
+    app_commands.Choice(name="Chest", value="Chest"),
+    app_commands.Choice(name="Ear", value="Ear"),
+    app_commands.Choice(name="Face", value="Face"),
+    app_commands.Choice(name="Feet", value="Feet"),
+    app_commands.Choice(name="Finger", value="Finger"),
+    app_commands.Choice(name="Hands", value="Hands"),
+    app_commands.Choice(name="Head", value="Head"),
+    app_commands.Choice(name="Legs", value="Legs"),
+    app_commands.Choice(name="Neck", value="Neck"),
+    app_commands.Choice(name="Primary", value="Primary"),
+    app_commands.Choice(name="Primary 2h", value="Primary 2h"),
+    app_commands.Choice(name="Range", value="Range"),
+    app_commands.Choice(name="Secondary", value="Secondary"),
+    app_commands.Choice(name="Shirt", value="Shirt"),
+    app_commands.Choice(name="Shoulders", value="Shoulders"),
+    app_commands.Choice(name="Waist", value="Waist"),
+    app_commands.Choice(name="Wrist", value="Wrist"),
+])
+async def add_item_db(interaction: discord.Interaction, item_image: discord.Attachment, npc_image: discord.Attachment, item_slot: str):
+    """Stages the images and opens the modal. They are uploaded once the modal is submitted."""
+    if not item_image or not npc_image:
+        await interaction.response.send_message("❌ Both item and NPC images are required.", ephemeral=True)
+        return
+
+    staged_uploads.set(interaction.id, {"item": item_image, "npc": npc_image})
+    await interaction.response.send_modal(
+        ItemDatabaseModal(
+            db_pool=db_pool,
+            guild_id=interaction.guild.id,
+            added_by=str(interaction.user),
+            item_slot=item_slot,
+            staging_key=interaction.id
+        )
+    )
+
         
 
 
+# ---------------- Upload Log Cleanup ----------------
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 8
+# Discord only bulk-deletes messages younger than 14 days
+BULK_DELETE_MAX_AGE = timedelta(days=13)
+
+
+async def delete_upload_log_messages(channel, jobs):
+    """Delete the jobs' messages from one channel. Returns (done ids, failed ids)."""
+    done, failed = [], []
+
+    cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+    recent = [j for j in jobs if discord.utils.snowflake_time(j['message_id']) > cutoff]
+    singles = [j for j in jobs if discord.utils.snowflake_time(j['message_id']) <= cutoff]
+
+    for i in range(0, len(recent), 100):
+        chunk = recent[i:i + 100]
+        if len(chunk) < 2:
+            singles.extend(chunk)
+            continue
+        try:
+            await channel.delete_messages([discord.Object(id=j['message_id']) for j in chunk])
+            done.extend(j['id'] for j in chunk)
+        except discord.HTTPException as e:
+            # One bad message fails the whole bulk call, retry them one by one
+            print(f"Bulk delete in #{channel.name} failed, deleting individually: {e}")
+            singles.extend(chunk)
+
+    for job in singles:
+        try:
+            await channel.get_partial_message(job['message_id']).delete()
+            done.append(job['id'])
+        except discord.NotFound:
+            done.append(job['id'])
+        except discord.HTTPException as e:
+            print(f"Failed to delete upload-log message {job['message_id']}: {e}")
+            failed.append(job)
+
+    return done, failed
+
+
+async def drain_upload_log_outbox():
+    """Process one batch of upload_log_outbox for the guilds this process serves."""
+    async with db_pool.acquire() as conn:
+        # Lease a batch so another process or a slow run doesn't pick it up twice
+        jobs = await conn.fetch('''
+            UPDATE upload_log_outbox
+            SET attempts = attempts + 1,
+                next_attempt_at = NOW() + INTERVAL '5 minutes'
+            WHERE id IN (
+                SELECT id FROM upload_log_outbox
+                WHERE next_attempt_at <= NOW() AND guild_id = ANY($2::bigint[])
+                ORDER BY id
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, guild_id, channel_id, message_id, attempts
+        ''', OUTBOX_BATCH_SIZE, [g.id for g in bot.guilds])
+
+    if not jobs:
+        return
+
+    by_channel = {}
+    for job in jobs:
+        channel = bot.get_channel(job['channel_id']) if job['channel_id'] else None
+        if channel is None:
+            guild = bot.get_guild(job['guild_id'])
+            channel = guild and discord.utils.get(guild.text_channels, name="guild-bank-upload-log")
+        by_channel.setdefault(channel, []).append(job)
+
+    done, failed = [], []
+    for channel, channel_jobs in by_channel.items():
+        if channel is None:
+            # The upload log is gone, and the messages with it
+            done.extend(j['id'] for j in channel_jobs)
+            continue
+        channel_done, channel_failed = await delete_upload_log_messages(channel, channel_jobs)
+        done.extend(channel_done)
+        failed.extend(channel_failed)
+
+    gave_up = [j['id'] for j in failed if j['attempts'] >= OUTBOX_MAX_ATTEMPTS]
+    retry = [j['id'] for j in failed if j['attempts'] < OUTBOX_MAX_ATTEMPTS]
+    if gave_up:
+        print(f"Giving up on {len(gave_up)} upload-log deletion(s) after {OUTBOX_MAX_ATTEMPTS} attempts")
+
+    async with db_pool.acquire() as conn:
+        if done:
+            await conn.execute("DELETE FROM upload_log_outbox WHERE id = ANY($1::bigint[])", done)
+        if gave_up:
+            await conn.execute('''
+                UPDATE upload_log_outbox
+                SET gave_up = TRUE, next_attempt_at = 'infinity'
+                WHERE id = ANY($1::bigint[])
+            ''', gave_up)
+        if retry:
+            # Exponential backoff: 30s, 1m, 2m, ... capped at an hour
+            await conn.execute('''
+                UPDATE upload_log_outbox
+                SET next_attempt_at = NOW() + LEAST(INTERVAL '15 seconds' * POWER(2, attempts), INTERVAL '1 hour')
+                WHERE id = ANY($1::bigint[])
+            ''', retry)
+
+
+@tasks.loop(seconds=15)
+async def upload_log_cleanup():
+    try:
+        await drain_upload_log_outbox()
+    except Exception:
+        # Keep the loop alive, leased jobs are retried once their lease runs out
+        import traceback
+        traceback.print_exc()
+
+
+# ---------------- Upload Log Recovery ----------------
+
+# Guilds scanned at once; discord.py waits out rate limits on its own
+RECOVERY_CONCURRENCY = 3
+RECOVERY_PAGE_SIZE = 100
+
+
+def parse_bank_upload(message):
+    """(name, added_by, image, thumbnail) from a guild-bank-upload-log message, or None."""
+    if not message.attachments or not message.content.startswith("Uploaded by "):
+        return None
+    added_by = message.content[len("Uploaded by "):]
+    original = message.attachments[0]
+    # Uploaded as "{item name}.png", Discord swaps spaces for underscores
+    name = os.path.splitext(original.filename)[0].replace("_", " ").strip()
+    thumbnail = message.attachments[1].url if len(message.attachments) > 1 else None
+    return name, added_by, original.url, thumbnail
+
+
+async def restore_bank_page(conn, guild_id, messages):
+    """Re-create the bank items of upload-log messages nothing points to. Returns how many."""
+    ids = [m.id for m in messages]
+    # bot1.py posts its item images to the same channel under the same bot user
+    shared_refs = ""
+    if await conn.fetchval("SELECT to_regclass('inventory') IS NOT NULL"):
+        shared_refs = '''
+        UNION
+        SELECT upload_message_id::bigint FROM inventory WHERE upload_message_id::bigint = ANY($1::bigint[])
+        '''
+    # Outbox rows include deletions that gave up, whose messages are still there
+    known = {r['message_id'] for r in await conn.fetch(f'''
+        SELECT upload_message_id AS message_id FROM inventory1 WHERE upload_message_id = ANY($1::bigint[])
+        UNION
+        SELECT message_id FROM upload_log_outbox WHERE message_id = ANY($1::bigint[])
+        {shared_refs}
+    ''', ids)}
+
+    # Group by stack so each stack is upserted once per page
+    stacks = {}
+    for message in messages:
+        if message.id in known:
+            continue
+        parsed = parse_bank_upload(message)
+        if parsed:
+            stacks.setdefault(normalize_item_name(parsed[0]), []).append((message, parsed))
+    if not stacks:
+        return 0
+
+    donations = []
+    for name_key, uploads in stacks.items():
+        message, (name, added_by, image, thumbnail) = uploads[0]
+        created_at = message.created_at.replace(tzinfo=None)
+        item_id = await conn.fetchval('''
+            INSERT INTO inventory1 (guild_id, upload_message_id, name, name_key, image, thumbnail, qty, added_by, created_at1)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+            ON CONFLICT (guild_id, name_key) WHERE qty > 0
+            DO UPDATE SET qty = inventory1.qty + EXCLUDED.qty,
+                          version = inventory1.version + 1
+            RETURNING id
+        ''', guild_id, message.id, name, name_key, image, thumbnail, len(uploads), added_by, created_at)
+        donations.extend(
+            (guild_id, item_id, parsed[0], parsed[1], m.created_at.replace(tzinfo=None))
+            for m, parsed in uploads
+        )
+
+    await conn.executemany('''
+        INSERT INTO inventory1_donations (guild_id, item_id, name, added_by, donated_at)
+        VALUES ($1, $2, $3, $4, $5)
+    ''', donations)
+    await conn.execute('''
+        INSERT INTO inventory1_counts (guild_id, total_donated, in_bank)
+        VALUES ($1, $2, $2)
+        ON CONFLICT (guild_id) DO UPDATE
+        SET total_donated = inventory1_counts.total_donated + EXCLUDED.total_donated,
+            in_bank = inventory1_counts.in_bank + EXCLUDED.in_bank
+    ''', guild_id, len(donations))
+    return len(donations)
+
+
+async def restore_item_database_page(conn, guild_id, messages):
+    """
+    Point item_database rows back at their upload-log images by message id.
+    These messages carry no item details, so rows that are gone can't be re-created.
+    Returns how many rows were repaired.
+    """
+    uploads = [m for m in messages if m.attachments]
+    if not uploads:
+        return 0
+    ids = [str(m.id) for m in uploads]
+    repaired = 0
+    # Newer messages carry both images (item first); older ones one each
+    for id_column, image_column, index in (("item_msg_id", "item_image", 0), ("npc_msg_id", "npc_image", -1)):
+        urls = [m.attachments[index].url for m in uploads]
+        result = await conn.execute(f'''
+            UPDATE item_database d
+            SET {image_column} = v.url
+            FROM unnest($2::text[], $3::text[]) AS v(message_id, url)
+            WHERE d.guild_id=$1 AND d.{id_column}::text = v.message_id
+        ''', guild_id, ids, urls)
+        repaired += int(result.split()[-1])
+    return repaired
+
+
+async def recover_channel(guild, channel, restore_page, restart=False):
+    """Page through one upload-log channel oldest first, restoring rows and saving progress per page."""
+    async with db_pool.acquire() as conn:
+        if restart:
+            await conn.execute(
+                "DELETE FROM upload_log_recovery WHERE guild_id=$1 AND channel_id=$2", guild.id, channel.id
+            )
+        last_id = await conn.fetchval(
+            "SELECT last_message_id FROM upload_log_recovery WHERE guild_id=$1 AND channel_id=$2",
+            guild.id, channel.id
+        )
+
+    async def flush(page):
+        async with db_pool.acquire() as conn:
+            # Rows and checkpoint commit together, so a rerun picks up exactly here
+            async with conn.transaction():
+                count = await restore_page(conn, guild.id, page)
+                await conn.execute('''
+                    INSERT INTO upload_log_recovery (guild_id, channel_id, last_message_id)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (guild_id, channel_id) DO UPDATE
+                    SET last_message_id = EXCLUDED.last_message_id, updated_at = NOW()
+                ''', guild.id, channel.id, page[-1].id)
+        return count
+
+    restored = 0
+    page = []
+    after = discord.Object(id=last_id) if last_id else None
+    async for message in channel.history(limit=None, after=after, oldest_first=True):
+        page.append(message)
+        if len(page) >= RECOVERY_PAGE_SIZE:
+            restored += await flush(page)
+            page = []
+    if page:
+        restored += await flush(page)
+    return restored
+
+
+async def recover_guild(guild, semaphore, restart=False):
+    """Returns (bank items restored, item database rows repaired)."""
+    async with semaphore:
+        bank = items = 0
+        bank_channel = discord.utils.get(guild.text_channels, name="guild-bank-upload-log")
+        if bank_channel:
+            bank = await recover_channel(guild, bank_channel, restore_bank_page, restart)
+        db_channel = discord.utils.get(guild.text_channels, name="item-database-upload-log")
+        if db_channel:
+            items = await recover_channel(guild, db_channel, restore_item_database_page, restart)
+        print(f"Recovery for {guild.name}: {bank} bank items, {items} item database rows")
+        return bank, items
+
+
+@bot.tree.command(name="recover_bank", description="Rebuild missing bank items from the upload-log channels.")
+@app_commands.describe(
+    all_guilds="Recover every server this bot serves (bot owner only)",
+    restart="Ignore saved progress and rescan the channels from the start"
+)
+@app_commands.default_permissions(manage_guild=True)
+async def recover_bank(interaction: discord.Interaction, all_guilds: bool = False, restart: bool = False):
+    if all_guilds and not await bot.is_owner(interaction.user):
+        await interaction.response.send_message("❌ Only the bot owner can recover every server.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
+    guilds = list(bot.guilds) if all_guilds else [interaction.guild]
+    semaphore = asyncio.Semaphore(RECOVERY_CONCURRENCY)
+    results = await asyncio.gather(
+        *(recover_guild(guild, semaphore, restart) for guild in guilds),
+        return_exceptions=True
+    )
+
+    bank = sum(r[0] for r in results if not isinstance(r, BaseException))
+    items = sum(r[1] for r in results if not isinstance(r, BaseException))
+    failed = [g.name for g, r in zip(guilds, results) if isinstance(r, BaseException)]
+    for guild, result in zip(guilds, results):
+        if isinstance(result, BaseException):
+            print(f"Recovery for {guild.name} failed: {result!r}")
+
+    message = f"♻️ Restored {bank} bank item(s) and repaired {items} item database image(s)."
+    if failed:
+        message += f"\n⚠️ Failed for: {', '.join(failed)}. Run it again to resume."
+    await interaction.followup.send(message, ephemeral=True)
+
+
+# ---------------- Upload Log Reconciliation ----------------
+
+RECONCILE_CHUNK_SIZE = 1000
+# Newer messages may still belong to a modal that hasn't been submitted
+RECONCILE_GRACE = timedelta(days=1)
+# If most of a channel looks orphaned the rows are probably what's missing
+# (a lost or restored database); leave the messages for /recover_bank
+RECONCILE_MAX_ORPHAN_SHARE = 0.5
+# Once a day at a fixed time (UTC), so restarts and reconnects don't trigger a full history scan
+RECONCILE_TIME = time(hour=4, minute=30)
+
+
+async def scan_upload_log(guild, channel, cutoff):
+    """Load the ids of the bot's messages in `channel` from before `cutoff` into reconcile_seen."""
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "DELETE FROM reconcile_seen WHERE guild_id=$1 AND channel_id=$2", guild.id, channel.id
+        )
+
+    async def flush(ids):
+        async with db_pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO reconcile_seen (guild_id, channel_id, message_id)
+                SELECT $1, $2, unnest($3::bigint[])
+                ON CONFLICT DO NOTHING
+            ''', guild.id, channel.id, ids)
+
+    chunk = []
+    async for message in channel.history(limit=None, before=cutoff, oldest_first=True):
+        if message.author.id != bot.user.id:
+            continue
+        chunk.append(message.id)
+        if len(chunk) >= RECONCILE_CHUNK_SIZE:
+            await flush(chunk)
+            chunk = []
+    if chunk:
+        await flush(chunk)
+
+
+async def queue_reconcile_orphans(conn, guild_id, channel_id):
+    """Queue the messages in reconcile_orphans for deletion, unless that looks like a lost database."""
+    orphans = await conn.fetchval("SELECT COUNT(*) FROM reconcile_orphans")
+    seen = await conn.fetchval(
+        "SELECT COUNT(*) FROM reconcile_seen WHERE guild_id=$1 AND channel_id=$2", guild_id, channel_id
+    )
+    if orphans > max(10, seen * RECONCILE_MAX_ORPHAN_SHARE):
+        print(f"Not deleting {orphans} of {seen} upload-log messages in channel {channel_id}: too many look orphaned")
+        return 0
+    await conn.execute('''
+        INSERT INTO upload_log_outbox (guild_id, channel_id, message_id)
+        SELECT $1, $2, message_id FROM reconcile_orphans
+    ''', guild_id, channel_id)
+    return orphans
+
+
+async def reconcile_bank_channel(conn, guild_id, channel_id, cutoff_id):
+    """Queue orphaned guild-bank-upload-log messages for deletion and flag items whose message is gone."""
+    # bot1.py posts its item images to the same channel under the same bot user
+    shared_refs = ""
+    if await conn.fetchval("SELECT to_regclass('inventory') IS NOT NULL"):
+        shared_refs = '''
+        EXCEPT
+        SELECT upload_message_id::bigint FROM inventory WHERE guild_id=$1 AND upload_message_id IS NOT NULL
+        '''
+    # Bind parameters aren't allowed in CREATE TABLE AS
+    await conn.execute("CREATE TEMP TABLE reconcile_orphans (message_id BIGINT) ON COMMIT DROP")
+    await conn.execute(f'''
+        INSERT INTO reconcile_orphans
+        SELECT message_id FROM reconcile_seen WHERE guild_id=$1 AND channel_id=$2
+        EXCEPT
+        SELECT upload_message_id FROM inventory1 WHERE guild_id=$1 AND upload_message_id IS NOT NULL
+        EXCEPT
+        SELECT message_id FROM upload_log_outbox WHERE guild_id=$1
+        {shared_refs}
+    ''', guild_id, channel_id)
+    orphans = await queue_reconcile_orphans(conn, guild_id, channel_id)
+    if orphans:
+        await conn.execute(
+            "DELETE FROM upload_log_images WHERE guild_id=$1 AND message_id IN (SELECT message_id FROM reconcile_orphans)",
+            guild_id
+        )
+
+    await conn.execute('''
+        UPDATE inventory1 i
+        SET upload_missing = NOT EXISTS (
+            SELECT 1 FROM reconcile_seen s
+            WHERE s.guild_id=$1 AND s.channel_id=$2 AND s.message_id = i.upload_message_id
+        )
+        WHERE i.guild_id=$1 AND i.qty > 0 AND i.upload_message_id < $3
+    ''', guild_id, channel_id, cutoff_id)
+    dangling = await conn.fetchval(
+        "SELECT COUNT(*) FROM inventory1 WHERE guild_id=$1 AND qty > 0 AND upload_missing", guild_id
+    )
+    return orphans, dangling
+
+
+async def reconcile_item_database_channel(conn, guild_id, channel_id, cutoff_id):
+    """Same as reconcile_bank_channel for item-database-upload-log and item_database."""
+    await conn.execute("CREATE TEMP TABLE reconcile_orphans (message_id BIGINT) ON COMMIT DROP")
+    # item_database message ids are compared as text, whatever their column type
+    await conn.execute('''
+        INSERT INTO reconcile_orphans
+        SELECT message_id::bigint FROM (
+            SELECT message_id::text FROM reconcile_seen WHERE guild_id=$1 AND channel_id=$2
+            EXCEPT
+            SELECT item_msg_id::text FROM item_database WHERE guild_id=$1 AND item_msg_id IS NOT NULL
+            EXCEPT
+            SELECT npc_msg_id::text FROM item_database WHERE guild_id=$1 AND npc_msg_id IS NOT NULL
+            EXCEPT
+            SELECT message_id::text FROM upload_log_outbox WHERE guild_id=$1
+        ) o
+    ''', guild_id, channel_id)
+    orphans = await queue_reconcile_orphans(conn, guild_id, channel_id)
+
+    await conn.execute('''
+        WITH seen AS (
+            SELECT message_id::text AS message_id FROM reconcile_seen WHERE guild_id=$1 AND channel_id=$2
+        )
+        UPDATE item_database d
+        SET upload_missing =
+            (d.item_msg_id IS NOT NULL AND d.item_msg_id::text::bigint < $3
+             AND d.item_msg_id::text NOT IN (SELECT message_id FROM seen))
+            OR
+            (d.npc_msg_id IS NOT NULL AND d.npc_msg_id::text::bigint < $3
+             AND d.npc_msg_id::text NOT IN (SELECT message_id FROM seen))
+        WHERE d.guild_id=$1
+    ''', guild_id, channel_id, cutoff_id)
+    dangling = await conn.fetchval(
+        "SELECT COUNT(*) FROM item_database WHERE guild_id=$1 AND upload_missing", guild_id
+    )
+    return orphans, dangling
+
+
+async def reconcile_guild(guild):
+    cutoff = discord.utils.utcnow() - RECONCILE_GRACE
+    cutoff_id = discord.utils.time_snowflake(cutoff)
+    channels = (
+        ("guild-bank-upload-log", reconcile_bank_channel),
+        ("item-database-upload-log", reconcile_item_database_channel),
+    )
+    for name, reconcile in channels:
+        channel = discord.utils.get(guild.text_channels, name=name)
+        if channel is None:
+            continue
+        await scan_upload_log(guild, channel, cutoff)
+        async with db_pool.acquire() as conn:
+            async with conn.transaction():
+                orphans, dangling = await reconcile(conn, guild.id, channel.id, cutoff_id)
+                await conn.execute(
+                    "DELETE FROM reconcile_seen WHERE guild_id=$1 AND channel_id=$2", guild.id, channel.id
+                )
+        if orphans or dangling:
+            print(f"Reconciled #{name} in {guild.name}: {orphans} orphaned message(s) queued, {dangling} row(s) missing their upload")
+
+
+@tasks.loop(time=RECONCILE_TIME)
+async def reconcile_upload_logs():
+    for guild in list(bot.guilds):
+        try:
+            await reconcile_guild(guild)
+        except Exception:
+            # One guild failing shouldn't stop the rest, or the loop
+            import traceback
+            traceback.print_exc()
+
+
+# ---------------- Funds Snapshots ----------------
+
+@tasks.loop(hours=1)
+async def snapshot_fund_balances():
+    """Record yesterday's closing balance for every guild this process serves."""
+    try:
+        # Wait an hour past midnight so late commits land before the day is closed
+        day = (datetime.utcnow() - timedelta(hours=1)).date() - timedelta(days=1)
+        async with db_pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO funds_snapshots (guild_id, snapshot_date, donated, spent)
+                SELECT g.guild_id, $1::date,
+                       COALESCE(s.donated, 0) + COALESCE(t.donated, 0),
+                       COALESCE(s.spent, 0) + COALESCE(t.spent, 0)
+                FROM unnest($2::bigint[]) AS g(guild_id)
+                LEFT JOIN LATERAL (
+                    SELECT snapshot_date, donated, spent
+                    FROM funds_snapshots
+                    WHERE guild_id = g.guild_id AND snapshot_date < $1::date
+                    ORDER BY snapshot_date DESC
+                    LIMIT 1
+                ) s ON TRUE
+                CROSS JOIN LATERAL (
+                    SELECT SUM(total_copper) FILTER (WHERE type='donation') AS donated,
+                           SUM(total_copper) FILTER (WHERE type='spend') AS spent
+                    FROM funds
+                    WHERE guild_id = g.guild_id
+                      AND donated_at >= COALESCE(s.snapshot_date + 1, '-infinity'::timestamp)
+                      AND donated_at < $1::date + 1
+                ) t
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM funds_snapshots WHERE guild_id = g.guild_id AND snapshot_date = $1::date
+                )
+                  AND (s.snapshot_date IS NOT NULL OR t.donated IS NOT NULL OR t.spent IS NOT NULL)
+                ON CONFLICT (guild_id, snapshot_date) DO NOTHING
+            ''', day, [g.id for g in bot.guilds])
+    except Exception:
+        import traceback
+        traceback.print_exc()
+
+
 # ---------------- Bot Setup ----------------
 
 @bot.event
@@ -1129,7 +3192,20 @@ async def on_ready():
     global db_pool
     if db_pool is None:
         db_pool = await asyncpg.create_pool(DATABASE_URL)
-    
+        await init_db(db_pool)
+
+    if not upload_log_cleanup.is_running():
+        upload_log_cleanup.start()
+    if not snapshot_fund_balances.is_running():
+        snapshot_fund_balances.start()
+    if not reconcile_upload_logs.is_running():
+        reconcile_upload_logs.start()
+
+    # Commands are global, so only the process that owns shard 0 syncs them
+    if SHARD_IDS is not None and 0 not in SHARD_IDS:
+        print(f"Logged in as {bot.user} (shards {SHARD_IDS} of {SHARD_COUNT})")
+        return
+
     try:
         synced = await bot.tree.sync()
         print(f"Logged in as {bot.user}")
@@ -1147,4 +3223,6 @@ async def on_error(event, *args, **kwargs):
     traceback.print_exc()
 
 
-bot.run(TOKEN)
+# launcher.py runs this file as a script; tests import it
+if __name__ == "__main__":
+    bot.run(TOKEN)
@@ -1,15 +1,29 @@
 import os
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ui import Modal, TextInput
 from datetime import datetime
 import asyncpg 
 from PIL import Image, ImageDraw, ImageFont
 import aiohttp
 import io
-
-active_views = {}
+from registry import ExpiringRegistry
+from cdn import AttachmentURLCache
+from maskindex import MaskIndex
+from itemstats import PARSER_VERSION, STAT_COLUMNS, LOWER_IS_BETTER, parse_item_stats
+
+# Unfinished /add_item entries. A view that sees no clicks for
+# ENTRY_VIEW_TIMEOUT seconds times out and is dropped; past MAX_ACTIVE_VIEWS
+# the least recently used entry is closed to make room.
+ENTRY_VIEW_TIMEOUT = 15 * 60
+MAX_ACTIVE_VIEWS = 500
+
+active_views = ExpiringRegistry(
+    ttl=ENTRY_VIEW_TIMEOUT + 60,
+    max_size=MAX_ACTIVE_VIEWS,
+    on_evict=lambda user_id, view: view.stop()
+)
 
 print("discord.py version:", discord.__version__)
 
@@ -53,6 +67,207 @@ intents.guilds = True
 intents.messages = True
 bot = commands.Bot(command_prefix="!", intents=intents)
 db_pool: asyncpg.Pool = None
+# Stored image URLs expire; this swaps them for freshly signed ones before they are embedded
+attachment_urls = AttachmentURLCache(bot.http)
+
+# ---------- Slot / Class / Race Masks ----------
+# slot, classes and race are kept as the space-joined text the UI shows, and
+# mirrored into integer bitmasks (bit i = option i of the vocabulary) for
+# filtering. "All" sets every bit. Bits follow list order, so only ever append
+# to EQUIPMENT_SUBTYPES, CLASS_OPTIONS and RACE_OPTIONS.
+
+MASK_COLUMNS = {
+    # text column: (mask column, vocabulary)
+    "slot": ("slot_mask", EQUIPMENT_SUBTYPES),
+    "classes": ("class_mask", CLASS_OPTIONS),
+    "race": ("race_mask", RACE_OPTIONS),
+}
+
+
+def to_mask(values, options):
+    """Bitmask for a list (or space-joined string) of vocabulary values."""
+    if isinstance(values, str):
+        values = values.split()
+    mask = 0
+    for value in values or []:
+        if value == "All":
+            return (1 << len(options)) - 1
+        if value in options:
+            mask |= 1 << options.index(value)
+    return mask
+
+
+def from_mask(mask, options):
+    return [option for i, option in enumerate(options) if mask >> i & 1]
+
+
+def with_masks(fields):
+    """Add the mask columns for any of slot/classes/race present in `fields`."""
+    for column, (mask_column, options) in MASK_COLUMNS.items():
+        if column in fields:
+            fields[mask_column] = to_mask(fields[column], options)
+    return fields
+
+
+async def init_db(pool):
+    """Add and backfill the mask columns on inventory, and create inventory_stats."""
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('guildbank1_init_db'))")
+            if not await conn.fetchval("SELECT to_regclass('inventory') IS NOT NULL"):
+                return
+            for column, (mask_column, options) in MASK_COLUMNS.items():
+                exists = await conn.fetchval('''
+                    SELECT EXISTS (
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name='inventory' AND column_name=$1
+                    )
+                ''', mask_column)
+                if exists:
+                    continue
+                await conn.execute(f"ALTER TABLE inventory ADD COLUMN {mask_column} INT NOT NULL DEFAULT 0")
+                await conn.execute(f'''
+                    UPDATE inventory SET {mask_column} = CASE
+                        WHEN 'All' = ANY(string_to_array({column}, ' ')) THEN $2
+                        ELSE (
+                            SELECT COALESCE(bit_or(1 << (array_position($1::text[], v) - 1)), 0)
+                            FROM unnest(string_to_array({column}, ' ')) v
+                            WHERE v = ANY($1::text[])
+                        )
+                    END
+                    WHERE COALESCE({column}, '') <> ''
+                ''', options, (1 << len(options)) - 1)
+                print(f"Backfilled inventory.{mask_column}")
+            # Mask filters run as index-only scans over a guild's rows
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS inventory_masks_idx
+                ON inventory (guild_id) INCLUDE (slot_mask, class_mask, race_mask)
+            ''')
+
+            # Numbers parsed from the free-text stat fields, one row per item.
+            # Rows missing here or parsed by an older PARSER_VERSION are filled
+            # in by backfill_item_stats.
+            stat_types = {"ac": "REAL", "damage": "REAL", "delay": "REAL", "ratio": "REAL"}
+            await conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS inventory_stats (
+                    item_id BIGINT PRIMARY KEY,
+                    guild_id BIGINT NOT NULL,
+                    parser_version INT NOT NULL,
+                    {", ".join(f'"{c}" {stat_types.get(c, "INT")}' for c in STAT_COLUMNS)}
+                )
+            ''')
+            for column in STAT_COLUMNS:
+                order = "ASC" if column in LOWER_IS_BETTER else "DESC"
+                await conn.execute(f'''
+                    CREATE INDEX IF NOT EXISTS inventory_stats_{column}_idx
+                    ON inventory_stats (guild_id, "{column}" {order}) WHERE "{column}" IS NOT NULL
+                ''')
+
+
+async def fetch_usable_rows(guild_id):
+    async with db_pool.acquire() as conn:
+        return await conn.fetch('''
+            SELECT id, name, slot_mask, class_mask, race_mask
+            FROM inventory
+            WHERE guild_id=$1 AND qty >= 1
+        ''', guild_id)
+
+# In-memory copy of the masks of items in the bank, for /usable_items
+usable_index = MaskIndex(fetch_usable_rows)
+
+
+def sync_usable_index(guild_id, row):
+    """Mirror an inventory row (id, name, qty and masks) into usable_index after a write."""
+    if row is None:
+        return
+    if (row['qty'] or 0) >= 1:
+        usable_index.upsert(guild_id, row['id'], row['name'], row['slot_mask'], row['class_mask'], row['race_mask'])
+    else:
+        usable_index.remove(guild_id, row['id'])
+
+
+# ---------- Item Stats ----------
+
+STATS_BACKFILL_BATCH = 500
+
+STATS_UPSERT = f'''
+    INSERT INTO inventory_stats (item_id, guild_id, parser_version, {", ".join(f'"{c}"' for c in STAT_COLUMNS)})
+    VALUES ($1, $2, $3, {", ".join(f"${i}" for i in range(4, 4 + len(STAT_COLUMNS)))})
+    ON CONFLICT (item_id) DO UPDATE SET
+        parser_version = EXCLUDED.parser_version,
+        {", ".join(f'"{c}" = EXCLUDED."{c}"' for c in STAT_COLUMNS)}
+'''
+
+
+def item_stats_args(guild_id, row):
+    parsed = parse_item_stats(row['stats'], row['ac'], row['attack'], row['delay'])
+    return (row['id'], guild_id, PARSER_VERSION, *(parsed[c] for c in STAT_COLUMNS))
+
+
+def empty_stats_args(guild_id, item_id):
+    return (item_id, guild_id, PARSER_VERSION, *(None for _ in STAT_COLUMNS))
+
+
+async def save_item_stats(conn, guild_id, row):
+    """
+    Re-parse one inventory row (id, stats, ac, attack, delay) into inventory_stats.
+    Runs in a savepoint, so a bad row never rolls back the inventory write around it;
+    backfill_item_stats retries it later.
+    """
+    if row is None:
+        return
+    try:
+        async with conn.transaction():
+            await conn.execute(STATS_UPSERT, *item_stats_args(guild_id, row))
+    except Exception as e:
+        print(f"Error saving stats for inventory item {row['id']}: {e}")
+
+
+async def upsert_stats_rows(conn, rows):
+    """Upsert parsed stats for `rows`, one at a time if the batch fails. Returns how many failed."""
+    try:
+        async with conn.transaction():
+            await conn.executemany(STATS_UPSERT, [item_stats_args(r['guild_id'], r) for r in rows])
+        return 0
+    except Exception as e:
+        print(f"Stats batch failed ({e}), retrying row by row")
+    failed = 0
+    for r in rows:
+        try:
+            async with conn.transaction():
+                await conn.execute(STATS_UPSERT, *item_stats_args(r['guild_id'], r))
+        except Exception as e:
+            # An empty row at the current version keeps it from blocking every later batch
+            print(f"Error parsing stats for inventory item {r['id']}: {e}")
+            await conn.execute(STATS_UPSERT, *empty_stats_args(r['guild_id'], r['id']))
+            failed += 1
+    return failed
+
+
+@tasks.loop(minutes=30)
+async def backfill_item_stats():
+    """Parse inventory rows that have no inventory_stats row yet, or an outdated one."""
+    try:
+        total = failed = 0
+        while True:
+            async with db_pool.acquire() as conn:
+                rows = await conn.fetch('''
+                    SELECT i.id, i.guild_id, i.stats, i.ac, i.attack, i.delay
+                    FROM inventory i
+                    LEFT JOIN inventory_stats s ON s.item_id = i.id
+                    WHERE s.item_id IS NULL OR s.parser_version < $1
+                    ORDER BY i.id
+                    LIMIT $2
+                ''', PARSER_VERSION, STATS_BACKFILL_BATCH)
+                if not rows:
+                    break
+                failed += await upsert_stats_rows(conn, rows)
+            total += len(rows)
+        if total:
+            print(f"Parsed stats for {total} inventory rows ({failed} unparseable)")
+    except Exception as e:
+        print(f"Error in backfill_item_stats: {e}")
+
 
 # ---------- DB Helpers ----------
 
@@ -73,11 +288,16 @@ async def ensure_upload_channel(guild: discord.Guild):
 
 async def add_item_db(guild_id, upload_message_id, name, type, subtype=None, size=None, slot=None, stats=None, weight=None,classes=None, race=None, image=None, donated_by=None, qty=None, added_by=None, attack=None, delay=None,effects=None, ac=None, created_images=None):
     created_at1 = datetime.utcnow()
-    async with db_pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO inventory (guild_id, upload_message_id, name, size, type, subtype, slot, stats, weight, classes, race, image, donated_by, qty, added_by, attack, delay, effects, ac, created_images, created_at1)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18, $19, $20, $21)
-        ''', guild_id, upload_message_id, name, size, type, subtype, slot, stats, weight, classes, race, image, donated_by, qty, added_by, attack, delay, effects, ac, created_images, created_at1)
+    async with db_pool.acquire() as conn, conn.transaction():
+        row = await conn.fetchrow('''
+            INSERT INTO inventory (guild_id, upload_message_id, name, size, type, subtype, slot, stats, weight, classes, race, image, donated_by, qty, added_by, attack, delay, effects, ac, created_images, created_at1,
+                                   slot_mask, class_mask, race_mask)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18, $19, $20, $21, $22, $23, $24)
+            RETURNING id, name, qty, slot_mask, class_mask, race_mask, stats, ac, attack, delay
+        ''', guild_id, upload_message_id, name, size, type, subtype, slot, stats, weight, classes, race, image, donated_by, qty, added_by, attack, delay, effects, ac, created_images, created_at1,
+            to_mask(slot, EQUIPMENT_SUBTYPES), to_mask(classes, CLASS_OPTIONS), to_mask(race, RACE_OPTIONS))
+        await save_item_stats(conn, guild_id, row)
+    sync_usable_index(guild_id, row)
 
 
 async def get_all_items(guild_id):
@@ -98,6 +318,7 @@ async def update_item_db(guild_id, item_id, **fields):
     """
     if not fields:
         return  # nothing to update
+    with_masks(fields)
 
     set_clauses = []
     values = []
@@ -114,9 +335,12 @@ async def update_item_db(guild_id, item_id, **fields):
         UPDATE inventory
         SET {', '.join(set_clauses)}
         WHERE guild_id=${i} AND id=${i+1}
+        RETURNING id, name, qty, slot_mask, class_mask, race_mask, stats, ac, attack, delay
     """
-    async with db_pool.acquire() as conn:
-        await conn.execute(sql, *values)
+    async with db_pool.acquire() as conn, conn.transaction():
+        row = await conn.fetchrow(sql, *values)
+        await save_item_stats(conn, guild_id, row)
+    sync_usable_index(guild_id, row)
 
 
 
@@ -177,22 +401,22 @@ class SubtypeSelect(discord.ui.Select):
         self.parent_view = parent_view
         
         # Add debugging
-        print(f"DEBUG: SubtypeSelect init - type: {self.parent_view.type}")
+        print(f"DEBUG: SubtypeSelect init - type: {self.parent_view.state.type}")
         
         # Add safety check
-        if not self.parent_view.type:
+        if not self.parent_view.state.type:
             print("ERROR: type is None!")
             options = [discord.SelectOption(label="Error", value="error")]
-        elif self.parent_view.type == "Crafting":
+        elif self.parent_view.state.type == "Crafting":
             options = [discord.SelectOption(label=s, value=s) for s in CRAFTING_SUBTYPES]
-        elif self.parent_view.type == "Consumable":
+        elif self.parent_view.state.type == "Consumable":
             options = [discord.SelectOption(label=s, value=s) for s in CONSUMABLE_SUBTYPES]
         else:
             options = [discord.SelectOption(label=s, value=s) for s in MISC_SUBTYPES]
 
         # ✅ Mark selected subtype as default
         for opt in options:
-            if opt.label == self.parent_view.subtype:
+            if opt.label == self.parent_view.state.subtype:
                 opt.default = True
 
         super().__init__(placeholder="Select Subtype", options=options)
@@ -200,7 +424,7 @@ class SubtypeSelect(discord.ui.Select):
     async def callback(self, interaction: discord.Interaction):
             try:
                 print(f"DEBUG: SubtypeSelect callback - values: {self.values}")
-                self.parent_view.subtype = self.values[0]
+                self.parent_view.state.subtype = self.values[0]
                 # update which option is default so it stays highlighted
                 for opt in self.options:
                     opt.default = (opt.label == self.values[0])
@@ -218,21 +442,21 @@ class SlotSelect(discord.ui.Select):
     def __init__(self, parent_view):
         self.parent_view = parent_view
         
-        print(f"DEBUG: SlotSelect init - type: {self.parent_view.type}")
+        print(f"DEBUG: SlotSelect init - type: {self.parent_view.state.type}")
         
-        if not self.parent_view.type:
+        if not self.parent_view.state.type:
             print("ERROR: type is None!")
             options = [discord.SelectOption(label="Error", value="error")]
-        elif self.parent_view.type in ["Equipment", "Armor"]:
+        elif self.parent_view.state.type in ["Equipment", "Armor"]:
             options = [discord.SelectOption(label=s, value=s) for s in EQUIPMENT_SUBTYPES]
-        elif self.parent_view.type in ["Weapon"]:
+        elif self.parent_view.state.type in ["Weapon"]:
             options = [discord.SelectOption(label=s, value=s) for s in WEAPON_SUBTYPES]
         else:
             options = [discord.SelectOption(label="N/A", value="N/A")]
         
         # ✅ Mark selected slots as default
         for opt in options:
-            if hasattr(self.parent_view, "slot") and opt.label in (self.parent_view.slot or []):
+            if opt.label in (self.parent_view.state.slot or []):
                 opt.default = True
 
         # ✅ Multi-select enabled here
@@ -247,7 +471,7 @@ class SlotSelect(discord.ui.Select):
         try:
             print(f"DEBUG: SlotSelect callback - values: {self.values}")
             # ✅ Store as a list of slots instead of single string
-            self.parent_view.slot = self.values  
+            self.parent_view.state.slot = self.values  
             
             # Keep selections highlighted
             for opt in self.options:
@@ -273,7 +497,7 @@ class ClassesSelect(discord.ui.Select):
         options = [discord.SelectOption(label="All")] + [discord.SelectOption(label=c) for c in CLASS_OPTIONS]
     
         for opt in options:
-            if self.parent_view.usable_classes and opt.label in self.parent_view.usable_classes:
+            if self.parent_view.state.usable_classes and opt.label in self.parent_view.state.usable_classes:
                 opt.default = True
         
         super().__init__(
@@ -288,14 +512,14 @@ class ClassesSelect(discord.ui.Select):
     async def callback(self, interaction: discord.Interaction):
         # If All is selected, ignore other selections
         if "All" in self.values:
-                self.view.usable_classes = ["All"]
+                self.view.state.usable_classes = ["All"]
         else:
             # If other classes selected while All is in previous selection, remove All
-            self.view.usable_classes = self.values
+            self.view.state.usable_classes = self.values
     
         # Update the dropdown so selections are visible
         for option in self.options:
-            option.default = option.label in self.view.usable_classes
+            option.default = option.label in self.view.state.usable_classes
     
         await interaction.response.edit_message(view=self.view)
     
@@ -307,9 +531,9 @@ class RaceSelect(discord.ui.Select):
         options = [discord.SelectOption(label="All")] + [discord.SelectOption(label=r) for r in RACE_OPTIONS]
 
         for opt in options:
-            if self.parent_view.usable_race and opt.label in self.parent_view.usable_race:
+            if self.parent_view.state.usable_race and opt.label in self.parent_view.state.usable_race:
                 opt.default = True
-		
+        
         super().__init__(
             placeholder="Select usable race (multi)",
             options=options,
@@ -322,14 +546,14 @@ class RaceSelect(discord.ui.Select):
     async def callback(self, interaction: discord.Interaction):
         # If All is selected, ignore other selections
         if "All" in self.values:
-            self.view.usable_race = ["All"]
+            self.view.state.usable_race = ["All"]
         else:
             # If other race selected while All is in previous selection, remove All
-            self.view.usable_race = self.values
+            self.view.state.usable_race = self.values
     
         # Update the dropdown so selections are visible
         for option in self.options:
-            option.default = option.label in self.view.usable_race
+            option.default = option.label in self.view.state.usable_race
     
         await interaction.response.edit_message(view=self.view)
 
@@ -343,7 +567,7 @@ class SizeSelect(discord.ui.Select):
 
         # ✅ Mark selected size as default
         for opt in options:
-            if opt.label == self.parent_view.size:
+            if opt.label == self.parent_view.state.size:
                 opt.default = True
 
         super().__init__(placeholder="Select Size", options=options)
@@ -352,7 +576,7 @@ class SizeSelect(discord.ui.Select):
         try:
             print(f"DEBUG: SizeSelect callback - values: {self.values}")
             # Save to size column
-            self.parent_view.size = self.values[0]
+            self.parent_view.state.size = self.values[0]
 
             # Update which option is default so it stays highlighted
             for opt in self.options:
@@ -368,15 +592,19 @@ class SizeSelect(discord.ui.Select):
             except:
                 pass
                 
-class ItemEntryView(discord.ui.View):
-    def __init__(self, author, db_pool=None, type=None, item_id=None, existing_data=None, is_edit=False):
-        super().__init__(timeout=None)
-        self.db_pool = db_pool     
-        self.author = author
+class ItemEntryState:
+    """Everything an ItemEntryView collects before the item is submitted."""
+    __slots__ = (
+        "type", "subtype", "slot", "size", "usable_classes", "usable_race",
+        "item_name", "stats", "weight", "item_id", "donated_by",
+        "attack", "delay", "effects", "ac", "is_edit", "image",
+    )
+
+    def __init__(self, type=None, item_id=None, is_edit=False):
         self.type = type
         self.subtype = None
         self.slot = []
-        self.size=""
+        self.size = ""
         self.usable_classes = []
         self.usable_race = []
         self.item_name = ""
@@ -388,33 +616,42 @@ class ItemEntryView(discord.ui.View):
         self.delay = ""
         self.effects = ""
         self.ac = ""
-        self.is_edit=is_edit
+        self.is_edit = is_edit
+        self.image = None
+
+
+class ItemEntryView(discord.ui.View):
+    def __init__(self, author, db_pool=None, type=None, item_id=None, existing_data=None, is_edit=False):
+        super().__init__(timeout=ENTRY_VIEW_TIMEOUT)
+        self.db_pool = db_pool     
+        self.author = author
+        self.state = ItemEntryState(type=type, item_id=item_id, is_edit=is_edit)
 
         # preload existing if editing
         if existing_data:
-            self.item_name = existing_data['name']
-            self.type = existing_data['type']
-            self.subtype = existing_data['subtype']
-            self.size = existing_data['size']
-            self.slot = existing_data['slot'].split(" ") if existing_data['slot'] else []
-            self.stats = existing_data['stats']
-            self.weight = existing_data['weight']
-            self.ac = existing_data['ac']
-            self.attack = existing_data['attack']
-            self.delay = existing_data['delay']
-            self.effects = existing_data['effects']
-            self.donated_by = existing_data['donated_by']
-            self.usable_classes = existing_data['classes'].split(" ") if existing_data['classes'] else []
-            self.usable_race = existing_data['race'].split(" ") if existing_data['race'] else []
-
-        if self.type in ["Crafting","Consumable","Misc"]:
+            self.state.item_name = existing_data['name']
+            self.state.type = existing_data['type']
+            self.state.subtype = existing_data['subtype']
+            self.state.size = existing_data['size']
+            self.state.slot = existing_data['slot'].split(" ") if existing_data['slot'] else []
+            self.state.stats = existing_data['stats']
+            self.state.weight = existing_data['weight']
+            self.state.ac = existing_data['ac']
+            self.state.attack = existing_data['attack']
+            self.state.delay = existing_data['delay']
+            self.state.effects = existing_data['effects']
+            self.state.donated_by = existing_data['donated_by']
+            self.state.usable_classes = existing_data['classes'].split(" ") if existing_data['classes'] else []
+            self.state.usable_race = existing_data['race'].split(" ") if existing_data['race'] else []
+
+        if self.state.type in ["Crafting","Consumable","Misc"]:
             self.subtype_select = SubtypeSelect(self)
             self.add_item(self.subtype_select)
 
         
-        if self.type in ["Weapon", "Equipment"]:
+        if self.state.type in ["Weapon", "Equipment"]:
 
-			
+            
             self.slot_select = SlotSelect(self)
             self.add_item(self.slot_select)
             
@@ -431,7 +668,7 @@ class ItemEntryView(discord.ui.View):
         self.details_button.callback = self.open_item_details
         self.add_item(self.details_button)
         
-        if self.type in ["Weapon", "Equipment"]:
+        if self.state.type in ["Weapon", "Equipment"]:
             self.details_button1 = discord.ui.Button(label="Stat Details", style=discord.ButtonStyle.secondary)
             self.details_button1.callback = self.open_item_details1
             self.add_item(self.details_button1)
@@ -447,7 +684,18 @@ class ItemEntryView(discord.ui.View):
         
     
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
-        return interaction.user == self.author
+        if interaction.user != self.author:
+            return False
+        active_views.get(self.author.id)  # keep the registry entry alive while in use
+        return True
+
+    def stop(self):
+        active_views.discard(self.author.id, self)
+        super().stop()
+
+    async def on_timeout(self):
+        active_views.discard(self.author.id, self)
+        self.clear_items()
     
     async def open_item_details(self, interaction: discord.Interaction):
         modal = ItemDetailsModal(parent_view=self)
@@ -466,287 +714,287 @@ class ItemEntryView(discord.ui.View):
 
 
     async def submit_item(self, interaction: discord.Interaction):
-	    # Convert lists to space-separated strings
-	    classes_str = " ".join(self.usable_classes)
-	    race_str = " ".join(self.usable_race)
-	    slot_str = " ".join(self.slot)
-	    donor = self.donated_by or "Anonymous"
-	    added_by = str(interaction.user)
-	
-	    # Base fields to update/add
-	    fields_to_update = {
-	        "name": self.item_name,
-	        "type": self.type,
-	        "subtype": self.subtype,
-	        "slot": slot_str,
-	        "size": self.size,
-	        "stats": self.stats,
-	        "weight": self.weight,
-	        "classes": classes_str,
-	        "race": race_str,
-	        "donated_by": donor,
-	        "added_by": added_by
-	    }
-	
-	    # Only include relevant fields per item type
-	    if self.type == "Weapon":
-	        fields_to_update.update({"attack": self.attack, "delay": self.delay, "effects": self.effects})
-	    elif self.type == "Equipment":
-	        fields_to_update.update({"ac": self.ac, "effects": self.effects})
-	    elif self.type == "Consumable":
-	        fields_to_update.update({"effects": self.effects})
-	
-	    def draw_item_text(background, item_name, type, subtype, size, slot, stats, weight, effects, donated_by):
-	        draw = ImageDraw.Draw(background)
-	
-	        # Load fonts
-	        font_title = ImageFont.truetype("assets/WinthorpeScB.ttf", 28)
-	        font_type = ImageFont.truetype("assets/Winthorpe.ttf", 20)
-	        font_slot = ImageFont.truetype("assets/Winthorpe.ttf", 16)
-	        font_size = ImageFont.truetype("assets/Winthorpe.ttf", 16)
-	        font_stats = ImageFont.truetype("assets/Winthorpe.ttf", 16)
-	        font_weight = ImageFont.truetype("assets/Winthorpe.ttf", 16)
-	        font_effects = ImageFont.truetype("assets/Winthorpe.ttf", 16)
-	        font_ac = ImageFont.truetype("assets/WinthorpeB.ttf", 16)
-	        font_attack = ImageFont.truetype("assets/Winthorpe.ttf", 16)
-	        font_class = ImageFont.truetype("assets/WinthorpeB.ttf", 16)
-	        font_race = ImageFont.truetype("assets/WinthorpeB.ttf", 16)
-	
-	        width, height = background.size
-	        x_margin = 40
-	        y = 3
-	        x = 110
-	
-	        draw.text((x_margin, y), f"{item_name}", fill=(255, 255, 255), font=font_title)
-	        y += 50
-	
-	        if self.type in ("Equipment"):
-	            slot = " ".join(sorted(self.slot))
-	            draw.text((x, y), f"Slot: {slot}", fill=(255, 255, 255), font=font_ac)
-	            y += 25
-	
-	            if self.ac != "":
-	                ac = self.ac
-	                draw.text((x, y), f"AC: {ac}", fill=(255, 255, 255), font=font_ac)
-	                y += 25
-	
-	        if self.type in ("Weapon"):
-	            slot = " ".join(sorted(self.slot)).upper()
-	            draw.text((x, y), f"Slot: {slot}", fill=(255, 255, 255), font=font_ac)
-	            y += 25
-	
-	            if self.attack != "":
-	                attack = self.attack
-	                delay = self.delay
-	                draw.text((x, y), f"Weapon DMG: {attack} ATK Delay: {delay}", fill=(255, 255, 255), font=font_attack)
-	                y += 25
-	
-	        if self.type in ("Equipment", "Weapon"):
-	            if self.stats != "":
-	                stats_text = stats
-	                draw.text((x, y), stats_text, fill=(255, 255, 255), font=font_stats)
-	                bbox = draw.textbbox((x, y), stats_text, font=font_stats)
-	                text_height = bbox[3] - bbox[1]
-	                y += text_height + 15
-	
-	            if self.effects != "":
-	                effects_text = effects
-	                draw.text((x, y), effects_text, fill=(255, 255, 255), font=font_effects)
-	                bbox = draw.textbbox((x, y), effects_text, font=font_effects)
-	                text_height = bbox[3] - bbox[1]
-	                y += text_height + 15
-
-                if self.size != "" and self.weight != "":
+        # Convert lists to space-separated strings
+        classes_str = " ".join(self.state.usable_classes)
+        race_str = " ".join(self.state.usable_race)
+        slot_str = " ".join(self.state.slot)
+        donor = self.state.donated_by or "Anonymous"
+        added_by = str(interaction.user)
+    
+        # Base fields to update/add
+        fields_to_update = {
+            "name": self.state.item_name,
+            "type": self.state.type,
+            "subtype": self.state.subtype,
+            "slot": slot_str,
+            "size": self.state.size,
+            "stats": self.state.stats,
+            "weight": self.state.weight,
+            "classes": classes_str,
+            "race": race_str,
+            "donated_by": donor,
+            "added_by": added_by
+        }
+    
+        # Only include relevant fields per item type
+        if self.state.type == "Weapon":
+            fields_to_update.update({"attack": self.state.attack, "delay": self.state.delay, "effects": self.state.effects})
+        elif self.state.type == "Equipment":
+            fields_to_update.update({"ac": self.state.ac, "effects": self.state.effects})
+        elif self.state.type == "Consumable":
+            fields_to_update.update({"effects": self.state.effects})
+    
+        def draw_item_text(background, item_name, type, subtype, size, slot, stats, weight, effects, donated_by):
+            draw = ImageDraw.Draw(background)
+    
+            # Load fonts
+            font_title = ImageFont.truetype("assets/WinthorpeScB.ttf", 28)
+            font_type = ImageFont.truetype("assets/Winthorpe.ttf", 20)
+            font_slot = ImageFont.truetype("assets/Winthorpe.ttf", 16)
+            font_size = ImageFont.truetype("assets/Winthorpe.ttf", 16)
+            font_stats = ImageFont.truetype("assets/Winthorpe.ttf", 16)
+            font_weight = ImageFont.truetype("assets/Winthorpe.ttf", 16)
+            font_effects = ImageFont.truetype("assets/Winthorpe.ttf", 16)
+            font_ac = ImageFont.truetype("assets/WinthorpeB.ttf", 16)
+            font_attack = ImageFont.truetype("assets/Winthorpe.ttf", 16)
+            font_class = ImageFont.truetype("assets/WinthorpeB.ttf", 16)
+            font_race = ImageFont.truetype("assets/WinthorpeB.ttf", 16)
+    
+            width, height = background.size
+            x_margin = 40
+            y = 3
+            x = 110
+    
+            draw.text((x_margin, y), f"{item_name}", fill=(255, 255, 255), font=font_title)
+            y += 50
+    
+            if self.state.type in ("Equipment"):
+                slot = " ".join(sorted(self.state.slot))
+                draw.text((x, y), f"Slot: {slot}", fill=(255, 255, 255), font=font_ac)
+                y += 25
+    
+                if self.state.ac != "":
+                    ac = self.state.ac
+                    draw.text((x, y), f"AC: {ac}", fill=(255, 255, 255), font=font_ac)
+                    y += 25
+    
+            if self.state.type in ("Weapon"):
+                slot = " ".join(sorted(self.state.slot)).upper()
+                draw.text((x, y), f"Slot: {slot}", fill=(255, 255, 255), font=font_ac)
+                y += 25
+    
+                if self.state.attack != "":
+                    attack = self.state.attack
+                    delay = self.state.delay
+                    draw.text((x, y), f"Weapon DMG: {attack} ATK Delay: {delay}", fill=(255, 255, 255), font=font_attack)
+                    y += 25
+    
+            if self.state.type in ("Equipment", "Weapon"):
+                if self.state.stats != "":
+                    stats_text = stats
+                    draw.text((x, y), stats_text, fill=(255, 255, 255), font=font_stats)
+                    bbox = draw.textbbox((x, y), stats_text, font=font_stats)
+                    text_height = bbox[3] - bbox[1]
+                    y += text_height + 15
+    
+                if self.state.effects != "":
+                    effects_text = effects
+                    draw.text((x, y), effects_text, fill=(255, 255, 255), font=font_effects)
+                    bbox = draw.textbbox((x, y), effects_text, font=font_effects)
+                    text_height = bbox[3] - bbox[1]
+                    y += text_height + 15
+
+                if self.state.size != "" and self.state.weight != "":
+                    draw.text((x, y), f"Weight:{weight} Size: {size.upper()}", fill=(255, 255, 255), font=font_size)
+                    y += 25
+    
+                if self.state.size != "" and self.state.weight == "":
+                    draw.text((x, y), f"Size: {size.upper()}", fill=(255, 255, 255), font=font_size)
+                    y += 25
+    
+                if self.state.size == "" and self.state.weight != "":
+                    draw.text((x, y), f"Weight: {weight}", fill=(255, 255, 255), font=font_size)
+                    y += 25
+    
+            if self.state.type in ("Consumable"):
+                if self.state.stats != "":
+                    stats_text = stats
+                    draw.text((x, y), stats_text, fill=(255, 255, 255), font=font_stats)
+                    bbox = draw.textbbox((x, y), stats_text, font=font_stats)
+                    text_height = bbox[3] - bbox[1]
+                    y += text_height + 15
+    
+            if self.state.subtype in ("Potion", "Scroll"):
+                if self.state.effects != "":
+                    draw.text((x, y), f"Effects: {effects}", fill=(255, 255, 255), font=font_effects)
+                    y += 25
+    
+            if self.state.subtype in ("Drink", "Food", "Other"):
+                if self.state.effects != "":
+                    effects_text = effects
+                    draw.text((x, y), effects_text, fill=(255, 255, 255), font=font_effects)
+                    bbox = draw.textbbox((x, y), effects_text, font=font_effects)
+                    text_height = bbox[3] - bbox[1]
+                    y += text_height + 15
+    
+            if self.state.type in ("Crafting", "Misc"):
+                if self.state.effects != "":
+                    effects_text = effects
+                    draw.text((x, y), effects_text, fill=(255, 255, 255), font=font_effects)
+                    bbox = draw.textbbox((x, y), effects_text, font=font_effects)
+                    text_height = bbox[3] - bbox[1]
+                    y += text_height + 15
+    
+                if self.state.size != "" and self.state.weight != "":
                     draw.text((x, y), f"Weight:{weight} Size: {size.upper()}", fill=(255, 255, 255), font=font_size)
                     y += 25
-	
-                if self.size != "" and self.weight == "":
-	                draw.text((x, y), f"Size: {size.upper()}", fill=(255, 255, 255), font=font_size)
-	                y += 25
-	
-	            if self.size == "" and self.weight != "":
-	                draw.text((x, y), f"Weight: {weight}", fill=(255, 255, 255), font=font_size)
-	                y += 25
-	
-	        if self.type in ("Consumable"):
-	            if self.stats != "":
-	                stats_text = stats
-	                draw.text((x, y), stats_text, fill=(255, 255, 255), font=font_stats)
-	                bbox = draw.textbbox((x, y), stats_text, font=font_stats)
-	                text_height = bbox[3] - bbox[1]
-	                y += text_height + 15
-	
-	        if self.subtype in ("Potion", "Scroll"):
-	            if self.effects != "":
-	                draw.text((x, y), f"Effects: {effects}", fill=(255, 255, 255), font=font_effects)
-	                y += 25
-	
-	        if self.subtype in ("Drink", "Food", "Other"):
-	            if self.effects != "":
-	                effects_text = effects
-	                draw.text((x, y), effects_text, fill=(255, 255, 255), font=font_effects)
-	                bbox = draw.textbbox((x, y), effects_text, font=font_effects)
-	                text_height = bbox[3] - bbox[1]
-	                y += text_height + 15
-	
-	        if self.type in ("Crafting", "Misc"):
-	            if self.effects != "":
-	                effects_text = effects
-	                draw.text((x, y), effects_text, fill=(255, 255, 255), font=font_effects)
-	                bbox = draw.textbbox((x, y), effects_text, font=font_effects)
-	                text_height = bbox[3] - bbox[1]
-	                y += text_height + 15
-	
-	            if self.size != "" and self.weight != "":
-	                draw.text((x, y), f"Weight:{weight} Size: {size.upper()}", fill=(255, 255, 255), font=font_size)
-	                y += 25
-	
-	            if self.size != "" and self.weight == "":
-	                draw.text((x, y), f"Size: {size.upper()}", fill=(255, 255, 255), font=font_size)
-	                y += 25
-	
-	            if self.size == "" and self.weight != "":
-	                draw.text((x, y), f"Weight: {weight}", fill=(255, 255, 255), font=font_size)
-	                y += 25
-	
-	        if self.type in ("Crafting", "Misc"):
-	            if self.stats != "":
-	                stats_text = stats
-	                draw.text((x, y), stats_text, fill=(255, 255, 255), font=font_stats)
-	                bbox = draw.textbbox((x, y), stats_text, font=font_stats)
-	                text_height = bbox[3] - bbox[1]
-	                y += text_height + 15
-	
-	        if self.type in ("Equipment", "Weapon"):
-	            if self.usable_classes:
-	                classes = " ".join(sorted(self.usable_classes))
-	                draw.text((x, y), f"Class: {classes.upper()}", fill=(255, 255, 255), font=font_effects)
-	                y += 25
-	
-	            if self.usable_race:
-	                race = " ".join(sorted(self.usable_race))
-	                draw.text((x, y), f"Race: {race.upper()}", fill=(255, 255, 255), font=font_effects)
-	                y += 25
-	
-	        return background
-	
-	    async with self.db_pool.acquire() as conn:
-	        if self.item_id:
-	            old_item = await conn.fetchrow(
-	                "SELECT id, created_images, upload_message_id FROM inventory WHERE id=$1",
-	                self.item_id
-	            )
-	
-	            if old_item and old_item['upload_message_id']:
-	                try:
-	                    upload_channel = await ensure_upload_channel(interaction.guild)
-	                    old_msg = await upload_channel.fetch_message(old_item['upload_message_id'])
-	                    await old_msg.delete()
-	                except discord.NotFound:
-	                    pass
-	
-	            bg_path = BG_FILES.get(self.type, BG_FILES["Misc"])
-	            background = Image.open(bg_path).convert("RGBA")
-	
-	            background = draw_item_text(
-	                background,
-	                self.item_name,
-	                self.type,
-	                self.subtype,
-	                self.size,
-	                self.slot,
-	                self.stats,
-	                self.weight,
-	                self.effects,
-	                self.donated_by
-	            )
-	            created_images = io.BytesIO()
-	            background.save(created_images, format="PNG")
-	            created_images.seek(0)
-	
-	            upload_channel = await ensure_upload_channel(interaction.guild)
-	            file = discord.File(created_images, filename=f"{self.item_name}.png")
-	            message = await upload_channel.send(file=file, content=f"Created by {added_by}")
-	            cdn_url = message.attachments[0].url
-	
-	            fields_to_update["created_images"] = cdn_url
-	            fields_to_update["upload_message_id"] = message.id
-	            fields_to_update["created_at1"] = datetime.utcnow()
-	
-	            await update_item_db(
-	                guild_id=interaction.guild.id,
-	                item_id=self.item_id,
-	                **fields_to_update
-	            )
-	
-	            embed = discord.Embed(title=f"{self.item_name}", color=discord.Color.blue())
-	            embed.set_image(url=cdn_url)
-	
-	            await interaction.response.send_message(
-	                content=f"✅ Updated **{self.item_name}**.",
-	                embed=embed,
-	                ephemeral=True
-	            )
-	
-	        else:
-	            bg_path = BG_FILES.get(self.type, BG_FILES["Misc"])
-	            background = Image.open(bg_path).convert("RGBA")
-	
-	            background = draw_item_text(
-	                background,
-	                self.item_name,
-	                self.type,
-	                self.subtype,
-	                self.size,
-	                self.slot,
-	                self.stats,
-	                self.weight,
-	                self.effects,
-	                self.donated_by
-	            )
-	
-	            created_images = io.BytesIO()
-	            background.save(created_images, format="PNG")
-	            created_images.seek(0)
-	
-	            upload_channel = await ensure_upload_channel(interaction.guild)
-	            file = discord.File(created_images, filename=f"{self.item_name}.png")
-	            message = await upload_channel.send(file=file, content=f"Created by {added_by}")
-	            cdn_url = message.attachments[0].url
-	
-	            await add_item_db(
-	                guild_id=interaction.guild.id,
-	                name=self.item_name,
-	                type=self.type,
-	                size=self.size,
-	                subtype=self.subtype,
-	                slot=" ".join(self.slot),
-	                stats=self.stats,
-	                weight=self.weight,
-	                classes=" ".join(self.usable_classes),
-	                race=" ".join(self.usable_race),
-	                image=None,
-	                created_images=cdn_url,
-	                donated_by=self.donated_by,
-	                qty=1,
-	                added_by=str(interaction.user),
-	                attack=self.attack,
-	                delay=self.delay,
-	                effects=self.effects,
-	                ac=self.ac,
-	                upload_message_id=message.id
-	            )
-	
-	            embed = discord.Embed(title=f"{self.item_name}", color=discord.Color.blue())
-	            embed.set_image(url=cdn_url)
-	
-	            await interaction.response.send_message(
-	                content=f"✅ Added **{self.item_name}** to the Guild Bank (manual image created).",
-	                embed=embed,
-	                ephemeral=True
-	            )
-	
-	    self.stop()
+    
+                if self.state.size != "" and self.state.weight == "":
+                    draw.text((x, y), f"Size: {size.upper()}", fill=(255, 255, 255), font=font_size)
+                    y += 25
+    
+                if self.state.size == "" and self.state.weight != "":
+                    draw.text((x, y), f"Weight: {weight}", fill=(255, 255, 255), font=font_size)
+                    y += 25
+    
+            if self.state.type in ("Crafting", "Misc"):
+                if self.state.stats != "":
+                    stats_text = stats
+                    draw.text((x, y), stats_text, fill=(255, 255, 255), font=font_stats)
+                    bbox = draw.textbbox((x, y), stats_text, font=font_stats)
+                    text_height = bbox[3] - bbox[1]
+                    y += text_height + 15
+    
+            if self.state.type in ("Equipment", "Weapon"):
+                if self.state.usable_classes:
+                    classes = " ".join(sorted(self.state.usable_classes))
+                    draw.text((x, y), f"Class: {classes.upper()}", fill=(255, 255, 255), font=font_effects)
+                    y += 25
+    
+                if self.state.usable_race:
+                    race = " ".join(sorted(self.state.usable_race))
+                    draw.text((x, y), f"Race: {race.upper()}", fill=(255, 255, 255), font=font_effects)
+                    y += 25
+    
+            return background
+    
+        async with self.db_pool.acquire() as conn:
+            if self.state.item_id:
+                old_item = await conn.fetchrow(
+                    "SELECT id, created_images, upload_message_id FROM inventory WHERE id=$1",
+                    self.state.item_id
+                )
+    
+                if old_item and old_item['upload_message_id']:
+                    try:
+                        upload_channel = await ensure_upload_channel(interaction.guild)
+                        old_msg = await upload_channel.fetch_message(old_item['upload_message_id'])
+                        await old_msg.delete()
+                    except discord.NotFound:
+                        pass
+    
+                bg_path = BG_FILES.get(self.state.type, BG_FILES["Misc"])
+                background = Image.open(bg_path).convert("RGBA")
+    
+                background = draw_item_text(
+                    background,
+                    self.state.item_name,
+                    self.state.type,
+                    self.state.subtype,
+                    self.state.size,
+                    self.state.slot,
+                    self.state.stats,
+                    self.state.weight,
+                    self.state.effects,
+                    self.state.donated_by
+                )
+                created_images = io.BytesIO()
+                background.save(created_images, format="PNG")
+                created_images.seek(0)
+    
+                upload_channel = await ensure_upload_channel(interaction.guild)
+                file = discord.File(created_images, filename=f"{self.state.item_name}.png")
+                message = await upload_channel.send(file=file, content=f"Created by {added_by}")
+                cdn_url = message.attachments[0].url
+    
+                fields_to_update["created_images"] = cdn_url
+                fields_to_update["upload_message_id"] = message.id
+                fields_to_update["created_at1"] = datetime.utcnow()
+    
+                await update_item_db(
+                    guild_id=interaction.guild.id,
+                    item_id=self.state.item_id,
+                    **fields_to_update
+                )
+    
+                embed = discord.Embed(title=f"{self.state.item_name}", color=discord.Color.blue())
+                embed.set_image(url=cdn_url)
+    
+                await interaction.response.send_message(
+                    content=f"✅ Updated **{self.state.item_name}**.",
+                    embed=embed,
+                    ephemeral=True
+                )
+    
+            else:
+                bg_path = BG_FILES.get(self.state.type, BG_FILES["Misc"])
+                background = Image.open(bg_path).convert("RGBA")
+    
+                background = draw_item_text(
+                    background,
+                    self.state.item_name,
+                    self.state.type,
+                    self.state.subtype,
+                    self.state.size,
+                    self.state.slot,
+                    self.state.stats,
+                    self.state.weight,
+                    self.state.effects,
+                    self.state.donated_by
+                )
+    
+                created_images = io.BytesIO()
+                background.save(created_images, format="PNG")
+                created_images.seek(0)
+    
+                upload_channel = await ensure_upload_channel(interaction.guild)
+                file = discord.File(created_images, filename=f"{self.state.item_name}.png")
+                message = await upload_channel.send(file=file, content=f"Created by {added_by}")
+                cdn_url = message.attachments[0].url
+    
+                await add_item_db(
+                    guild_id=interaction.guild.id,
+                    name=self.state.item_name,
+                    type=self.state.type,
+                    size=self.state.size,
+                    subtype=self.state.subtype,
+                    slot=" ".join(self.state.slot),
+                    stats=self.state.stats,
+                    weight=self.state.weight,
+                    classes=" ".join(self.state.usable_classes),
+                    race=" ".join(self.state.usable_race),
+                    image=None,
+                    created_images=cdn_url,
+                    donated_by=self.state.donated_by,
+                    qty=1,
+                    added_by=str(interaction.user),
+                    attack=self.state.attack,
+                    delay=self.state.delay,
+                    effects=self.state.effects,
+                    ac=self.state.ac,
+                    upload_message_id=message.id
+                )
+    
+                embed = discord.Embed(title=f"{self.state.item_name}", color=discord.Color.blue())
+                embed.set_image(url=cdn_url)
+    
+                await interaction.response.send_message(
+                    content=f"✅ Added **{self.state.item_name}** to the Guild Bank (manual image created).",
+                    embed=embed,
+                    ephemeral=True
+                )
+    
+        self.stop()
 
 
 #-----IMAGE UPLOAD ----
@@ -790,18 +1038,18 @@ class ImageDetailsModal(discord.ui.Modal):
           
         # Handle the image
         image_url = None
-        if self.view and getattr(self.view, "image", None):
+        if self.view and self.view.state.image:
             # If image is bytes, upload directly
-            if isinstance(self.view.image, (bytes, bytearray)):
-                file = discord.File(io.BytesIO(self.view.image), filename=f"{item_name}.png")
+            if isinstance(self.view.state.image, (bytes, bytearray)):
+                file = discord.File(io.BytesIO(self.view.state.image), filename=f"{item_name}.png")
                 message = await upload_channel.send(file=file, content=f"Uploaded by {added_by}")
                 image_url = message.attachments[0].url
         
             # If image is already a URL (string)
-            elif isinstance(self.view.image, str):
+            elif isinstance(self.view.state.image, str):
                 # Download and re-upload so it’s permanent in your upload-log
                 async with aiohttp.ClientSession() as session:
-                    async with session.get(self.view.image) as resp:
+                    async with session.get(self.view.state.image) as resp:
                         if resp.status == 200:
                             data = await resp.read()
                             file = discord.File(io.BytesIO(data), filename=f"{item_name}.png")
@@ -824,7 +1072,7 @@ class ImageDetailsModal(discord.ui.Modal):
 
         if self.is_edit and not image_url:
             image_url = self.item_row["image"] 
-			
+            
         if not self.is_edit and not image_url:
             await modal_interaction.response.send_message(
                 "❌ No image provided. Please attach or send an image.", ephemeral=True
@@ -863,68 +1111,70 @@ class ImageDetailsModal(discord.ui.Modal):
             await modal_interaction.response.send_message(
                 f"✅ Image item **{item_name}** added to the guild bank!", ephemeral=True
             )
+            if self.view:
+                self.view.stop()
 
 
 
 # ------ITEM DETAILS ----
 class ItemDetailsModal(discord.ui.Modal):
     def __init__(self, parent_view):
-        super().__init__(title=f"{parent_view.type} Details")
+        super().__init__(title=f"{parent_view.state.type} Details")
         
         self.parent_view = parent_view
         
         self.item_name = discord.ui.TextInput(
-                label="Item Name", placeholder="Example: Flowing Black Silk Sash", default=parent_view.item_name, required=True
+                label="Item Name", placeholder="Example: Flowing Black Silk Sash", default=parent_view.state.item_name, required=True
         )
         self.add_item(self.item_name)
         
         # Weapon ATTACK/DELAY
-        if parent_view.type == "Weapon":
+        if parent_view.state.type == "Weapon":
 
             self.attack = discord.ui.TextInput(
-                label="Damage", placeholder="Example: 7", default=parent_view.attack, required=False
+                label="Damage", placeholder="Example: 7", default=parent_view.state.attack, required=False
             )
             self.delay = discord.ui.TextInput(
-                label="Delay", placeholder="Example: 28", default=parent_view.delay, required=False
+                label="Delay", placeholder="Example: 28", default=parent_view.state.delay, required=False
             )
             self.add_item(self.attack)
             self.add_item(self.delay)
 
 
         # Equipment AC
-        if parent_view.type == "Equipment":
+        if parent_view.state.type == "Equipment":
 
             self.ac = discord.ui.TextInput(
-                label="Armor Class", placeholder="Example: 15", default=parent_view.ac, required=True
+                label="Armor Class", placeholder="Example: 15", default=parent_view.state.ac, required=True
             )
             self.add_item(self.ac)
 
          
-        if parent_view.type == "Consumable":
+        if parent_view.state.type == "Consumable":
          # STATS
             self.stats = discord.ui.TextInput(
-                label="Stats", default=parent_view.stats, placeholder="Example: STR:+1 STA:+3 CHA:-1", required=False, style=discord.TextStyle.paragraph
+                label="Stats", default=parent_view.state.stats, placeholder="Example: STR:+1 STA:+3 CHA:-1", required=False, style=discord.TextStyle.paragraph
             )
     
         #  EFFECTS
 
             self.effects = discord.ui.TextInput(
-                label="Effects", default=parent_view.effects, placeholder="Minor Serum of Dexerity: increases dex by 5 for 1 hour", required=False, style=discord.TextStyle.paragraph
+                label="Effects", default=parent_view.state.effects, placeholder="Minor Serum of Dexerity: increases dex by 5 for 1 hour", required=False, style=discord.TextStyle.paragraph
             )  
 
             self.add_item(self.stats)
             self.add_item(self.effects)
 
-        if self.parent_view.type in ("Crafting","Misc"):
+        if self.parent_view.state.type in ("Crafting","Misc"):
         # STATS
             self.stats = discord.ui.TextInput(
-                label="Info", default=parent_view.stats, placeholder="Basic information about the item", required=False, style=discord.TextStyle.paragraph
+                label="Info", default=parent_view.state.stats, placeholder="Basic information about the item", required=False, style=discord.TextStyle.paragraph
             )
     
         #  EFFECTS
 
             self.effects = discord.ui.TextInput(
-                label="Effects", default=parent_view.effects, placeholder="Basic information if the item has an effect", required=False, style=discord.TextStyle.paragraph
+                label="Effects", default=parent_view.state.effects, placeholder="Basic information if the item has an effect", required=False, style=discord.TextStyle.paragraph
             )
                         
             self.add_item(self.stats)
@@ -933,10 +1183,10 @@ class ItemDetailsModal(discord.ui.Modal):
         
 
         self.weight = discord.ui.TextInput(
-                    label="Weight", default=parent_view.weight, placeholder="Example: 1.0", required=False
+                    label="Weight", default=parent_view.state.weight, placeholder="Example: 1.0", required=False
         )
         self.donated_by = discord.ui.TextInput(
-                label="Donated By", default=parent_view.donated_by, placeholder="Example:Thieron or Raid", required=False
+                label="Donated By", default=parent_view.state.donated_by, placeholder="Example:Thieron or Raid", required=False
         )
 
        
@@ -946,20 +1196,20 @@ class ItemDetailsModal(discord.ui.Modal):
 
     async def on_submit(self, interaction: discord.Interaction):
         # Save values back to the view
-        self.parent_view.item_name = self.item_name.value
-        self.parent_view.weight = self.weight.value
-        self.parent_view.donated_by = self.donated_by.value or "Anonymous"
-
-        if self.parent_view.type == "Weapon":
-            self.parent_view.attack = self.attack.value
-            self.parent_view.delay = self.delay.value
-        if self.parent_view.type == "Equipment":
-            self.parent_view.ac = self.ac.value
+        self.parent_view.state.item_name = self.item_name.value
+        self.parent_view.state.weight = self.weight.value
+        self.parent_view.state.donated_by = self.donated_by.value or "Anonymous"
+
+        if self.parent_view.state.type == "Weapon":
+            self.parent_view.state.attack = self.attack.value
+            self.parent_view.state.delay = self.delay.value
+        if self.parent_view.state.type == "Equipment":
+            self.parent_view.state.ac = self.ac.value
         
-        if self.parent_view.type in ("Crafting", "Consumable","Misc"):
+        if self.parent_view.state.type in ("Crafting", "Consumable","Misc"):
       
-            self.parent_view.stats = self.stats.value
-            self.parent_view.effects = self.effects.value
+            self.parent_view.state.stats = self.stats.value
+            self.parent_view.state.effects = self.effects.value
 
 
         await interaction.response.send_message(
@@ -969,21 +1219,21 @@ class ItemDetailsModal(discord.ui.Modal):
             
 class ItemDetailsModal2(discord.ui.Modal):
     def __init__(self, parent_view):
-        super().__init__(title=f"{parent_view.type} Details")
+        super().__init__(title=f"{parent_view.state.type} Details")
         
         self.parent_view = parent_view
 
          #  STATS
-        if parent_view.type == "Weapon" or "Equipment" or "Consumable":
+        if parent_view.state.type == "Weapon" or "Equipment" or "Consumable":
 
             self.stats = discord.ui.TextInput(
-                label="Stats", default=parent_view.stats, placeholder="Example: STR:+3 WIS:+4 INT:-1", required=False, style=discord.TextStyle.paragraph
+                label="Stats", default=parent_view.state.stats, placeholder="Example: STR:+3 WIS:+4 INT:-1", required=False, style=discord.TextStyle.paragraph
             )
     
         #  EFFECTS
 
             self.effects = discord.ui.TextInput(
-                label="Effects", default=parent_view.effects, placeholder="Example: Lesser Spellshield, ", required=False, style=discord.TextStyle.paragraph
+                label="Effects", default=parent_view.state.effects, placeholder="Example: Lesser Spellshield, ", required=False, style=discord.TextStyle.paragraph
             )
 
             
@@ -994,9 +1244,9 @@ class ItemDetailsModal2(discord.ui.Modal):
 
     async def on_submit(self, interaction: discord.Interaction):
         # Save values back to the view   
-        if self.parent_view.type == "Weapon" or "Equipment" or"Consumable":
-            self.parent_view.stats = self.stats.value
-            self.parent_view.effects = self.effects.value
+        if self.parent_view.state.type == "Weapon" or "Equipment" or"Consumable":
+            self.parent_view.state.stats = self.stats.value
+            self.parent_view.state.effects = self.effects.value
 
         await interaction.response.send_message(
             "✅ Details saved. Click Submit when ready, or Add Required Details.", ephemeral=True
@@ -1188,6 +1438,7 @@ class RemoveItemModal(discord.ui.Modal, title="Remove Item"):
                     str(interaction.user),
                     self.reason.value
                 )
+            usable_index.remove(interaction.guild.id, self.item["id"])
 
             await interaction.response.send_message(
                 f"🗑️ **{self.item['name']}** was removed from the Guild Bank.\n"
@@ -1222,6 +1473,11 @@ async def view_bank(interaction: discord.Interaction):
 
     await interaction.response.defer(thinking=True)
 
+    # Stored image URLs expire; swap them for freshly signed ones in one batch
+    urls = await attachment_urls.refresh(
+        [u for row in rows for u in (row.get('image'), row.get('created_images'))]
+    )
+
     TYPE_COLORS = {
         "weapon": discord.Color.red(),
         "equipment": discord.Color.blue(),
@@ -1248,12 +1504,12 @@ async def view_bank(interaction: discord.Interaction):
                             
         # Handle uploaded images (URL)
         if row.get('image'):
-            embed.set_image(url=row['image'])
+            embed.set_image(url=urls.get(row['image'], row['image']))
             return embed, None
 
               # Handle uploaded created_images (URL)
         if row.get('created_images'):
-            embed.set_image(url=row['created_images'])
+            embed.set_image(url=urls.get(row['created_images'], row['created_images']))
             return embed, None
 
     # Send embeds
@@ -1283,12 +1539,16 @@ async def view_bank(interaction: discord.Interaction):
 ])
 async def add_item(interaction: discord.Interaction, type: str, image: discord.Attachment = None):
     view = ItemEntryView(interaction.user, type=type, db_pool=db_pool)
-    active_views[interaction.user.id] = view  # Track this view
+
+    # Starting a new entry abandons the user's previous one
+    previous = active_views.pop(interaction.user.id)
+    if previous:
+        previous.stop()
+    active_views.set(interaction.user.id, view)  # Track this view
 
     # If an image was uploaded, attach it to the view
     if image:
-        view.image = image.url
-        view.waiting_for_image = False
+        view.state.image = image.url
         # Optional: open the minimal modal for donated_by and item name
         await interaction.response.send_modal(ImageDetailsModal(interaction, view=view))
     else:
@@ -1319,13 +1579,13 @@ async def edit_item(interaction: discord.Interaction, item_name: str):
     if item.get("created_images"):
         await interaction.response.defer(ephemeral=True)
         view = ItemEntryView(
-	        db_pool=db_pool,
-	        author=interaction.user,
-	        type=type,
-	        item_id=item["id"],
-	        existing_data=item,
-	        is_edit=True
-	    )
+            db_pool=db_pool,
+            author=interaction.user,
+            type=type,
+            item_id=item["id"],
+            existing_data=item,
+            is_edit=True
+        )
 
     # Let the user know this is edit mode
     await interaction.followup.send(
@@ -1362,6 +1622,95 @@ async def remove_item(interaction: discord.Interaction, item_name: str):
 
 
 
+# ---------- /usable_items Command ----------
+
+USABLE_LIST_LIMIT = 3900
+
+@bot.tree.command(name="usable_items", description="Banked items a class/race can use in a slot.")
+@app_commands.describe(class_="Your class", race="Your race", slot="Equipment slot")
+@app_commands.rename(class_="class")
+@app_commands.choices(
+    class_=[app_commands.Choice(name=c, value=c) for c in CLASS_OPTIONS],
+    race=[app_commands.Choice(name=r, value=r) for r in RACE_OPTIONS],
+    slot=[app_commands.Choice(name=s, value=s) for s in EQUIPMENT_SUBTYPES]
+)
+async def usable_items(interaction: discord.Interaction, class_: str = None, race: str = None, slot: str = None):
+    if not (class_ or race or slot):
+        await interaction.response.send_message("⚠️ Pick at least one of class, race or slot.", ephemeral=True)
+        return
+
+    matches = await usable_index.match(
+        interaction.guild.id,
+        slot=to_mask([slot], EQUIPMENT_SUBTYPES) if slot else 0,
+        class_=to_mask([class_], CLASS_OPTIONS) if class_ else 0,
+        race=to_mask([race], RACE_OPTIONS) if race else 0
+    )
+
+    label = " ".join(v for v in (class_, race, slot) if v)
+    if not matches:
+        await interaction.response.send_message(f"No banked items match **{label}**.", ephemeral=True)
+        return
+
+    lines = []
+    size = 0
+    for _, name in sorted(matches, key=lambda m: m[1] or ""):
+        line = f"• {name}\n"
+        if size + len(line) > USABLE_LIST_LIMIT:
+            lines.append(f"…and {len(matches) - len(lines)} more")
+            break
+        lines.append(line)
+        size += len(line)
+
+    embed = discord.Embed(
+        title=f"🛡️ Usable by {label} ({len(matches)})",
+        description="".join(lines),
+        color=discord.Color.blue()
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+
+# ---------- /top_items Command ----------
+
+STAT_LABELS = {
+    "str": "STR", "sta": "STA", "agi": "AGI", "dex": "DEX", "wis": "WIS", "int": "INT", "cha": "CHA",
+    "hp": "HP", "mana": "Mana", "ac": "AC", "damage": "Damage", "delay": "Delay", "ratio": "Damage/Delay ratio",
+}
+
+@bot.tree.command(name="top_items", description="Banked items ranked by a stat.")
+@app_commands.describe(stat="Stat to rank by", count="How many items to show")
+@app_commands.choices(stat=[app_commands.Choice(name=STAT_LABELS[c], value=c) for c in STAT_COLUMNS])
+async def top_items(interaction: discord.Interaction, stat: str, count: app_commands.Range[int, 1, 50] = 10):
+    # stat comes from the fixed choices above, so it is safe to splice into the query
+    order = "ASC" if stat in LOWER_IS_BETTER else "DESC"
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(f'''
+            SELECT i.name, i.slot, s."{stat}" AS value
+            FROM inventory_stats s
+            JOIN inventory i ON i.id = s.item_id
+            WHERE s.guild_id=$1 AND s."{stat}" IS NOT NULL AND i.qty >= 1
+            ORDER BY s."{stat}" {order}, i.name
+            LIMIT $2
+        ''', interaction.guild.id, count)
+
+    label = STAT_LABELS[stat]
+    if not rows:
+        await interaction.response.send_message(f"No banked items list **{label}**.", ephemeral=True)
+        return
+
+    lines = [
+        f"{n}. **{r['name']}** " + (f"({r['slot']}) " if r['slot'] else "") + f"— {r['value']:g}"
+        for n, r in enumerate(rows, 1)
+    ]
+    embed = discord.Embed(
+        title=f"🏆 Top items by {label}",
+        description="\n".join(lines),
+        color=discord.Color.gold()
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+
 @bot.tree.command(name="view_itemhistory", description="View guild item donation stats.")
 async def view_itemhistory(interaction: discord.Interaction):
     guild_id = interaction.guild.id
@@ -1752,11 +2101,23 @@ async def view_donations(interaction: discord.Interaction):
 
 # ---------------- Bot Setup ----------------
 
+@tasks.loop(minutes=5)
+async def report_active_views():
+    expired = active_views.purge()
+    print(f"active_views: {len(active_views)} live, {expired} expired")
+
+
 @bot.event
 async def on_ready():
     global db_pool
     if db_pool is None:
         db_pool = await asyncpg.create_pool(DATABASE_URL)
+        await init_db(db_pool)
+
+    if not report_active_views.is_running():
+        report_active_views.start()
+    if not backfill_item_stats.is_running():
+        backfill_item_stats.start()
     
     try:
         synced = await bot.tree.sync()
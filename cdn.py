@@ -0,0 +1,110 @@
+import time
+from urllib.parse import urlsplit, parse_qs
+
+import discord
+from discord.http import Route
+
+# Discord signs attachment URLs with an expiry (the `ex` query parameter, hex
+# unix seconds). The message an attachment belongs to is the source of truth;
+# stored URLs are only a hint that gets swapped for a fresh one before use.
+
+REFRESH_BATCH_SIZE = 50       # the refresh endpoint takes at most 50 URLs per call
+REFRESH_MARGIN = 60 * 60      # treat links that expire within the hour as stale
+CDN_HOSTS = ("cdn.discordapp.com", "media.discordapp.net")
+
+
+def attachment_key(url):
+    """Stable part of an attachment URL: the path, without host or signature."""
+    return urlsplit(url).path
+
+
+def url_expiry(url):
+    """Unix time a signed attachment URL expires, or None if it isn't signed."""
+    parts = urlsplit(url)
+    if parts.hostname not in CDN_HOSTS:
+        return None
+    ex = parse_qs(parts.query).get("ex")
+    if not ex:
+        return None
+    try:
+        return int(ex[0], 16)
+    except ValueError:
+        return None
+
+
+def is_stale(url, now=None):
+    expires_at = url_expiry(url)
+    if expires_at is None:
+        return False
+    return expires_at - REFRESH_MARGIN <= (now or time.time())
+
+
+class AttachmentURLCache:
+    """
+    Fresh attachment URLs, refreshed in batches through the
+    attachments/refresh-urls endpoint and kept until shortly before they expire.
+    """
+
+    def __init__(self, http, max_size=10000):
+        self.http = http
+        self.max_size = max_size
+        self._fresh = {}  # attachment_key -> refreshed url
+
+    def get(self, url, now=None):
+        """Cached fresh version of `url`, or None."""
+        fresh = self._fresh.get(attachment_key(url))
+        if fresh is not None and not is_stale(fresh, now):
+            return fresh
+        return None
+
+    def remember(self, url):
+        """Cache a URL known to be fresh, e.g. one read from a fetched message."""
+        if url_expiry(url) is None:
+            return
+        self._fresh.pop(attachment_key(url), None)
+        self._fresh[attachment_key(url)] = url
+        if len(self._fresh) > self.max_size:
+            now = time.time()
+            for key in [k for k, u in self._fresh.items() if is_stale(u, now)]:
+                del self._fresh[key]
+            while len(self._fresh) > self.max_size:
+                del self._fresh[next(iter(self._fresh))]
+
+    async def refresh(self, urls):
+        """
+        Map each URL to one that is safe to embed now. URLs that are not
+        signed Discord attachments, or that could not be refreshed, map to themselves.
+        """
+        now = time.time()
+        result = {}
+        to_refresh = []
+        for url in urls:
+            if not url or url in result:
+                continue
+            if not is_stale(url, now):
+                result[url] = url
+                continue
+            cached = self.get(url, now)
+            if cached:
+                result[url] = cached
+            else:
+                result[url] = url
+                to_refresh.append(url)
+
+        for i in range(0, len(to_refresh), REFRESH_BATCH_SIZE):
+            batch = to_refresh[i:i + REFRESH_BATCH_SIZE]
+            try:
+                data = await self.http.request(
+                    Route("POST", "/attachments/refresh-urls"),
+                    json={"attachment_urls": batch}
+                )
+            except discord.HTTPException as e:
+                print(f"Attachment URL refresh failed for {len(batch)} URLs: {e}")
+                continue
+            by_key = {attachment_key(url): url for url in batch}
+            for entry in data.get("refreshed_urls", []):
+                original = by_key.get(attachment_key(entry["original"]))
+                if original:
+                    self.remember(entry["refreshed"])
+                    result[original] = entry["refreshed"]
+        return result
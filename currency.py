@@ -0,0 +1,72 @@
+# ----------------- Currency Helpers -----------------
+# 1 Platinum = 100 Gold = 10,000 Silver = 1,000,000 Copper
+# 1 Gold = 100 Silver = 10,000 Copper
+# 1 Silver = 100 Copper
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COPPER_PER_SILVER = 100
+COPPER_PER_GOLD = 100 * 100
+COPPER_PER_PLAT = 100 * 100 * 100
+
+
+# Convert from 4-part currency to total copper
+def currency_to_copper(plat=0, gold=0, silver=0, copper=0):
+    total_copper = (
+        plat * COPPER_PER_PLAT +    # Plat to Copper
+        gold * COPPER_PER_GOLD +    # Gold to Copper
+        silver * COPPER_PER_SILVER +  # Silver to Copper
+        copper                      # Copper
+    )
+    return total_copper
+
+
+# Convert total copper back to 4-part currency
+def copper_to_currency(total_copper):
+    plat, remainder = divmod(total_copper, COPPER_PER_PLAT)
+    gold, remainder = divmod(remainder, COPPER_PER_GOLD)
+    silver, copper = divmod(remainder, COPPER_PER_SILVER)
+    return plat, gold, silver, copper
+
+
+def format_currency(total_copper):
+    plat, gold, silver, copper = copper_to_currency(total_copper)
+    return f"{plat}p {gold}g {silver}s {copper}c"
+
+
+# Batch versions for history pages and exports
+def copper_to_currency_many(values):
+    """
+    Split many copper totals at once.
+    Takes a list, an array('q') or a NumPy array and returns four columns
+    (plat, gold, silver, copper). With NumPy installed the columns are arrays
+    computed in one vectorized pass, otherwise lists.
+    """
+    if np is not None:
+        totals = np.asarray(values, dtype=np.int64)
+        plat, remainder = np.divmod(totals, COPPER_PER_PLAT)
+        gold, remainder = np.divmod(remainder, COPPER_PER_GOLD)
+        silver, copper = np.divmod(remainder, COPPER_PER_SILVER)
+        return plat, gold, silver, copper
+
+    plat, gold, silver, copper = [], [], [], []
+    for total_copper in values:
+        p, remainder = divmod(total_copper, COPPER_PER_PLAT)
+        g, remainder = divmod(remainder, COPPER_PER_GOLD)
+        s, c = divmod(remainder, COPPER_PER_SILVER)
+        plat.append(p)
+        gold.append(g)
+        silver.append(s)
+        copper.append(c)
+    return plat, gold, silver, copper
+
+
+def format_currency_many(values):
+    """Format many copper totals as "{p}p {g}g {s}s {c}c" strings."""
+    plat, gold, silver, copper = copper_to_currency_many(values)
+    if np is not None:
+        plat, gold, silver, copper = plat.tolist(), gold.tolist(), silver.tolist(), copper.tolist()
+    return [f"{p}p {g}g {s}s {c}c" for p, g, s, c in zip(plat, gold, silver, copper)]
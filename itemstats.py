@@ -0,0 +1,123 @@
+import re
+
+# Structured numbers pulled out of the free-text stats/ac/attack/delay fields
+# that ItemDetailsModal and ItemDetailsModal2 collect. The text stays the
+# source of truth; these are derived, so bump PARSER_VERSION when the parsing
+# changes and the backfill re-parses every row.
+
+PARSER_VERSION = 2
+
+# stat column -> names players write it as, upper-cased
+STAT_ALIASES = {
+    "str": ("STR", "STRENGTH"),
+    "sta": ("STA", "STAMINA"),
+    "agi": ("AGI", "AGILITY"),
+    "dex": ("DEX", "DEXTERITY"),
+    "wis": ("WIS", "WISDOM"),
+    "int": ("INT", "INTELLIGENCE"),
+    "cha": ("CHA", "CHARISMA"),
+    "hp": ("HP", "HEALTH", "HIT POINTS", "HITPOINTS"),
+    "mana": ("MANA", "MP"),
+}
+
+# Every column in inventory_stats, in table order
+STAT_COLUMNS = tuple(STAT_ALIASES) + ("ac", "damage", "delay", "ratio")
+
+# Columns where the smallest value is the best one
+LOWER_IS_BETTER = {"delay"}
+
+# Anything bigger is a typo, and wouldn't fit inventory_stats' INT columns anyway
+MAX_STAT_VALUE = 100000
+
+_NAME_TO_STAT = {alias: stat for stat, aliases in STAT_ALIASES.items() for alias in aliases}
+# Longest names first so HP doesn't eat HITPOINTS
+_NAMES = "|".join(sorted((re.escape(n).replace(r"\ ", r"\s+") for n in _NAME_TO_STAT), key=len, reverse=True))
+# Stats text splits into known stat names, numbers, other words (resists,
+# effects: "SV FIRE +10", "Haste +20") and separators. ':' and '=' are dropped.
+_TOKEN = re.compile(
+    rf"(?P<name>(?<![A-Za-z])(?:{_NAMES})(?![A-Za-z]))"
+    r"|(?P<number>[+-]?\s*\d+)"
+    r"|(?P<word>[A-Za-z][A-Za-z']*)"
+    r"|(?P<sep>[^\s:=])",
+    re.IGNORECASE
+)
+_NUMBER = re.compile(r"[+-]?\d+(?:\.\d+)?")
+
+
+def _first_number(text):
+    match = _NUMBER.search(text or "")
+    return float(match.group()) if match else None
+
+
+def _in_range(value):
+    return value is not None and abs(value) <= MAX_STAT_VALUE
+
+
+def _tokenize(text):
+    return [(match.lastgroup, match.group()) for match in _TOKEN.finditer(text)]
+
+
+def _clauses(tokens):
+    """Split tokens at separators (",", ";", "|", ...)."""
+    clause = []
+    for token in tokens:
+        if token[0] == "sep":
+            if clause:
+                yield clause
+            clause = []
+        else:
+            clause.append(token)
+    if clause:
+        yield clause
+
+
+def _value_first(clause):
+    """
+    Whether a clause is written "+3 STR" rather than "STR +3". Decided by its
+    first stat name: value-first only if the clause starts with a number right
+    before it, so the number of a word ("SV FIRE +10 STR +5") is never taken.
+    """
+    for i, (kind, _) in enumerate(clause):
+        if kind == "name":
+            return i == 1 and clause[0][0] == "number"
+    return False
+
+
+def parse_stat_text(text):
+    """{stat: total} for the stat names in `text` that have a number next to them."""
+    totals = {}
+    for clause in _clauses(_tokenize(text or "")):
+        offset = -1 if _value_first(clause) else 1
+        for i, (kind, name) in enumerate(clause):
+            if kind != "name" or not 0 <= i + offset < len(clause):
+                continue
+            other_kind, value = clause[i + offset]
+            if other_kind == "number":
+                stat = _NAME_TO_STAT[" ".join(name.upper().split())]
+                totals[stat] = totals.get(stat, 0) + int(value.replace(" ", ""))
+    return totals
+
+
+def parse_item_stats(stats=None, ac=None, attack=None, delay=None):
+    """
+    Dict of STAT_COLUMNS -> number (or None) for one item.
+    Repeated stats add up; ratio is damage / delay for weapons with both.
+    Values beyond MAX_STAT_VALUE are dropped as None.
+    """
+    result = dict.fromkeys(STAT_COLUMNS)
+    result.update(parse_stat_text(stats))
+
+    result["ac"] = _first_number(ac)
+    result["damage"] = _first_number(attack)
+    result["delay"] = _first_number(delay)
+    for column in ("ac", "damage", "delay"):
+        if not _in_range(result[column]):
+            result[column] = None
+        elif result[column].is_integer():
+            result[column] = int(result[column])
+    if result["damage"] and result["delay"] and result["delay"] > 0:
+        result["ratio"] = round(result["damage"] / result["delay"], 4)
+    for stat in STAT_ALIASES:
+        if not _in_range(result[stat]):
+            result[stat] = None
+    return result
@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+
+# Runs bot.py as several processes, each owning a contiguous range of shards.
+# All shared state lives in Postgres, so processes never talk to each other.
+
+BOT_PROCESSES = int(os.getenv("BOT_PROCESSES", "1"))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", str(BOT_PROCESSES)))
+RESTART_DELAY = 5        # seconds before restarting a crashed process
+MAX_RESTART_DELAY = 300  # cap for the exponential backoff
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+
+def shard_ranges(shard_count, processes):
+    """Split shard ids 0..shard_count-1 into `processes` contiguous ranges."""
+    processes = max(1, min(processes, shard_count))
+    base, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for i in range(processes):
+        size = base + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+def start_worker(shard_ids):
+    env = dict(os.environ)
+    env["SHARD_COUNT"] = str(SHARD_COUNT)
+    env["SHARD_IDS"] = ",".join(str(s) for s in shard_ids)
+    print(f"Starting worker for shards {shard_ids} of {SHARD_COUNT}")
+    return subprocess.Popen([sys.executable, BOT_SCRIPT], env=env)
+
+
+def main():
+    workers = [
+        {"shards": shard_ids, "proc": start_worker(shard_ids), "started": time.monotonic(),
+         "delay": RESTART_DELAY, "restart_at": None}
+        for shard_ids in shard_ranges(SHARD_COUNT, BOT_PROCESSES)
+    ]
+
+    stopping = False
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for w in workers:
+            if w["proc"] is not None and w["proc"].poll() is None:
+                w["proc"].send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    while not stopping:
+        now = time.monotonic()
+        for w in workers:
+            proc = w["proc"]
+            if proc is not None and proc.poll() is not None:
+                # A worker that ran for a while gets a fresh backoff
+                if now - w["started"] > MAX_RESTART_DELAY:
+                    w["delay"] = RESTART_DELAY
+                print(f"Worker for shards {w['shards']} exited with code {proc.returncode}, restarting in {w['delay']}s")
+                w["proc"] = None
+                w["restart_at"] = now + w["delay"]
+                w["delay"] = min(w["delay"] * 2, MAX_RESTART_DELAY)
+            elif proc is None and now >= w["restart_at"]:
+                w["proc"] = start_worker(w["shards"])
+                w["started"] = now
+        time.sleep(1)
+
+    for w in workers:
+        if w["proc"] is not None:
+            try:
+                w["proc"].wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                w["proc"].kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Per-guild columnar index of item bitmasks: one array per column, all aligned
+# by position with the item ids. A lookup ANDs every column against the wanted
+# bits in one pass (vectorized when NumPy is installed) without touching the DB.
+
+COLUMNS = ("slot", "class", "race")
+
+
+class GuildColumns:
+    def __init__(self):
+        self.ids = array("q")
+        self.names = []
+        self.masks = {column: array("q") for column in COLUMNS}
+        self.positions = {}  # item id -> position in the arrays
+
+    def __len__(self):
+        return len(self.ids)
+
+    def upsert(self, item_id, name, masks):
+        pos = self.positions.get(item_id)
+        if pos is None:
+            self.positions[item_id] = len(self.ids)
+            self.ids.append(item_id)
+            self.names.append(name)
+            for column in COLUMNS:
+                self.masks[column].append(masks[column])
+            return
+        self.names[pos] = name
+        for column in COLUMNS:
+            self.masks[column][pos] = masks[column]
+
+    def remove(self, item_id):
+        # Swap the last item into the hole so the arrays stay dense
+        pos = self.positions.pop(item_id, None)
+        if pos is None:
+            return
+        last = len(self.ids) - 1
+        if pos != last:
+            moved_id = self.ids[last]
+            self.ids[pos] = moved_id
+            self.names[pos] = self.names[last]
+            for column in COLUMNS:
+                self.masks[column][pos] = self.masks[column][last]
+            self.positions[moved_id] = pos
+        self.ids.pop()
+        self.names.pop()
+        for column in COLUMNS:
+            self.masks[column].pop()
+
+    def match(self, wanted):
+        """(id, name) of every item whose mask overlaps wanted[column] for each filtered column."""
+        filters = [(column, bits) for column, bits in wanted.items() if bits]
+        if not self.ids:
+            return []
+        if np is not None:
+            # frombuffer views share memory with the arrays; they are gone
+            # before the next append, which could otherwise raise BufferError
+            hit = np.ones(len(self.ids), dtype=bool)
+            for column, bits in filters:
+                hit &= (np.frombuffer(self.masks[column], dtype=np.int64) & bits) != 0
+            positions = np.flatnonzero(hit).tolist()
+        else:
+            positions = range(len(self.ids))
+            for column, bits in filters:
+                col = self.masks[column]
+                positions = [i for i in positions if col[i] & bits]
+        return [(self.ids[i], self.names[i]) for i in positions]
+
+
+class MaskIndex:
+    """
+    Guild id -> GuildColumns, loaded on first lookup and kept current by
+    calling `upsert`/`remove` on every write. Writes that land while a guild
+    is loading bump its generation, and the load starts over.
+    """
+
+    def __init__(self, fetch_rows):
+        # fetch_rows(guild_id) -> rows with id, name, slot_mask, class_mask, race_mask
+        self.fetch_rows = fetch_rows
+        self._guilds = {}
+        self._generation = {}
+
+    def _changed(self, guild_id):
+        self._generation[guild_id] = self._generation.get(guild_id, 0) + 1
+
+    async def get(self, guild_id):
+        columns = self._guilds.get(guild_id)
+        while columns is None:
+            generation = self._generation.get(guild_id, 0)
+            rows = await self.fetch_rows(guild_id)
+            if guild_id in self._guilds:
+                return self._guilds[guild_id]
+            if self._generation.get(guild_id, 0) != generation:
+                continue
+            columns = GuildColumns()
+            for row in rows:
+                columns.upsert(row['id'], row['name'], {
+                    "slot": row['slot_mask'], "class": row['class_mask'], "race": row['race_mask']
+                })
+            self._guilds[guild_id] = columns
+        return columns
+
+    def upsert(self, guild_id, item_id, name, slot_mask, class_mask, race_mask):
+        self._changed(guild_id)
+        columns = self._guilds.get(guild_id)
+        if columns is not None:
+            columns.upsert(item_id, name, {"slot": slot_mask, "class": class_mask, "race": race_mask})
+
+    def remove(self, guild_id, item_id):
+        self._changed(guild_id)
+        columns = self._guilds.get(guild_id)
+        if columns is not None:
+            columns.remove(item_id)
+
+    async def match(self, guild_id, slot=0, class_=0, race=0):
+        columns = await self.get(guild_id)
+        return columns.match({"slot": slot, "class": class_, "race": race})
@@ -0,0 +1,76 @@
+import time
+from collections import OrderedDict
+
+
+class ExpiringRegistry:
+    """
+    Bounded key -> value store with sliding TTL expiry and LRU eviction.
+    Every `set`/`get` pushes the entry's expiry back by `ttl`, so the
+    entries stay ordered by expiry and purging only touches expired ones.
+    `on_evict(key, value)` is called for every entry dropped because it
+    expired or the registry was full, but not for explicit `pop`s.
+    """
+
+    def __init__(self, ttl, max_size, on_evict=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.on_evict = on_evict
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+
+    def __len__(self):
+        self.purge()
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def set(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self.purge()
+        while len(self._entries) > self.max_size:
+            old_key, (_, old_value) = self._entries.popitem(last=False)
+            self._evicted(old_key, old_value)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self._evicted(key, value)
+            return default
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        return value
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def discard(self, key, value):
+        """Remove `key` only if it still maps to `value`."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] is value:
+            del self._entries[key]
+
+    def purge(self):
+        """Drop every expired entry. Returns how many were dropped."""
+        now = time.monotonic()
+        dropped = 0
+        while self._entries:
+            key, (expires_at, value) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[key]
+            self._evicted(key, value)
+            dropped += 1
+        return dropped
+
+    def _evicted(self, key, value):
+        if self.on_evict:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                print(f"Error evicting {key}: {e}")
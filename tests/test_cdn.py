@@ -0,0 +1,141 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import discord
+
+import bot
+from cdn import REFRESH_BATCH_SIZE, AttachmentURLCache, is_stale
+
+
+def cdn_url(n, expires_in):
+    ex = format(int(time.time() + expires_in), "x")
+    return f"https://cdn.discordapp.com/attachments/1/{n}/item.png?ex={ex}&is=0&hm=sig"
+
+
+def renewed(url):
+    """The same attachment, signed for another day."""
+    return url.split("?")[0] + "?" + cdn_url(0, 86400).split("?")[1]
+
+
+class StubHTTP:
+    """Stands in for bot.http: records refresh-urls calls and renews every URL, or fails."""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+
+    async def request(self, route, json):
+        assert route.method == "POST" and route.path == "/attachments/refresh-urls"
+        self.batches.append(json["attachment_urls"])
+        if self.fail:
+            raise discord.HTTPException(SimpleNamespace(status=503, reason="Service Unavailable"), "down")
+        return {"refreshed_urls": [
+            {"original": url, "refreshed": renewed(url)}
+            for url in json["attachment_urls"]
+        ]}
+
+
+def test_refresh_sends_batches_of_50():
+    http = StubHTTP()
+    cache = AttachmentURLCache(http)
+    stale = [cdn_url(n, -60) for n in range(120)]
+
+    result = asyncio.run(cache.refresh(stale))
+    assert [len(batch) for batch in http.batches] == [REFRESH_BATCH_SIZE, REFRESH_BATCH_SIZE, 20]
+    assert set(result) == set(stale)
+    assert not any(is_stale(url) for url in result.values())
+
+
+def test_refresh_uses_cache_and_skips_fresh_urls():
+    http = StubHTTP()
+    cache = AttachmentURLCache(http)
+    stale = [cdn_url(n, -60) for n in range(3)]
+    fresh = cdn_url(99, 86400)
+    unsigned = "https://example.com/item.png"
+
+    first = asyncio.run(cache.refresh(stale + [fresh, unsigned]))
+    assert http.batches == [stale]
+    assert first[fresh] == fresh and first[unsigned] == unsigned
+
+    second = asyncio.run(cache.refresh(stale))
+    assert len(http.batches) == 1
+    assert second == {url: first[url] for url in stale}
+
+
+def test_refresh_failure_keeps_original_urls():
+    http = StubHTTP(fail=True)
+    cache = AttachmentURLCache(http)
+    stale = [cdn_url(n, -60) for n in range(3)]
+
+    assert asyncio.run(cache.refresh(stale)) == {url: url for url in stale}
+    assert cache.get(stale[0]) is None
+
+
+class FakeUploadChannel:
+    name = "guild-bank-upload-log"
+
+    def __init__(self, urls_by_message):
+        self.urls_by_message = urls_by_message
+        self.fetched = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def fetch_message(self, message_id):
+        self.fetched.append(message_id)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        return SimpleNamespace(attachments=[SimpleNamespace(url=self.urls_by_message[message_id])])
+
+
+class FakeInteraction:
+    def __init__(self, channel):
+        self.guild = SimpleNamespace(id=1, name="Guild", text_channels=[channel])
+        self.sent = []
+        self.channel = SimpleNamespace(send=self._send)
+        self.response = SimpleNamespace(defer=self._noop, send_message=self._noop)
+        self.followup = SimpleNamespace(send=self._noop)
+
+    async def _send(self, embeds):
+        self.sent.extend(embeds)
+
+    async def _noop(self, *args, **kwargs):
+        pass
+
+
+class FakePool:
+    def __init__(self, rows):
+        self.rows = rows
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    async def fetch(self, sql, guild_id):
+        return self.rows
+
+
+def test_view_bank_rereads_stale_links_from_upload_log(monkeypatch):
+    count = bot.STALE_FETCH_LIMIT + 5
+    stale = [cdn_url(n, -60) for n in range(count)]
+    rows = [
+        {"name": f"Item {n}", "image": url, "thumbnail": None, "upload_message_id": 1000 + n,
+         "upload_missing": False, "donated_by": None, "qty": 1}
+        for n, url in enumerate(stale)
+    ]
+    channel = FakeUploadChannel({1000 + n: renewed(url) for n, url in enumerate(stale)})
+    interaction = FakeInteraction(channel)
+    monkeypatch.setattr(bot, "db_pool", FakePool(rows))
+    monkeypatch.setattr(bot, "attachment_urls", AttachmentURLCache(StubHTTP(fail=True)))
+
+    asyncio.run(bot.view_bank.callback(interaction))
+
+    # Only the first STALE_FETCH_LIMIT are re-read, a few at a time
+    assert channel.fetched == [1000 + n for n in range(bot.STALE_FETCH_LIMIT)]
+    assert channel.max_in_flight <= bot.STALE_FETCH_CONCURRENCY
+    images = [embed.image.url for embed in interaction.sent]
+    assert images[:bot.STALE_FETCH_LIMIT] == [channel.urls_by_message[1000 + n] for n in range(bot.STALE_FETCH_LIMIT)]
+    assert images[bot.STALE_FETCH_LIMIT:] == stale[bot.STALE_FETCH_LIMIT:]
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+import bot
+
+BIGINT_MAX = 2**63 - 1
+
+
+def fake_insert(calls):
+    async def insert_funds_batch(entries):
+        calls.append(len(entries))
+        if any(entry[2] > BIGINT_MAX for entry in entries):
+            raise OverflowError("value out of int64 range")
+        return [True] * len(entries)
+    return insert_funds_batch
+
+
+def test_bad_entry_only_fails_its_own_caller(monkeypatch):
+    calls = []
+    monkeypatch.setattr(bot, "insert_funds_batch", fake_insert(calls))
+
+    async def main():
+        batcher = bot.FundsBatcher(max_batch=100, max_delay=0.01)
+        entries = [(1, "donation", 100 + i, None, None, i) for i in range(5)]
+        entries[2] = (1, "donation", BIGINT_MAX + 1, None, None, 2)
+        results = await asyncio.gather(*(batcher.submit(e) for e in entries), return_exceptions=True)
+        batcher.task.cancel()
+        return results
+
+    results = asyncio.run(main())
+    assert isinstance(results[2], OverflowError)
+    assert [r for i, r in enumerate(results) if i != 2] == [True] * 4
+    # One failed batch, then one insert per entry
+    assert calls == [5, 1, 1, 1, 1, 1]
+
+
+@pytest.mark.parametrize("total", [0, -5, bot.MAX_FUNDS_COPPER + 1])
+def test_add_funds_db_rejects_out_of_range_amounts(total):
+    with pytest.raises(ValueError):
+        asyncio.run(bot.add_funds_db(1, "donation", total, idempotency_key=None))
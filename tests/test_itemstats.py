@@ -0,0 +1,46 @@
+import pytest
+
+from itemstats import MAX_STAT_VALUE, parse_item_stats, parse_stat_text
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("STR:+3 WIS:+4 INT:-1", {"str": 3, "wis": 4, "int": -1}),
+    ("+5 STR, +10 WIS", {"str": 5, "wis": 10}),
+    ("+5 STR +10 WIS", {"str": 5, "wis": 10}),
+    ("Hit Points: 25 MANA 10", {"hp": 25, "mana": 10}),
+    ("STA: +1 STA +2", {"sta": 3}),
+    ("Intelligence: 4 INT 2", {"int": 6}),
+    ("+5 Strength, Hit Points: 25 MANA 10", {"str": 5, "hp": 25, "mana": 10}),
+])
+def test_stat_forms(text, expected):
+    assert parse_stat_text(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    # The number after a word that isn't a stat belongs to that word
+    ("SV FIRE +10 STR +5", {"str": 5}),
+    ("Haste +20 STR +5", {"str": 5}),
+    ("STR +5 SV MAGIC +10 HP +20", {"str": 5, "hp": 20}),
+])
+def test_other_values_are_not_taken(text, expected):
+    assert parse_stat_text(text) == expected
+
+
+def test_names_without_numbers_are_skipped():
+    assert parse_stat_text("STR +5 AGI") == {"str": 5}
+    assert parse_stat_text("") == {}
+    assert parse_stat_text(None) == {}
+
+
+def test_weapon_numbers_and_ratio():
+    stats = parse_item_stats("", ac="AC 15", attack="7", delay="28")
+    assert (stats["ac"], stats["damage"], stats["delay"], stats["ratio"]) == (15, 7, 28, 0.25)
+    assert parse_item_stats(attack="7", delay="0")["ratio"] is None
+
+
+def test_out_of_range_values_are_dropped():
+    stats = parse_item_stats("HP 99999999999 STR +3", attack=str(MAX_STAT_VALUE + 1), delay="20")
+    assert stats["hp"] is None
+    assert stats["str"] == 3
+    assert stats["damage"] is None
+    assert stats["ratio"] is None